@@ -1,42 +1,321 @@
 
 import requests
+import requests.adapters
+import requests.utils
 import json
-from urllib.parse import urlencode
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from urllib3.exceptions import NewConnectionError
+
+from anthill_tools.progress import Transfer, ProgressReader
+from anthill_tools.body import FileBody, DEFAULT_BLOCK_SIZE, streamable
+from anthill_tools.cache import ServiceCache
+from anthill_tools.tokens import TokenStore
+from anthill_tools.retry import RetryPolicy
+from anthill_tools.trace import Tracer
+from anthill_tools.shaping import Scheduler, scheduled
+
+
+# lines printed by concurrent uploads, deliverers and deployers stay whole
+log_lock = threading.Lock()
 
 
 def log(s):
-    print(s)
+    with log_lock:
+        print(s)
 
 
-def get(url, params=None, **kwargs):
-    try:
-        response = requests.get(url, params=params, **kwargs)
-    except requests.ConnectionError as e:
-        raise ServiceError(599, str(e))
+class Transport(object):
+    DEFAULT_TIMEOUT = (10, 300)
+    # the server may take a long time to process a big upload before it responds, so there is no read timeout
+    DEFAULT_UPLOAD_TIMEOUT = (10, None)
 
-    if response.status_code >= 300:
-        raise ServiceError(response.status_code, response.text, response)
+    def __init__(self, pool_connections=10, pool_maxsize=10, timeout=DEFAULT_TIMEOUT, keep_alive=True,
+                 block_size=DEFAULT_BLOCK_SIZE, memory_map=True, upload_timeout=DEFAULT_UPLOAD_TIMEOUT):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+        self.keep_alive = keep_alive
+        self.block_size = block_size
+        self.memory_map = memory_map
+        self.hosts = {}
 
-    return response
+        self.session = requests.Session()
+        self.mount_defaults()
 
+    def new_adapter(self, pool_maxsize):
+        return requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=pool_maxsize)
 
-def post(url, data=None, **kwargs):
-    try:
-        response = requests.post(url, data=data, **kwargs)
-    except requests.ConnectionError as e:
-        raise ServiceError(599, str(e))
+    def mount(self, prefix, adapter):
+        replaced = self.session.adapters.get(prefix)
+        self.session.mount(prefix, adapter)
 
-    if response.status_code >= 300:
-        raise ServiceError(response.status_code, response.text, response)
+        # the same adapter may still be mounted for another prefix
+        if replaced is not None and replaced not in self.session.adapters.values():
+            replaced.close()
 
-    return response
+    def mount_defaults(self):
+        adapter = self.new_adapter(self.pool_maxsize)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
 
+        if not self.keep_alive:
+            self.session.headers["Connection"] = "close"
 
-def put(url, data=None, **kwargs):
+    def mount_host(self, location, pool_maxsize):
+        parsed = urlparse(location)
+        prefix = "{0}://{1}/".format(parsed.scheme, parsed.netloc)
+        self.hosts[prefix] = pool_maxsize
+        self.mount(prefix, self.new_adapter(pool_maxsize))
+
+    def reserve(self, pool_maxsize):
+        if pool_maxsize <= self.pool_maxsize:
+            return
+
+        self.pool_maxsize = pool_maxsize
+        self.mount_defaults()
+
+        for prefix, host_maxsize in list(self.hosts.items()):
+            if host_maxsize < pool_maxsize:
+                self.hosts[prefix] = pool_maxsize
+                self.mount(prefix, self.new_adapter(pool_maxsize))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def body(self, f, offset=None, length=None, transfer=None):
+        return FileBody(f, offset, length, block_size=self.block_size, memory_map=self.memory_map,
+                        transfer=transfer)
+
+    def close(self):
+        self.session.close()
+
+
+__transport__ = None
+__transport_lock__ = threading.Lock()
+
+
+def transport():
+    global __transport__
+
+    with __transport_lock__:
+        if __transport__ is None:
+            __transport__ = Transport()
+        return __transport__
+
+
+def configure_transport(**kwargs):
+    global __transport__
+
+    with __transport_lock__:
+        if __transport__ is not None:
+            __transport__.close()
+        __transport__ = Transport(**kwargs)
+        return __transport__
+
+
+__service_cache__ = None
+
+
+def service_cache():
+    global __service_cache__
+
+    with __transport_lock__:
+        if __service_cache__ is None:
+            __service_cache__ = ServiceCache()
+        return __service_cache__
+
+
+def configure_service_cache(**kwargs):
+    global __service_cache__
+
+    with __transport_lock__:
+        __service_cache__ = ServiceCache(**kwargs)
+        return __service_cache__
+
+
+__token_store__ = None
+
+
+def token_store():
+    global __token_store__
+
+    with __transport_lock__:
+        if __token_store__ is None:
+            __token_store__ = TokenStore()
+        return __token_store__
+
+
+def configure_token_store(**kwargs):
+    global __token_store__
+
+    with __transport_lock__:
+        __token_store__ = TokenStore(**kwargs)
+        return __token_store__
+
+
+__scheduler__ = None
+
+
+def scheduler():
+    global __scheduler__
+
+    with __transport_lock__:
+        if __scheduler__ is None:
+            __scheduler__ = Scheduler()
+        return __scheduler__
+
+
+def configure_bandwidth(rate=None, stream_rate=None, policy=None, limits_file=None):
+    """
+    Limits all uploads of the process together to rate bytes per second and each of them to stream_rate,
+    or lifts the limits, picks the policy sharing the bandwidth between uploads, and forgets the transfers
+    reported before. With limits_file, the limits are taken from that JSON file whenever it changes.
+    Uploads started while there was a limit follow new limits at once.
+    """
+
+    shaper = scheduler()
+    shaper.configure(rate, stream_rate, policy)
+    shaper.reset()
+
+    if limits_file:
+        shaper.follow(limits_file)
+    else:
+        shaper.unfollow()
+
+    return shaper
+
+
+def limit_bandwidth(rate=None, stream_rate=None, policy=None, limits_file=None):
+    """
+    Same as configure_bandwidth, but if no limit, policy or limits file is given, the limits set before
+    are kept and only the transfers reported before are forgotten.
+    """
+
+    if rate is None and stream_rate is None and policy is None and limits_file is None:
+        shaper = scheduler()
+        shaper.reset()
+        return shaper
+
+    return configure_bandwidth(rate, stream_rate, policy, limits_file)
+
+
+TOKEN_EXPIRED_CODES = (401, 403)
+
+
+def token_expired(error):
+    if error.code == 401:
+        return True
+    return error.code in TOKEN_EXPIRED_CODES and "token" in str(error.message).lower()
+
+
+__retry_policy__ = None
+
+
+def retry_policy():
+    global __retry_policy__
+
+    with __transport_lock__:
+        if __retry_policy__ is None:
+            __retry_policy__ = RetryPolicy()
+        return __retry_policy__
+
+
+def configure_retry(**kwargs):
+    global __retry_policy__
+
+    with __transport_lock__:
+        __retry_policy__ = RetryPolicy(**kwargs)
+        return __retry_policy__
+
+
+__tracer__ = None
+
+
+def tracer():
+    global __tracer__
+
+    with __transport_lock__:
+        if __tracer__ is None:
+            __tracer__ = Tracer()
+        return __tracer__
+
+
+# uploads are not among them: only the callers know whether sending the same body twice is harmless
+IDEMPOTENT_METHODS = ("GET", "HEAD", "DELETE", "OPTIONS")
+
+
+def replayable(data):
+    if data is None or isinstance(data, (dict, list, tuple, str, bytes)):
+        return True
+    if hasattr(data, "rewind"):
+        return data.rewindable
+    return hasattr(data, "seek") and hasattr(data, "tell")
+
+
+def mark(data):
+    if hasattr(data, "rewind") or not hasattr(data, "tell"):
+        return None
+    return data.tell()
+
+
+def rewind(data, position):
+    if hasattr(data, "rewind"):
+        data.rewind()
+    elif position is not None:
+        data.seek(position)
+
+
+def connection_failed(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def body_size(data):
+    """
+    The size of a body about to be sent. Bodies wrapped for streaming count the bytes they pass on
+    instead, as their size is not known up front (compressed) or not exposed (shaped).
+    """
+
+    if data is None or isinstance(data, (dict, list, tuple)):
+        return None
+    if isinstance(data, (str, bytes)):
+        return len(data)
+    if hasattr(data, "sent_bytes"):
+        return None
+    return requests.utils.super_len(data)
+
+
+def traced(method, url, attributes, data, size, started, clock, attempt, response=None, error=None):
+    if hasattr(data, "sent_bytes"):
+        size = data.sent_bytes
+    elif size is None:
+        size = len(response.request.body or b"") if response is not None else 0
+
+    tracer().request(
+        started, time.monotonic() - clock, method=method, url=url,
+        status=response.status_code if response is not None else getattr(error, "code", None),
+        bytes_in=len(response.content) if response is not None else 0,
+        bytes_out=size, attempt=attempt, error=str(error) if error is not None else None,
+        **(attributes or {}))
+
+
+def send(method, url, **kwargs):
     try:
-        response = requests.put(url, data=data, **kwargs)
-    except requests.ConnectionError as e:
-        raise ServiceError(599, str(e))
+        response = transport().request(method, url, **kwargs)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        error = ServiceError(599, str(e))
+        error.not_sent = connection_failed(e)
+        raise error
 
     if response.status_code >= 300:
         raise ServiceError(response.status_code, response.text, response)
@@ -44,6 +323,66 @@ def put(url, data=None, **kwargs):
     return response
 
 
+def request(method, url, idempotent=None, retry=None, trace=None, **kwargs):
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+
+    policy = retry_policy() if retry is None else retry
+    tracing = tracer().enabled
+    data = kwargs.get("data")
+    position = mark(data)
+
+    started = time.monotonic()
+    attempt = 0
+
+    while True:
+        if tracing:
+            size = body_size(data)
+            attempt_started = time.time()
+            attempt_clock = time.monotonic()
+
+        try:
+            response = send(method, url, **kwargs)
+        except ServiceError as e:
+            if tracing:
+                traced(method, url, trace, data, size, attempt_started, attempt_clock, attempt, e.response, e)
+
+            if not policy or not replayable(data) or \
+                    not policy.should_retry(e, attempt, time.monotonic() - started, idempotent):
+                if policy and attempt:
+                    policy.stats.done(False)
+                raise
+
+            delay = policy.delay(attempt)
+            attempt += 1
+            policy.stats.retry(e.code, delay)
+
+            log("{0} {1} failed ({2}), retry {3} in {4:.1f}s...".format(
+                method, url, e.code, attempt, delay))
+
+            time.sleep(delay)
+            rewind(data, position)
+        else:
+            if tracing:
+                traced(method, url, trace, data, size, attempt_started, attempt_clock, attempt, response)
+
+            if attempt:
+                policy.stats.done(True)
+            return response
+
+
+def get(url, params=None, **kwargs):
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    return request("POST", url, data=data, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request("PUT", url, data=data, **kwargs)
+
+
 class ServiceError(Exception):
     def __init__(self, code, message, response=None):
         self.code = code
@@ -64,22 +403,58 @@ class ApplicationInfo(object):
 class Service(object):
     def __init__(self, location):
         self.location = location
+        self.environment = None
+        self.service_cache = None
+        self.service_cache_keys = None
         log("New service: {0} at {1}".format(self.ID, self.location))
 
-    def get(self, url, params):
-        params.update({
-            "access_token": Login.TOKEN,
-        })
+    @property
+    def token(self):
+        if self.environment is not None and self.environment.access_token is not None:
+            return self.environment.access_token
+        return Login.TOKEN
+
+    def authorize(self, method, kwargs):
+        token = self.token
+        if method == "POST":
+            kwargs["data"]["access_token"] = token
+        else:
+            kwargs["params"]["access_token"] = token
+        return token
 
-        result = get(self.location + "/" + url, params=params)
-        return result.json()
+    def request(self, method, url, authorized=False, **kwargs):
+        kwargs.setdefault("trace", {"service": self.ID})
+        data = kwargs.get("data")
+        position = mark(data) if authorized else None
+        refreshed = False
 
-    def post(self, url, data):
-        data.update({
-            "access_token": Login.TOKEN,
-        })
+        while True:
+            token = self.authorize(method, kwargs) if authorized else None
+
+            try:
+                return request(method, self.location + "/" + url, **kwargs)
+            except ServiceError as e:
+                if e.code == 599 and self.service_cache_keys:
+                    log("Cached location of {0} is not reachable, invalidating the cache".format(self.ID))
+                    self.service_cache.invalidate(*self.service_cache_keys)
+                    self.service_cache_keys = None
+
+                if not authorized or refreshed or not token_expired(e) or not replayable(data):
+                    raise
+
+                login = self.environment.login_service if self.environment is not None else None
+                if login is None or not login.reauth(token):
+                    raise
+
+                refreshed = True
+                rewind(data, position)
+
+    def get(self, url, params):
+        result = self.request("GET", url, authorized=True, params=params)
+        return result.json()
 
-        result = post(self.location + "/" + url, data=data)
+    def post(self, url, data, idempotent=False):
+        result = self.request("POST", url, authorized=True, data=data, idempotent=idempotent)
         return result.json()
 
 
@@ -89,6 +464,8 @@ class Discovery(Service):
     def __init__(self, location):
         super(Discovery, self).__init__(location)
         self.cache = {}
+        self.cache_key = None
+        self.environment_keys = None
 
         Services.discovery = self
 
@@ -103,7 +480,7 @@ class Discovery(Service):
 
         log("Looking for service: " + service)
 
-        response = get(self.location + "/service/" + service)
+        response = self.request("GET", "service/" + service)
         location = response.text
 
         service = Services.new_service(service, location, *args, **kwargs)
@@ -129,43 +506,100 @@ class Discovery(Service):
             else:
                 to_request.append(service)
 
+        if to_request and self.service_cache is not None:
+            locations = self.service_cache.get(self.cache_key) or {}
+
+            for service_id in list(to_request):
+                location = locations.get(service_id)
+                if not location:
+                    continue
+
+                _args, _kwargs = args.get(service_id, ([], {}))
+                service = Services.new_service(service_id, location, *_args, **_kwargs)
+                service.environment = self.environment
+                service.service_cache = self.service_cache
+                service.service_cache_keys = self.environment_keys
+                self.cache[service_id] = service
+                result[service_id] = service
+                to_request.remove(service_id)
+
+        if not to_request:
+            return result
+
         log("Looking for services: " + ",".join(to_request))
 
-        response = get(self.location + "/services/" + ",".join(to_request))
+        response = self.request("GET", "services/" + ",".join(to_request))
         response_json = response.json()
 
         for service_id, location in response_json.items():
             _args, _kwargs = args.get(service_id, ([], {}))
             service = Services.new_service(service_id, location, *_args, **_kwargs)
+            service.environment = self.environment
+            service.service_cache = self.service_cache
+            service.service_cache_keys = self.environment_keys
             self.cache[service_id] = service
             result[service_id] = service
 
+        if self.service_cache is not None:
+            self.service_cache.update(self.cache_key, response_json)
+
         return result
 
 
 class Environment(Service):
     ID = "environment"
 
-    def __init__(self, location, app_info):
+    def __init__(self, location, app_info, cache=True):
         super(Environment, self).__init__(location)
 
         self.app_info = app_info
         self.env = {}
         self.discovery = None
+        self.environment = self
+        self.access_token = None
+        self.login_service = None
+
+        if cache is True:
+            self.service_cache = service_cache()
+        elif cache:
+            self.service_cache = cache
 
         Services.env = self
 
     def init(self):
-        response = get(
-            self.location + "/" + self.app_info.app_name + "/" + self.app_info.app_version)
+        path = self.app_info.app_name + "/" + self.app_info.app_version
+        environment_key = "environment:" + self.location + "/" + path
+        discovery_key = "discovery:" + self.location + "/" + path
 
-        self.env = response.json()
+        env = None
+
+        if self.service_cache is not None:
+            env = self.service_cache.get(environment_key)
+
+        if env is None:
+            response = self.request("GET", path)
+            env = response.json()
+
+            if self.service_cache is not None:
+                self.service_cache.put(environment_key, env)
+        else:
+            log("Using cached environment response")
+
+        self.env = env
 
         try:
             self.discovery = Discovery(self.env["discovery"])
         except KeyError:
             raise ServiceError(500, "No discovery in environment info!")
 
+        self.discovery.environment = self
+        self.discovery.cache_key = discovery_key
+        self.discovery.environment_keys = (environment_key, discovery_key)
+
+        if self.service_cache is not None:
+            self.discovery.service_cache = self.service_cache
+            self.discovery.service_cache_keys = self.discovery.environment_keys
+
         log("Got environment response!")
         log("Discovery: " + self.discovery.location)
 
@@ -176,12 +610,25 @@ class Login(Service):
 
     def __init__(self, location):
         super(Login, self).__init__(location)
+        self.lock = threading.Lock()
+        self.auth_data = None
+        self.store = None
+        self.store_key = None
+
+    def set_token(self, token):
+        Login.TOKEN = token
 
-    def auth(self, credential, scopes, options):
+        environment = self.environment or Services.env
+        if environment is not None:
+            environment.access_token = token
+            environment.login_service = self
+
+    def auth(self, credential, scopes, options, cache=True):
         if not isinstance(scopes, list):
             raise ServiceError(400, "Scopes should be a list")
 
-        app_info = Services.env.app_info
+        environment = self.environment or Services.env
+        app_info = environment.app_info
 
         data = {
             "credential": credential,
@@ -192,16 +639,61 @@ class Login(Service):
 
         data.update(options)
 
-        response = post(self.location + "/auth", data=data)
+        self.auth_data = data
 
-        token = response.json()["token"]
-        Login.TOKEN = token
+        if cache is True:
+            self.store = token_store()
+        else:
+            self.store = cache or None
+
+        if self.store is not None:
+            self.store_key = TokenStore.key(
+                environment.location, app_info.gamespace, credential, options.get("username"), scopes, options)
+
+            token = self.store.get(self.store_key)
+
+            if token is not None:
+                self.set_token(token)
+                log("Authenticated with a cached token!")
+                return token
+
+        return self.authenticate()
+
+    def authenticate(self):
+        response = self.request("POST", "auth", data=dict(self.auth_data))
+        response_json = response.json()
+
+        token = response_json["token"]
+        self.set_token(token)
+
+        if self.store is not None:
+            self.store.put(self.store_key, token, response_json.get("expires_in"))
 
         log("Authenticated!")
 
         return token
 
-    def auth_dev(self, username, password, scopes, options=None):
+    def reauth(self, expired_token):
+        with self.lock:
+            if self.auth_data is None:
+                return False
+
+            if self.token != expired_token:
+                return True
+
+            if self.store is not None:
+                self.store.invalidate(self.store_key)
+
+            log("Access token has expired, authenticating again...")
+
+            try:
+                self.authenticate()
+            except ServiceError:
+                return False
+
+            return True
+
+    def auth_dev(self, username, password, scopes, options=None, cache=True):
 
         if options is None:
             options = {}
@@ -211,7 +703,7 @@ class Login(Service):
             "key": password
         })
 
-        return self.auth("dev", scopes, options)
+        return self.auth("dev", scopes, options, cache=cache)
 
 
 class Admin(Service):
@@ -228,18 +720,16 @@ class Admin(Service):
         return None
 
     def api_get(self, service, action, context):
-        result = get(self.location + "/api", params={
-            "access_token": Login.TOKEN,
+        result = self.request("GET", "api", authorized=True, params={
             "service": service,
             "context": json.dumps(context),
             "action": action
-        })
+        }, trace={"service": service, "action": action})
         return result
 
-    def api_post(self, service, action, method, context, data):
+    def api_post(self, service, action, method, context, data, idempotent=False):
 
         args = {
-            "access_token": Login.TOKEN,
             "service": service,
             "method": method,
             "context": json.dumps(context),
@@ -248,22 +738,58 @@ class Admin(Service):
 
         args.update(data)
 
-        result = post(self.location + "/api", data=args)
+        result = self.request("POST", "api", authorized=True, data=args, idempotent=idempotent,
+                              trace={"service": service, "action": "{0}:{1}".format(action, method)})
 
         return result
 
-    def api_put(self, service, action, context, data, args=None, **kwargs):
+    @staticmethod
+    def track(data, name, progress):
+        return ProgressReader(data, Transfer(name, requests.utils.super_len(data), progress))
+
+    def api_put(self, service, action, context, data, args=None, progress=None, compression=None, stream=None,
+                weight=1, idempotent=False, **kwargs):
+
+        shaper = scheduler()
+        own_stream = None
+
+        if stream is None and shaper.shaping:
+            stream = own_stream = shaper.stream(
+                os.path.basename(getattr(data, "name", "") or action), requests.utils.super_len(data), weight)
+
+        compress = compression is not None and compression.applies(data)
+
+        if not compress and streamable(data):
+            transfer = None
+
+            if progress is not None:
+                name = os.path.basename(getattr(data, "name", "") or action)
+                transfer = Transfer(name, requests.utils.super_len(data), progress)
+
+            data = transport().body(data, transfer=transfer)
+
+        elif progress is not None:
+            name = os.path.basename(getattr(data, "name", "") or action)
+            data = Admin.track(data, name, progress)
+
+        if compress:
+            data, kwargs["headers"] = compression.wrap(data, kwargs.get("headers"))
+
+        if stream is not None:
+            data = scheduled(data, stream)
 
         request_args = {
-            "access_token": Login.TOKEN,
             "service": service,
             "context": json.dumps(context),
             "action": action,
             "args": json.dumps(args) if args else "{}"
         }
 
+        kwargs.setdefault("timeout", transport().upload_timeout)
+
         try:
-            result = put(self.location + "/service/upload?" + urlencode(request_args), data=data, **kwargs)
+            result = self.request("PUT", "service/upload", authorized=True, params=request_args, data=data,
+                                  idempotent=idempotent, trace={"service": service, "action": action}, **kwargs)
         except ServiceError as e:
             if e.code == 444:
                 return e.response
@@ -272,6 +798,9 @@ class Admin(Service):
                 return e.response
 
             raise e
+        finally:
+            if own_stream is not None:
+                own_stream.close()
         return result
 
 
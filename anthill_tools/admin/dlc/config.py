@@ -0,0 +1,136 @@
+import json
+import re
+
+
+READ_SIZE = 1024 * 1024
+WHITESPACE = " \t\n\r"
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*\Z")
+
+
+class JsonStream(object):
+    """
+    Reads a JSON document from a file piece by piece. Objects can be walked member by member with
+    items(), which yields each key and expects the caller to consume its value with value() or
+    items() before continuing, so only one member value at a time is kept in memory.
+    """
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def more(self):
+        if self.eof:
+            return False
+
+        data = self.f.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+
+            if not self.more():
+                return None
+
+    def expect(self, characters):
+        c = self.peek()
+        if c is None or c not in characters:
+            raise ValueError("Expected one of '{0}' at {1}, got {2}".format(
+                characters, self.position, "end of file" if c is None else "'" + c + "'"))
+        self.position += 1
+        return c
+
+    def value(self):
+        if self.peek() is None:
+            raise ValueError("Unexpected end of file")
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # the value may continue past what was read so far
+                if not self.more():
+                    raise
+                continue
+
+            # so may a number if nothing but number characters follow it in the buffer
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                    NUMBER_TAIL.match(self.buffer, end) and self.more():
+                continue
+
+            self.position = end
+            return value
+
+    def items(self):
+        self.expect("{")
+
+        if self.peek() == "}":
+            self.position += 1
+            return
+
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("Object keys should be strings")
+
+            self.expect(":")
+            yield key
+
+            if self.expect(",}") == "}":
+                return
+
+
+def read_json(f):
+    stream = JsonStream(f)
+
+    for key in stream.items():
+        if key != "bundles":
+            stream.value()
+            continue
+
+        if stream.peek() != "{":
+            raise ValueError("bundles should be a dict")
+
+        for name in stream.items():
+            yield name, stream.value()
+
+
+def read_json_lines(f):
+    for number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        entry = json.loads(line)
+        if not isinstance(entry, dict) or "name" not in entry:
+            raise ValueError("Line {0} has no bundle name".format(number))
+
+        yield entry["name"], entry
+
+
+def read_config(location):
+    """
+    Yields (bundle name, bundle config) pairs of a configuration file while reading it. Files ending
+    with .jsonl have one bundle object with a "name" per line, anything else is a JSON document with
+    a "bundles" object.
+    """
+
+    with open(location, "r") as f:
+        if location.endswith(".jsonl"):
+            yield from read_json_lines(f)
+        else:
+            yield from read_json(f)
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import threading
+
+from anthill_tools import ServiceError
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "chunks")
+
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_AVG_SIZE = 1024 * 1024
+CHUNK_MAX_SIZE = 8 * 1024 * 1024
+READ_SIZE = CHUNK_MAX_SIZE
+
+# Chunk boundaries are content-defined: every byte is mapped through GEAR and the buffer, read as one
+# little-endian integer, is multiplied by MIX. Each byte of the product then mixes the byte at its
+# position with the WINDOW - 1 bytes before it, and a chunk ends after a run of mixed bytes matching a
+# pattern taken from BOUNDARY. Whether a position is a boundary depends only on the bytes right before
+# it, so an insertion or a change only affects the chunks around it. Mapping, mixing and searching are
+# done by bytes.translate, int multiplication and bytes.find, so the bytes are never looped over in
+# Python. As in FastCDC, up to the average size more bits have to match than after it, which keeps chunk
+# sizes close to the average.
+WINDOW = 8
+GEAR = bytes(hashlib.sha256(bytes([i])).digest()[0] for i in range(256))
+MIX = int.from_bytes(hashlib.sha256(b"mix").digest()[:WINDOW], "little") | 1
+BOUNDARY = hashlib.sha256(b"boundary").digest()
+
+UNSUPPORTED_CODES = (404, 405, 501)
+
+
+def mixed(data, previous=b""):
+    """
+    The mixed bytes of data, where previous are the bytes read before it.
+    """
+
+    previous = previous[-(WINDOW - 1):]
+    data = previous + data
+    product = int.from_bytes(data.translate(GEAR), "little") * MIX
+    return product.to_bytes(len(data) + WINDOW, "little")[len(previous):len(data)]
+
+
+def boundary(bits):
+    """
+    A translation table and a pattern matching at least that many bits of mixed bytes.
+    """
+
+    length = -(-bits // 8)
+    shift = 8 - -(-bits // length)
+    table = bytes(value >> shift for value in range(256))
+    return table, BOUNDARY[:length].translate(table)
+
+
+def cut_point(hard, easy, start, end, min_size, avg_size):
+    """
+    The end of the chunk starting at start, where data is available up to end. hard and easy are the
+    mixed bytes translated and the pattern to find in them, before and after the average size.
+    """
+
+    if end - start <= min_size:
+        return end
+
+    normal = min(start + avg_size, end)
+
+    for (data, pattern), begin, stop in ((hard, start + min_size, normal), (easy, normal, end)):
+        found = data.find(pattern, begin + 1 - len(pattern), stop)
+        if found >= 0:
+            return found + len(pattern)
+
+    return end
+
+
+def chunks(f, min_size=CHUNK_MIN_SIZE, avg_size=CHUNK_AVG_SIZE, max_size=CHUNK_MAX_SIZE):
+    bits = avg_size.bit_length() - 1
+    (hard_table, hard), (easy_table, easy) = boundary(bits + 2), boundary(bits - 2)
+    min_size = max(min_size, len(hard), len(easy))
+
+    buffer = b""
+    hard_bytes = b""
+    easy_bytes = b""
+    start = 0
+    offset = 0
+    eof = False
+
+    while True:
+        if not eof and len(buffer) - start < max_size:
+            data = f.read(READ_SIZE)
+            if data:
+                mix = mixed(data, buffer)
+                buffer = buffer[start:] + data
+                hard_bytes = hard_bytes[start:] + mix.translate(hard_table)
+                easy_bytes = easy_bytes[start:] + mix.translate(easy_table)
+                start = 0
+                continue
+            eof = True
+
+        if start >= len(buffer):
+            return
+
+        cut = cut_point((hard_bytes, hard), (easy_bytes, easy), start, min(len(buffer), start + max_size),
+                        min_size, avg_size)
+
+        chunk = buffer[start:cut]
+        start = cut
+
+        yield offset, chunk
+        offset += len(chunk)
+
+
+def chunk_hash(chunk):
+    return hashlib.sha256(chunk).hexdigest()
+
+
+class ChunkIndex(object):
+    def __init__(self, key, location=DEFAULT_LOCATION):
+        self.location = os.path.join(location, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+        self.chunks = {}
+        self.bundles = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.location, "r") as f:
+                data = json.load(f)
+                self.chunks = data.get("chunks", {})
+                self.bundles = data.get("bundles", {})
+        except (OSError, ValueError, AttributeError):
+            self.chunks = {}
+            self.bundles = {}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            os.makedirs(os.path.dirname(self.location), exist_ok=True)
+            temp_location = self.location + ".tmp"
+            with open(temp_location, "w") as f:
+                json.dump({"chunks": self.chunks, "bundles": self.bundles}, f)
+            os.replace(temp_location, self.location)
+            self.dirty = False
+
+    def known(self, hash_):
+        with self.lock:
+            return hash_ in self.chunks
+
+    def add(self, hash_, size):
+        with self.lock:
+            self.chunks[hash_] = size
+            self.dirty = True
+
+    def indexed(self, name):
+        with self.lock:
+            return name in self.bundles
+
+    def add_bundle(self, name, hash_):
+        with self.lock:
+            self.bundles[name] = hash_
+            self.dirty = True
+
+    def forget(self, hashes):
+        with self.lock:
+            for hash_ in hashes:
+                self.chunks.pop(hash_, None)
+            self.dirty = True
+
+
+class DeltaUploader(object):
+    """
+    Uploads bundles as content-defined chunks: only chunks the local index has not seen uploaded
+    before are sent, then the server assembles the bundle from the chunk manifest. If the server does
+    not support that, or no earlier version of the bundle was uploaded from here, upload() returns False
+    and the caller uploads the whole file, then calls uploaded().
+    """
+
+    def __init__(self, admin, app_name, index):
+        self.admin = admin
+        self.app_name = app_name
+        self.index = index
+        self.supported = True
+        self.lock = threading.Lock()
+
+        self.total_bytes = 0
+        self.sent_bytes = 0
+
+    @property
+    def saved_bytes(self):
+        return self.total_bytes - self.sent_bytes
+
+    def put_chunk(self, hash_, chunk):
+        self.admin.api_put("dlc", "bundle_chunk", {
+            "app_id": self.app_name,
+            "chunk_hash": hash_
+        }, data=chunk, idempotent=True)
+
+        self.index.add(hash_, len(chunk))
+
+        with self.lock:
+            self.sent_bytes += len(chunk)
+
+    def assemble(self, bundle, data_id, bundle_id, manifest):
+        return self.admin.api_post("dlc", "bundle", "assemble", {
+            "app_id": self.app_name,
+            "data_id": data_id,
+            "bundle_id": bundle_id
+        }, data={
+            "bundle_hash": bundle.hash,
+            "manifest": json.dumps([[hash_, size] for hash_, offset, size in manifest])
+        }, idempotent=True)
+
+    def uploaded(self, bundle):
+        self.index.add_bundle(bundle.name, bundle.hash)
+
+    def upload(self, bundle, data_id, bundle_id):
+        if not self.supported:
+            return False
+
+        # without an earlier version there is nothing to share chunks with, so chunking would not pay off
+        if not self.index.indexed(bundle.name):
+            return False
+
+        manifest = []
+
+        try:
+            with open(bundle.path, "rb") as f:
+                for offset, chunk in chunks(f):
+                    hash_ = chunk_hash(chunk)
+                    manifest.append((hash_, offset, len(chunk)))
+
+                    if not self.index.known(hash_):
+                        self.put_chunk(hash_, chunk)
+
+                try:
+                    self.assemble(bundle, data_id, bundle_id, manifest)
+                except ServiceError as e:
+                    if e.code != 409:
+                        raise
+
+                    # the server lost some chunks our index believes it has, send them again
+                    try:
+                        missing = set(json.loads(e.message).get("missing", []))
+                    except (ValueError, AttributeError):
+                        raise e
+
+                    self.index.forget(missing)
+
+                    for hash_, offset, size in manifest:
+                        if hash_ in missing:
+                            f.seek(offset)
+                            self.put_chunk(hash_, f.read(size))
+                            missing.discard(hash_)
+
+                    self.assemble(bundle, data_id, bundle_id, manifest)
+        except ServiceError as e:
+            if e.code in UNSUPPORTED_CODES:
+                self.supported = False
+                return False
+            raise
+
+        self.uploaded(bundle)
+
+        with self.lock:
+            self.total_bytes += bundle.size
+
+        return True
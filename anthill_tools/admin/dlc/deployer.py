@@ -1,25 +1,66 @@
 
-from anthill_tools import Discovery, Environment, Login, Admin, ApplicationInfo, ServiceError
+from anthill_tools import Discovery, Environment, Login, Admin, ApplicationInfo, ServiceError, transport
+from anthill_tools import limit_bandwidth, log_lock, retry_policy, scheduler, tracer
+from anthill_tools.cache import ServiceCache
+from anthill_tools.tokens import TokenStore
+from anthill_tools.trace import trace_sinks
+from anthill_tools.plan import DeployPlan, HostMeters, LinkMeter, LinkStats, write_plans
+from anthill_tools.retry import DEFAULT_ATTEMPTS
+from anthill_tools.admin.dlc.hashcache import HashCache
+from anthill_tools.admin.dlc.delta import DeltaUploader, ChunkIndex
+from anthill_tools.admin.dlc.journal import DeployJournal
+from anthill_tools.admin.dlc.config import read_config
+from anthill_tools.admin.dlc.pipeline import Pipeline, Stage, report
+from anthill_tools.admin.dlc.store import ContentStore, DEFAULT_CONTENT_HASH, CONTENT_HASHES, hasher
+from anthill_tools.progress import progress_sink
+from anthill_tools.compression import Compression
+from anthill_tools.shaping import POLICIES, SMALLEST_FIRST
 
-import hashlib
 import os
 import sys
 import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
 
 
+DEFAULT_CONCURRENCY = 8
+DEFAULT_JOBS = 1
+DEFAULT_PARALLEL = 4
+DEFAULT_ATTACH_JOBS = 4
+DEFAULT_HASH_JOBS = os.cpu_count() or 1
+HASH_BUFFER_SIZE = 1024 * 1024
+BATCH_CHECK_SIZE = 500
+BATCH_ATTACH_SIZE = 500
+BATCH_LINGER = 0.2
+BATCH_UNSUPPORTED = (404, 405, 501)
+
+
 def log(data):
-    print(data)
+    with log_lock:
+        print(data)
 
 
-def md5(file_name):
-    hash_ = hashlib.md5()
+def digest(file_name, names=("md5",)):
+    hashes = [(name, hasher(name)) for name in names]
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+
+    with open(file_name, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            for name, hash_ in hashes:
+                hash_.update(view[:read])
 
-    with open(file_name, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_.update(chunk)
+    return {name: hash_.hexdigest() for name, hash_ in hashes}
 
-    return hash_.hexdigest()
+
+def md5(file_name):
+    return digest(file_name)["md5"]
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -64,35 +105,142 @@ def ask(question, default="yes"):
 
 
 class Bundle(object):
-    def __init__(self):
-        self.name = None
-        self.path = None
+    __slots__ = ("name", "path", "hash", "key", "size", "filters", "properties")
+
+    def __init__(self, name=None, path=None, filters=None, properties=None):
+        self.name = name
+        self.path = path
         self.hash = None
+        self.key = None
         self.size = 0
-        self.filters = {}
-        self.properties = {}
+        self.filters = {} if filters is None else filters
+        self.properties = {} if properties is None else properties
 
-    def init(self):
+    def init(self, hash_cache=None, store=None):
         bundle_path = self.path
         if not os.path.isfile(bundle_path):
             raise DeliverError("Bundle {0} cannot be found!".format(bundle_path))
-        self.hash = md5(bundle_path)
-        self.size = os.path.getsize(bundle_path)
+
+        stat = os.stat(bundle_path)
+        self.size = stat.st_size
+
+        names = ("md5",) if store is None or store.content_hash == "md5" else ("md5", store.content_hash)
+
+        def compute():
+            if hash_cache is not None:
+                cached = hash_cache.get(bundle_path, stat, names)
+                if cached:
+                    return cached
+
+            digests = digest(bundle_path, names)
+
+            if hash_cache is not None and HashCache.signature(os.stat(bundle_path)) == HashCache.signature(stat):
+                hash_cache.put(bundle_path, stat, digests)
+
+            return digests
+
+        if store is None:
+            self.hash = compute()["md5"]
+            return
+
+        digests = store.digest(bundle_path, HashCache.signature(stat), compute)
+        self.hash = digests["md5"]
+        self.key = store.key(digests)
 
 
 class Deliverer(object):
-    def __init__(self, environment_location, app_info, config, username=None, password=None, force=False):
+    def __init__(self, environment_location, app_info, config, username=None, password=None, force=False,
+                 concurrency=DEFAULT_CONCURRENCY, jobs=DEFAULT_JOBS, hash_jobs=DEFAULT_HASH_JOBS,
+                 attach_jobs=DEFAULT_ATTACH_JOBS, hash_cache=True, batch_check=True, progress=None,
+                 service_cache=True, token_cache=True, delta=False, compression=None,
+                 journal=True, resume=False, bulk_attach=True, clone=False, content_store=True,
+                 content_hash=DEFAULT_CONTENT_HASH, upload_slots=None, weight=1):
         self.environment_location = environment_location
         self.app_info = app_info
         self.username = username
         self.password = password
         self.force = force
+        self.concurrency = max(1, concurrency)
+        self.jobs = max(1, jobs)
+        self.hash_jobs = max(1, hash_jobs)
+        self.attach_jobs = max(1, attach_jobs)
+        self.batch_check = batch_check
+        self.bulk_attach = bulk_attach
+        self.clone = clone
+        self.progress = progress
+        self.service_cache = service_cache
+        self.token_cache = token_cache
+        self.compression = compression
+        self.delta = delta
+        self.delta_uploader = None
+        # shared by the deliverers of a batch deploy to limit the uploads running at once across them
+        self.upload_slots = upload_slots
+        # share of the bandwidth the uploads of this deliverer get under the weighted schedule
+        self.weight = weight
+
+        if isinstance(hash_cache, HashCache):
+            self.hash_cache = hash_cache
+        elif hash_cache is True:
+            self.hash_cache = HashCache()
+        elif hash_cache:
+            self.hash_cache = HashCache(hash_cache)
+        else:
+            self.hash_cache = None
+
+        try:
+            if isinstance(content_store, ContentStore):
+                self.store = content_store
+            elif content_store is True:
+                self.store = ContentStore(content_hash=content_hash)
+            elif content_store:
+                self.store = ContentStore(content_store, content_hash)
+            else:
+                self.store = None
+        except ValueError as e:
+            raise DeliverError(str(e))
+
+        # whether the server can fill a new bundle by copying another bundle with the same payload
+        self.copying = self.store is not None
+        self.copied = 0
+        self.copied_bytes = 0
+
+        journal_key = DeployJournal.key(environment_location, app_info.app_name, app_info.gamespace)
+
+        if journal is True:
+            self.journal = DeployJournal(journal_key)
+        elif journal:
+            self.journal = DeployJournal(journal_key, journal)
+        else:
+            self.journal = None
+
+        self.resume = resume and self.journal is not None
+
+        self.config = config
+
+        self.lock = threading.Lock()
+        self.data_lock = threading.Lock()
+        self.data_id = None
+        self.authenticated = False
+        self.collect = False
+        self.delivered = 0
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.errors = []
 
-        self.bundles = []
+        # bundles of the published data version the new one is cloned from, by name
+        self.clone_source = None
+        self.carried = {}
+        self.seen = set()
+        self.unchanged = 0
 
         self.upload_bundles = []
         self.attach_bundles = []
 
+        self.hashing = None
+        self.checking = None
+        self.attaching = None
+        self.uploading = None
+
         self.env = None
         self.discovery = None
         self.login = None
@@ -100,65 +248,480 @@ class Deliverer(object):
         self.dlc = None
 
         self.init()
-        self.parse_config(config)
 
     def parse_config(self, config):
-        log("Parsing config...")
-        if "bundles" in config:
-            if not isinstance(config["bundles"], dict):
+        if isinstance(config, dict):
+            if not isinstance(config.get("bundles", {}), dict):
                 raise DeliverError("bundles should be a dict")
+            config = config.get("bundles", {}).items()
 
-            for name, config_bundle in config["bundles"].items():
-                if "path" not in config_bundle:
+        try:
+            for name, config_bundle in config:
+                if not isinstance(config_bundle, dict) or "path" not in config_bundle:
                     raise DeliverError("Bundle has no path option")
 
-                bundle = Bundle()
-                bundle.name = name
-                bundle.path = config_bundle["path"]
-                bundle.filters = config_bundle.get("filters", {})
-                bundle.properties = config_bundle.get("properties", {})
-
-                self.bundles.append(bundle)
+                yield Bundle(name, config_bundle["path"], config_bundle.get("filters", {}),
+                             config_bundle.get("properties", {}))
+        except ValueError as e:
+            raise DeliverError("Failed to parse config: {0}".format(str(e)))
 
     def init(self):
         log("Initializing...")
 
-        self.env = Environment(self.environment_location, self.app_info)
-        self.env.init()
+        with tracer().phase("init"):
+            self.env = Environment(self.environment_location, self.app_info, cache=self.service_cache)
+            self.env.init()
 
-        self.discovery = self.env.discovery
+            self.discovery = self.env.discovery
 
-        services = self.discovery.get_services([Login.ID, Admin.ID, "dlc"])
+            services = self.discovery.get_services([Login.ID, Admin.ID, "dlc"])
 
         self.login = services[Login.ID]
         self.admin = services[Admin.ID]
         self.dlc = services["dlc"]
 
-    def deliver(self):
-        log("Authenticating...")
+    def locations(self):
+        """
+        Locations of the environment and the services the deliverer talks to.
+        """
 
-        self.login.auth_dev(self.username, self.password, ["admin", "dlc", "dlc_admin"], options={
-            "as": "deployer"
-        })
+        services = (self.discovery, self.login, self.admin, self.dlc)
+        return [self.environment_location] + [service.location for service in services if service is not None]
 
-        log("Gathering bundles...")
+    def check_bundle(self, bundle):
+        try:
+            self.dlc.get("bundle", params={
+                "bundle_name": bundle.name,
+                "bundle_hash": bundle.hash
+            })
+        except ServiceError as e:
+            if e.code == 404:
+                return False
+            raise DeliverError("Failed to check bundle {0}: {1}".format(bundle.name, str(e)))
+
+        return True
 
-        for bundle in self.bundles:
-            bundle.init()
+    def check_batch(self, bundles):
+        manifest = [
+            {"bundle_name": bundle.name, "bundle_hash": bundle.hash}
+            for bundle in bundles
+        ]
+
+        try:
+            response = self.dlc.post("bundles/check", {
+                "bundles": json.dumps(manifest)
+            }, idempotent=True)
+        except ServiceError as e:
+            if e.code in BATCH_UNSUPPORTED:
+                return None
+            raise DeliverError("Failed to check bundles: {0}".format(str(e)))
+
+        existing = set(
+            (entry["bundle_name"], entry["bundle_hash"])
+            for entry in response.get("existing", [])
+        )
+
+        return [(bundle.name, bundle.hash) in existing for bundle in bundles]
+
+    def hash_bundle(self, bundle):
+        bundle.init(self.hash_cache, self.store)
+
+        if self.carried:
+            with self.lock:
+                self.seen.add(bundle.name)
+
+            if self.carried.get(bundle.name) == bundle.hash:
+                # the cloned data version has it already
+                with self.lock:
+                    self.unchanged += 1
+                self.record(bundle)
+                return
+
+        self.checking.put(bundle)
+
+    def check_bundles(self, bundles):
+        results = self.check_batch(bundles) if self.batch_check else None
+
+        if results is None:
+            with self.lock:
+                if self.batch_check:
+                    log("Batch bundle checks are not supported, checking bundles one by one")
+                    self.batch_check = False
+                    self.checking.batch = 1
+
+            results = [self.check_bundle(bundle) for bundle in bundles]
+
+        for bundle, exists in zip(bundles, results):
+            self.route(bundle, exists)
+
+    def route(self, bundle, exists):
+        if self.resume:
+            if self.journal.done(bundle):
+                with self.lock:
+                    self.delivered += 1
+                return
+
+            # bundles created but not uploaded last time are uploaded into the same bundle_id again,
+            # even if the same bundle exists somewhere else by now
+            if exists and self.journal.bundle_id(bundle) is not None:
+                exists = False
+
+        self.dispatch(bundle, exists)
+
+    def dispatch(self, bundle, exists):
+        if exists:
+            # attaching only needs the name and the hash
+            bundle.filters = bundle.properties = None
+
+        if self.collect:
+            with self.lock:
+                (self.attach_bundles if exists else self.upload_bundles).append(bundle)
+        else:
+            (self.attaching if exists else self.uploading).put(bundle)
+
+    def attach_batch(self, bundles):
+        data_id = self.data_version()
+
+        if self.bulk_attach:
+            log("Attaching {0} bundle(s) ...".format(len(bundles)))
 
             try:
-                self.dlc.get("bundle", params={
-                    "bundle_name": bundle.name,
-                    "bundle_hash": bundle.hash
+                self.admin.api_post("dlc", "attach_bundles", "attach", {
+                    "app_id": self.app_info.app_name,
+                    "data_id": data_id
+                }, data={
+                    "bundles": json.dumps([
+                        {"bundle_name": bundle.name, "bundle_hash": bundle.hash}
+                        for bundle in bundles
+                    ])
                 })
             except ServiceError as e:
-                if e.code == 404:
-                    self.upload_bundles.append(bundle)
-                else:
-                    raise DeliverError("Failed to check bundle {0}: {1}".format(bundle.name, str(e)))
+                if e.code not in BATCH_UNSUPPORTED:
+                    for bundle in bundles:
+                        self.fail(bundle, "attach", e)
+                    return
+
+                with self.lock:
+                    if self.bulk_attach:
+                        log("Bulk attach is not supported, attaching bundles one by one")
+                        self.bulk_attach = False
+                        self.attaching.batch = 1
             else:
-                self.attach_bundles.append(bundle)
+                self.finish(*bundles)
+                log("  {0} bundle(s) attached!".format(len(bundles)))
+                return
+
+        for bundle in bundles:
+            self.attach_bundle(bundle, data_id)
+
+    def attach_bundle(self, bundle, data_id):
+        log("Attaching bundle {0} ...".format(bundle.name))
+
+        try:
+            self.admin.api_post("dlc", "attach_bundle", "attach", {
+                "app_id": self.app_info.app_name,
+                "data_id": data_id
+            }, data={
+                "bundle_name": bundle.name,
+                "bundle_hash": bundle.hash
+            })
+        except ServiceError as e:
+            self.fail(bundle, "attach", e)
+            return
+
+        self.finish(bundle)
+        log("  {0}: attached!".format(bundle.name))
+
+    def deliver_bundle(self, bundle):
+        data_id = self.data_version()
+
+        try:
+            if self.upload_slots is None:
+                self.upload_bundle(bundle, data_id)
+            else:
+                with self.upload_slots:
+                    self.upload_bundle(bundle, data_id)
+        except (ServiceError, DeliverError, OSError) as e:
+            self.fail(bundle, "upload", e)
+
+    def fail(self, bundle, action, error):
+        log("  {0}: failed to {1}: {2}".format(bundle.name, action, str(error)))
+
+        with self.lock:
+            self.errors.append(bundle)
+
+    def upload_bundle(self, bundle, data_id):
+        log("Uploading bundle {0} ...".format(bundle.name))
+
+        bundle_id = self.journal.bundle_id(bundle) if self.resume else None
+
+        if bundle_id is None:
+            bundle_id = self.create_bundle(bundle, data_id)
+        else:
+            log("  {0}: using bundle created before: {1}".format(bundle.name, bundle_id))
+
+        if self.store is None or not self.copying:
+            self.send_bundle(bundle, data_id, bundle_id)
+            return
+
+        with self.store.payload(bundle.key, self.admin.location) as sources:
+            if sources and self.copy_bundle(bundle, data_id, bundle_id, sources):
+                return
+
+            self.send_bundle(bundle, data_id, bundle_id)
+
+    def copy_bundle(self, bundle, data_id, bundle_id, sources):
+        """
+        Fills a new bundle with the payload of another bundle the server has already, trying each of the
+        sources in turn. Returns False if none of them could be copied, so the bundle has to be uploaded.
+        """
+
+        for app, name in sources:
+            if not self.copying:
+                return False
+
+            try:
+                self.admin.api_post("dlc", "bundle", "copy", {
+                    "app_id": self.app_info.app_name,
+                    "data_id": data_id,
+                    "bundle_id": bundle_id
+                }, data={
+                    "source_app_id": app,
+                    "bundle_name": name,
+                    "bundle_hash": bundle.hash
+                }, idempotent=True)
+            except ServiceError as e:
+                if e.code == 409:
+                    # the server doesn't have it anymore
+                    self.store.forget(bundle.key, self.admin.location, app, name)
+                    continue
+                if e.code == 403:
+                    continue
+                if e.code in BATCH_UNSUPPORTED:
+                    with self.lock:
+                        if self.copying:
+                            log("Copying bundles is not supported, uploading identical bundles again")
+                            self.copying = False
+                    return False
+                raise
+
+            with self.lock:
+                self.copied += 1
+                self.copied_bytes += bundle.size
+
+            self.finish(bundle)
+            log("  {0}: copied from {1} of {2}!".format(bundle.name, name, app))
+            return True
+
+        return False
+
+    def send_bundle(self, bundle, data_id, bundle_id):
+        if self.delta_uploader is not None and self.delta_uploader.upload(bundle, data_id, bundle_id):
+            log("  {0}: uploaded as delta!".format(bundle.name))
+            self.sent(bundle)
+            return
+
+        with open(bundle.path, "rb") as f:
+            self.admin.api_put("dlc", "bundle", {
+                "app_id": self.app_info.app_name,
+                "data_id": data_id,
+                "bundle_id": bundle_id,
+            }, data=f, progress=self.progress, compression=self.compression, weight=self.weight, idempotent=True)
+
+        if self.delta_uploader is not None:
+            self.delta_uploader.uploaded(bundle)
+
+        self.sent(bundle)
+        log("  {0}: uploaded!".format(bundle.name))
+
+    def sent(self, bundle):
+        with self.lock:
+            self.uploaded += 1
+            self.uploaded_bytes += bundle.size
+
+        self.finish(bundle)
+
+    def create_bundle(self, bundle, data_id):
+        response = self.admin.api_post("dlc", "new_bundle", "create", {
+            "app_id": self.app_info.app_name,
+            "data_id": data_id
+        }, data={
+            "bundle_name": bundle.name,
+            "bundle_payload": json.dumps(bundle.properties),
+            "bundle_filters": json.dumps(bundle.filters)
+        })
+
+        try:
+            context = json.loads(response.headers["X-Api-Context"])
+        except (KeyError, ValueError):
+            raise DeliverError("Failed to get data context")
+
+        bundle_id = context["bundle_id"]
+        log("  {0}: new bundle created: {1}".format(bundle.name, bundle_id))
+
+        if self.journal is not None:
+            self.journal.created(bundle, bundle_id)
+
+        return bundle_id
+
+    def finish(self, *bundles):
+        if self.journal is not None:
+            self.journal.finished(*bundles)
+
+        self.record(*bundles)
+
+    def record(self, *bundles):
+        if self.store is None:
+            return
+
+        for bundle in bundles:
+            self.store.deployed(bundle.key, bundle.hash, bundle.size, self.admin.location,
+                                self.app_info.app_name, bundle.name)
+
+    def payload_size(self):
+        """
+        The size of the bundles to upload, without the ones that can be copied from bundles deployed
+        before or from another bundle of this deploy with the same payload, and the amount of the latter.
+        """
+
+        size = 0
+        copies = 0
+        keys = set()
+
+        for bundle in self.upload_bundles:
+            if self.store is not None and (bundle.key in keys or self.store.sources(bundle.key, self.admin.location)):
+                copies += 1
+            else:
+                size += bundle.size
+            keys.add(bundle.key)
+
+        return size, copies
+
+    def init_delta(self):
+        index = ChunkIndex(self.admin.location + "/" + self.app_info.app_name)
+        index.load()
+        self.delta_uploader = DeltaUploader(self.admin, self.app_info.app_name, index)
+
+    def finish_delta(self):
+        self.delta_uploader.index.save()
+
+        if not self.delta_uploader.supported:
+            log("Delta uploads are not supported by the server, bundles were uploaded in full")
+        elif self.delta_uploader.total_bytes:
+            log("Delta upload: sent {0} of {1}, saved {2}".format(
+                sizeof_fmt(self.delta_uploader.sent_bytes),
+                sizeof_fmt(self.delta_uploader.total_bytes),
+                sizeof_fmt(self.delta_uploader.saved_bytes)))
+
+    def load_journal(self):
+        if self.journal is None:
+            return
+
+        self.journal.load()
+
+        if self.resume:
+            if self.journal.data_id is None:
+                log("Nothing to resume, starting a new deploy")
+                self.resume = False
+            else:
+                log("Resuming data {0}".format(self.journal.data_id))
+                self.data_id = self.journal.data_id
+        elif self.journal.data_id is not None:
+            log("***** Unfinished deploy of data {0} found, it will be abandoned. "
+                "Use --resume to continue it instead.".format(self.journal.data_id))
+
+    def load_published(self):
+        try:
+            response = self.admin.api_get("dlc", "published_data_version", {
+                "app_id": self.app_info.app_name
+            }).json()
+        except ServiceError as e:
+            if e.code in BATCH_UNSUPPORTED:
+                log("No published data version to clone, creating a new one")
+                return
+            raise DeliverError("Failed to get the published data version: {0}".format(str(e)))
+
+        self.clone_source = response["data_id"]
+        self.carried = {
+            entry["bundle_name"]: entry["bundle_hash"]
+            for entry in response.get("bundles", [])
+        }
+
+        log("Cloning data {0} with {1} bundle(s)".format(self.clone_source, len(self.carried)))
+
+    def removed_bundles(self):
+        return sorted(name for name in self.carried if name not in self.seen)
+
+    def detach_bundles(self, names):
+        log("Detaching {0} bundle(s) ...".format(len(names)))
+
+        self.admin.api_post("dlc", "data_version", "detach", {
+            "app_id": self.app_info.app_name,
+            "data_id": self.data_version()
+        }, data={
+            "bundles": json.dumps(names)
+        })
+
+    def new_data_version(self):
+        if self.clone_source is None:
+            log("Creating new data version")
+
+            response = self.admin.api_post("dlc", "app", "new_data_version", {
+                "app_id": self.app_info.app_name
+            }, data={})
+        else:
+            log("Cloning data version {0}".format(self.clone_source))
+
+            response = self.admin.api_post("dlc", "data_version", "clone", {
+                "app_id": self.app_info.app_name,
+                "data_id": self.clone_source
+            }, data={})
+
+        try:
+            context = json.loads(response.headers["X-Api-Context"])
+        except (KeyError, ValueError):
+            raise DeliverError("Failed to get data context")
+
+        data_id = context["data_id"]
+        log("New data created: {0}".format(data_id))
 
+        if self.journal is not None:
+            self.journal.start(data_id)
+
+        return data_id
+
+    def data_version(self):
+        """
+        The data version bundles are delivered into, created by whichever bundle needs it first.
+        """
+
+        with self.data_lock:
+            if self.data_id is None:
+                with tracer().phase("create"):
+                    self.data_id = self.new_data_version()
+            return self.data_id
+
+    def stages(self):
+        self.hashing = Stage("hash", self.hash_bundle, self.hash_jobs)
+        self.checking = Stage(
+            "check", self.check_bundles, self.concurrency,
+            capacity=BATCH_CHECK_SIZE * 2 if self.batch_check else None,
+            batch=BATCH_CHECK_SIZE if self.batch_check else 1, linger=BATCH_LINGER)
+        self.attaching = Stage(
+            "attach", self.attach_batch, self.attach_jobs,
+            capacity=BATCH_ATTACH_SIZE * 2 if self.bulk_attach else None,
+            batch=BATCH_ATTACH_SIZE if self.bulk_attach else 1, linger=BATCH_LINGER)
+        self.uploading = Stage("upload", self.deliver_bundle, self.jobs)
+
+        return [self.hashing, self.checking, self.attaching, self.uploading]
+
+    def log_delivered(self):
+        if self.carried:
+            log("{0} unchanged bundle(s) carried over from data {1}".format(self.unchanged, self.clone_source))
+        if self.resume:
+            log("{0} bundle(s) delivered before".format(self.delivered))
+
+    def list_bundles(self):
         if self.upload_bundles:
             log("Bundles to upload:")
             total_size = 0
@@ -167,107 +730,532 @@ class Deliverer(object):
                 total_size += bundle.size
             log("Total size: {0}".format(sizeof_fmt(total_size)))
 
+            payload_size, copies = self.payload_size()
+            if copies:
+                log("{0} bundle(s) have the same payload as others and can be copied, {1} to upload".format(
+                    copies, sizeof_fmt(payload_size)))
+
         if self.attach_bundles:
             log("Existing bundles to attach:")
             for bundle in self.attach_bundles:
                 log("  {1} [{0}] {2}".format(bundle.hash, bundle.name, sizeof_fmt(bundle.size)))
 
-        if (not self.upload_bundles) and (not self.attach_bundles):
-            log("Nothing to deliver, exiting!")
+        removed = self.removed_bundles()
+        if removed:
+            log("Bundles to remove:")
+            for name in removed:
+                log("  {0}".format(name))
+
+    def confirm(self):
+        if not self.upload_bundles and self.data_id is None:
+            return ask("***** There's nothing to upload, are you sure you want to create new data entry?")
+        return ask("Proceed?")
+
+    def gather(self):
+        log("Gathering bundles...")
+        self.collect = True
+        Pipeline([self.hashing, self.checking]).run(self.parse_config(self.config))
+        self.log_delivered()
+
+        # bundles are checked concurrently, so they come out of order
+        self.upload_bundles.sort(key=lambda bundle: bundle.name)
+        self.attach_bundles.sort(key=lambda bundle: bundle.name)
+
+    def run(self, stages):
+        """
+        Streams bundles of the config through the stages. Forced deploys run all of them at once, so
+        bundles are uploaded while others are still being hashed and checked. Otherwise bundles are
+        hashed and checked first, listed and confirmed, then attached and uploaded.
+        """
+
+        if self.force:
+            log("Delivering bundles...")
+            self.collect = False
+            Pipeline(stages).run(self.parse_config(self.config))
+            self.log_delivered()
+            return True
+
+        self.gather()
+        self.list_bundles()
+
+        if not self.upload_bundles and not self.attach_bundles and not self.removed_bundles() and \
+                self.data_id is None:
+            return True
+
+        if not self.confirm():
+            log("Exiting!")
+            return False
+
+        self.collect = False
+        Pipeline([self.attaching, self.uploading]).run(
+            [(bundle, True) for bundle in self.attach_bundles] +
+            [(bundle, False) for bundle in self.upload_bundles],
+            feed=lambda item: self.dispatch(*item))
+        return True
+
+    def authenticate(self):
+        if self.authenticated:
             return
 
-        if not self.force:
-            if not self.upload_bundles:
-                proceed = ask("***** There's nothing to upload, "
-                              "are you sure you want to create new data entry?")
-                if not proceed:
-                    log("Exiting!")
-                    return
-            else:
-                proceed = ask("Proceed?")
-                if not proceed:
-                    log("Exiting!")
-                    return
+        log("Authenticating...")
+
+        with tracer().phase("auth"):
+            self.login.auth_dev(self.username, self.password, ["admin", "dlc", "dlc_admin"], options={
+                "as": "deployer"
+            }, cache=self.token_cache)
+
+        self.authenticated = True
+
+    def prepare(self):
+        self.authenticate()
+        self.load_journal()
+
+        if self.clone:
+            self.load_published()
+
+        transport().reserve(self.concurrency + self.attach_jobs + self.jobs)
+
+        if self.hash_cache is not None:
+            self.hash_cache.load()
+
+        if self.store is not None:
+            self.store.load()
+
+    def save_caches(self):
+        if self.hash_cache is not None:
+            self.hash_cache.save()
+
+        if self.store is not None:
+            self.store.save()
 
-        log("Creating new data version")
+    def plan(self):
+        """
+        Gathers bundles the same way deliver() does, without changing anything on the server, and
+        returns what the rest of the deploy would do. Upload sizes are before compression or delta.
+        """
 
-        response = self.admin.api_post("dlc", "app", "new_data_version", {
-            "app_id": self.app_info.app_name
-        }, data={})
+        self.prepare()
+        self.stages()
+
+        started = time.monotonic()
 
         try:
-            context = json.loads(response.headers["X-Api-Context"])
-        except (KeyError, ValueError):
-            raise DeliverError("Failed to get data context")
+            self.gather()
+        finally:
+            self.save_caches()
+
+        self.list_bundles()
+
+        uploads = len(self.upload_bundles)
+        upload_bytes, copies = self.payload_size()
+        attaches = len(self.attach_bundles)
+        detaches = len(self.removed_bundles())
+        attach_requests = math.ceil(attaches / BATCH_ATTACH_SIZE) if self.bulk_attach else attaches
+        delivers = uploads or attaches or detaches
+
+        # creating the data version, detaching and publishing are done one after another, while
+        # bundles are created and uploaded or copied (two requests each) next to the attaches
+        sequential = sum([
+            bool(delivers) and self.data_id is None,
+            bool(detaches),
+            bool(delivers) or self.data_id is not None
+        ])
+
+        plan = DeployPlan("{0} {1}@{2}".format(
+            self.environment_location, self.app_info.app_name, self.app_info.gamespace))
+        plan.gather_time = time.monotonic() - started
+        plan.uploads = uploads - copies
+        plan.upload_bytes = upload_bytes
+        plan.copies = copies
+        plan.attaches = attaches
+        plan.detaches = detaches
+        plan.unchanged = self.unchanged
+        plan.requests = sequential + uploads * 2 + attach_requests
+        plan.rounds = sequential + max(math.ceil(uploads / self.jobs) * 2,
+                                       math.ceil(attach_requests / self.attach_jobs))
+
+        return plan
 
-        data_id = context["data_id"]
-        log("New data created: {0}".format(data_id))
+    def deliver(self):
+        self.prepare()
 
-        for bundle in self.attach_bundles:
-            log("Attaching bundle {0} ...".format(bundle.name))
+        if self.delta:
+            self.init_delta()
 
-            self.admin.api_post("dlc", "attach_bundle", "attach", {
-                "app_id": self.app_info.app_name,
-                "data_id": data_id
-            }, data={
-                "bundle_name": bundle.name,
-                "bundle_hash": bundle.hash
-            })
+        stages = self.stages()
 
-            log("  Attached!")
+        try:
+            proceed = self.run(stages)
+        finally:
+            self.save_caches()
 
-        for bundle in self.upload_bundles:
-            log("Uploading bundle {0} ...".format(bundle.name))
+        if not proceed:
+            return
 
-            log("  Creating...")
-            response = self.admin.api_post("dlc", "new_bundle", "create", {
-                "app_id": self.app_info.app_name,
-                "data_id": data_id
-            }, data={
-                "bundle_name": bundle.name,
-                "bundle_payload": json.dumps(bundle.properties),
-                "bundle_filters": json.dumps(bundle.filters)
-            })
+        if self.delta_uploader is not None:
+            self.finish_delta()
 
-            try:
-                context = json.loads(response.headers["X-Api-Context"])
-            except (KeyError, ValueError):
-                raise DeliverError("Failed to get data context")
+        report(stages, log)
 
-            bundle_id = context["bundle_id"]
-            log("  New bundle created: {0}".format(bundle_id))
+        if self.copied:
+            log("{0} bundle(s) copied from identical payloads on the server, {1} not uploaded".format(
+                self.copied, sizeof_fmt(self.copied_bytes)))
 
-            log("  Uploading...")
+        if not self.errors:
+            removed = self.removed_bundles()
+            if removed:
+                self.detach_bundles(removed)
 
-            with open(bundle.path, "rb") as f:
-                self.admin.api_put("dlc", "bundle", {
-                    "app_id": self.app_info.app_name,
-                    "data_id": data_id,
-                    "bundle_id": bundle_id,
-                }, data=f)
+        if self.errors:
+            raise DeliverError("Failed to deliver {0} bundle(s): {1}. Data {2} is left unpublished{3}.".format(
+                len(self.errors), ", ".join(bundle.name for bundle in self.errors), self.data_id,
+                ", run again with --resume to continue it" if self.journal is not None else ""))
 
-            log("  Uploaded!")
+        if self.data_id is None:
+            log("Nothing to deliver, exiting!")
+            return
 
         log("Publishing data!")
 
-        self.admin.api_post("dlc", "data_version", "publish", {
-            "app_id": self.app_info.app_name,
-            "data_id": data_id
-        }, data={})
+        with tracer().phase("publish"):
+            self.admin.api_post("dlc", "data_version", "publish", {
+                "app_id": self.app_info.app_name,
+                "data_id": self.data_id
+            }, data={})
+
+        if self.journal is not None:
+            self.journal.remove()
 
         log("Publish process started!")
 
+        stats = retry_policy().stats
+        if stats.retries:
+            log("Retries: {0}".format(str(stats)))
+
 
 def deploy(environment_location, application_name, application_version,
-           gamespace, config_location, username=None, password=None, force=False):
+           gamespace, config_location, username=None, password=None, force=False,
+           concurrency=DEFAULT_CONCURRENCY, jobs=DEFAULT_JOBS, hash_jobs=DEFAULT_HASH_JOBS,
+           attach_jobs=DEFAULT_ATTACH_JOBS, hash_cache=True, batch_check=True, progress=None,
+           service_cache=True, token_cache=True, delta=False, compression=None, retries=None,
+           journal=True, resume=False, trace=None, bulk_attach=True, clone=False, plan=False, plan_output=None,
+           max_upload=None, content_store=True, content_hash=DEFAULT_CONTENT_HASH, bandwidth=None,
+           stream_bandwidth=None, schedule=None, bandwidth_file=None, link_stats=None):
+
+    retry_policy().reset(retries)
+    limit_bandwidth(bandwidth, stream_bandwidth, schedule, bandwidth_file)
 
     app_info = ApplicationInfo(application_name, application_version, gamespace)
 
-    with open(config_location, "r") as f:
-        config = json.load(f)
+    config = read_config(config_location)
+
+    if isinstance(progress, str):
+        progress = progress_sink(progress)
+
+    if isinstance(compression, str):
+        compression = Compression.parse(compression)
+
+    if isinstance(trace, str):
+        trace = trace_sinks(trace, log)
+
+    meter = LinkMeter()
+    link_stats = LinkStats(link_stats)
+
+    with tracer().hooked((trace or []) + [meter]):
+        d = Deliverer(environment_location, app_info, config, username=username, password=password, force=force,
+                      concurrency=concurrency, jobs=jobs, hash_jobs=hash_jobs, attach_jobs=attach_jobs,
+                      hash_cache=hash_cache,
+                      batch_check=batch_check, progress=progress,
+                      service_cache=service_cache, token_cache=token_cache, delta=delta,
+                      compression=compression, journal=journal, resume=resume, bulk_attach=bulk_attach,
+                      clone=clone, content_store=content_store, content_hash=content_hash)
+
+        if plan:
+            result = d.plan()
+            result.measure(meter, link_stats.get(environment_location))
+            return report_plans([result], 1, plan_output, max_upload)
+
+        d.deliver()
+
+    scheduler().report(log)
+    link_stats.update(environment_location, meter)
+
+
+def report_plans(plans, parallel, plan_output, max_upload):
+    for plan in plans:
+        plan.report(log)
+
+    total = plans[0]
+
+    if len(plans) > 1:
+        total = DeployPlan.combine("{0} targets".format(len(plans)), plans, parallel)
+        total.report(log)
+        plans = plans + [total]
+
+    if plan_output:
+        write_plans(plans, plan_output)
+
+    if max_upload is not None and total.upload_bytes > max_upload:
+        raise DeliverError("The deploy would upload {0}, more than the limit of {1}".format(
+            sizeof_fmt(total.upload_bytes), sizeof_fmt(max_upload)))
+
+    return total
+
+
+class Session(object):
+    """
+    What the targets of a batch deploy share: environment, discovery and token caches (kept in memory
+    only when the file caches are turned off), the hash cache, the content store, and a limit of bundles
+    uploaded at once across all targets. Targets of the same app and version take turns to initialize,
+    and targets authenticating into the same gamespace take turns to authenticate, so only the first
+    of them asks the services and the others find the answer in the caches.
+    """
+
+    def __init__(self, service_cache=True, token_cache=True, hash_cache=True, content_store=True,
+                 content_hash=DEFAULT_CONTENT_HASH, max_uploads=None):
+        self.service_cache = service_cache if service_cache else ServiceCache(None)
+        self.token_cache = token_cache if token_cache else TokenStore(None)
+
+        if hash_cache is True:
+            self.hash_cache = HashCache()
+        elif hash_cache and not isinstance(hash_cache, HashCache):
+            self.hash_cache = HashCache(hash_cache)
+        else:
+            self.hash_cache = hash_cache or False
+
+        try:
+            if content_store is True:
+                self.content_store = ContentStore(content_hash=content_hash)
+            elif content_store and not isinstance(content_store, ContentStore):
+                self.content_store = ContentStore(content_store, content_hash)
+            else:
+                self.content_store = content_store or False
+        except ValueError as e:
+            raise DeliverError(str(e))
+
+        self.upload_slots = threading.Semaphore(max_uploads) if max_uploads else None
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def turn(self, *key):
+        with self.lock:
+            lock = self.locks.get(key)
+            if lock is None:
+                lock = self.locks[key] = threading.Lock()
+            return lock
+
+    def kwargs(self):
+        return {
+            "service_cache": self.service_cache,
+            "token_cache": self.token_cache,
+            "hash_cache": self.hash_cache,
+            "content_store": self.content_store,
+            "upload_slots": self.upload_slots
+        }
+
+
+class Target(object):
+    # options a target of a batch deploy can set for itself
+    OPTIONS = ("clone", "delta", "compression", "batch_check", "bulk_attach", "jobs", "attach_jobs", "weight")
+
+    def __init__(self, environment_location, application_name, application_version, gamespace,
+                 config_location, options=None):
+        self.environment_location = environment_location
+        self.app_info = ApplicationInfo(application_name, application_version, gamespace)
+        self.config_location = config_location
+        self.options = options or {}
+
+        self.deliverer = None
+        self.error = None
+        self.timings = {}
+        self.plan = None
+
+    @staticmethod
+    def parse(config, config_location=None):
+        try:
+            return Target(
+                config["environment"], config["name"], config["version"], config["gamespace"],
+                config.get("config", config_location) or config["config"],
+                options={option: config[option] for option in Target.OPTIONS if option in config})
+        except KeyError as e:
+            raise DeliverError("Target has no {0} option".format(str(e)))
+
+    def __str__(self):
+        return "{0} {1}@{2}".format(self.environment_location, self.app_info.app_name, self.app_info.gamespace)
+
+    def locations(self):
+        return self.deliverer.locations() if self.deliverer is not None else [self.environment_location]
+
+    def run(self, phase, method, *args):
+        if self.error is not None:
+            return
+
+        started = time.monotonic()
+
+        try:
+            method(*args)
+        except (ServiceError, DeliverError, OSError, ValueError) as e:
+            self.error = "{0} failed: {1}".format(phase, str(e))
+            log("{0}: {1}".format(self, self.error))
+        finally:
+            self.timings[phase] = time.monotonic() - started
+
+    def prepare(self, session, kwargs):
+        kwargs = dict(kwargs, **self.options)
+
+        if isinstance(kwargs.get("compression"), str):
+            kwargs["compression"] = Compression.parse(kwargs["compression"])
+
+        with session.turn("init", self.environment_location, self.app_info.app_name, self.app_info.app_version):
+            self.deliverer = Deliverer(self.environment_location, self.app_info,
+                                       read_config(self.config_location), force=True, **kwargs)
+
+    def authenticate(self, session):
+        with session.turn("auth", self.environment_location, self.app_info.gamespace):
+            self.deliverer.authenticate()
+
+    def init(self, session, kwargs):
+        self.run("init", self.prepare, session, kwargs)
+        self.run("auth", self.authenticate, session)
+
+    def deliver(self, session, kwargs):
+        self.init(session, kwargs)
+        self.run("deliver", lambda: self.deliverer.deliver())
+
+    def plan_deploy(self, session, kwargs):
+        def plan():
+            self.plan = self.deliverer.plan()
+
+        self.init(session, kwargs)
+        self.run("plan", plan)
+
+    def dump(self):
+        d = self.deliverer
+
+        return {
+            "target": str(self),
+            "environment": self.environment_location,
+            "name": self.app_info.app_name,
+            "version": self.app_info.app_version,
+            "gamespace": self.app_info.gamespace,
+            "ok": self.error is None,
+            "error": self.error,
+            "data_id": d.data_id if d is not None else None,
+            "uploaded": d.uploaded if d is not None else 0,
+            "uploaded_bytes": d.uploaded_bytes if d is not None else 0,
+            "copied": d.copied if d is not None else 0,
+            "attached": d.attaching.items if d is not None and d.attaching is not None else 0,
+            "unchanged": d.unchanged if d is not None else 0,
+            "failed": len(d.errors) if d is not None else 0,
+            "timings": self.timings
+        }
+
+
+def summary(targets, report_output=None):
+    log("Deploy summary:")
+
+    entries = [target.dump() for target in targets]
+
+    for entry in entries:
+        timings = ", ".join(
+            "{0} {1}".format(phase, "{0:.1f}s".format(entry["timings"][phase]) if phase in entry["timings"] else "-")
+            for phase in ("init", "auth", "deliver"))
+
+        log("  {0} {1}: {2}; uploaded {3} ({4}), copied {5}, attached {6}, unchanged {7}{8}".format(
+            "OK  " if entry["ok"] else "FAIL", entry["target"], timings,
+            entry["uploaded"], sizeof_fmt(entry["uploaded_bytes"]), entry["copied"], entry["attached"],
+            entry["unchanged"], "" if entry["ok"] else " ({0})".format(entry["error"])))
+
+    log("Total: {0} of {1} targets delivered, {2} uploaded".format(
+        sum(entry["ok"] for entry in entries), len(entries),
+        sizeof_fmt(sum(entry["uploaded_bytes"] for entry in entries))))
+
+    scheduler().report(log)
+
+    stats = retry_policy().stats
+    if stats.retries:
+        log("Retries: {0}".format(str(stats)))
+
+    if report_output:
+        with open(report_output, "w") as f:
+            json.dump(entries, f, indent=4)
+
+
+def deploy_many(targets, config_location=None, username=None, password=None, parallel=DEFAULT_PARALLEL,
+                max_uploads=None, bandwidth=None, stream_bandwidth=None, schedule=None,
+                bandwidth_file=None, retries=None, trace=None, plan=False, plan_output=None,
+                max_upload=None, report_output=None, service_cache=True, token_cache=True, hash_cache=True,
+                content_store=True, content_hash=DEFAULT_CONTENT_HASH, progress=None, link_stats=None, **kwargs):
+    """
+    Delivers the configs of many targets, each an app in a gamespace, in one process: up to parallel
+    targets at once, with up to max_uploads bundles uploaded at once and all uploads limited to
+    bandwidth bytes per second across all of them, shared as schedule says. Targets are dicts with
+    environment, name, version, gamespace and config (config_location if missing), and may override
+    the options in Target.OPTIONS. Deploys are forced, a summary of every target is logged and written
+    to report_output.
+    """
+
+    retry_policy().reset(retries)
+    limit_bandwidth(bandwidth, stream_bandwidth, schedule, bandwidth_file)
+
+    if isinstance(progress, str):
+        progress = progress_sink(progress)
+
+    if isinstance(trace, str):
+        trace = trace_sinks(trace, log)
 
-    d = Deliverer(environment_location, app_info, config, username=username, password=password, force=force)
-    d.deliver()
+    targets = [
+        target if isinstance(target, Target) else Target.parse(target, config_location)
+        for target in targets
+    ]
+
+    if not targets:
+        raise DeliverError("No targets to deploy")
+
+    session = Session(service_cache=service_cache, token_cache=token_cache, hash_cache=hash_cache,
+                      content_store=content_store, content_hash=content_hash, max_uploads=max_uploads)
+
+    kwargs.update(session.kwargs())
+    kwargs.update({
+        "username": username,
+        "password": password,
+        "progress": progress
+    })
+
+    parallel = max(1, parallel)
+    per_target = kwargs.get("concurrency", DEFAULT_CONCURRENCY) + kwargs.get("attach_jobs", DEFAULT_ATTACH_JOBS) + \
+        kwargs.get("jobs", DEFAULT_JOBS)
+    transport().reserve(min(len(targets), parallel) * per_target)
+
+    meters = HostMeters()
+    link_stats = LinkStats(link_stats)
+
+    log("Initializing {0} targets...".format(len(targets)))
+
+    with tracer().hooked((trace or []) + [meters]):
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for _ in executor.map(lambda target: (target.plan_deploy if plan else target.deliver)(session, kwargs),
+                                  targets):
+                pass
+
+    failed = [target for target in targets if target.error is not None]
+
+    if plan:
+        if failed:
+            raise DeliverError("Failed to plan {0} of {1} targets".format(len(failed), len(targets)))
+
+        for target in targets:
+            target.plan.measure(meters.meter(target.locations()), link_stats.get(target.environment_location))
+        return report_plans([target.plan for target in targets], parallel, plan_output, max_upload)
+
+    meters.store(link_stats, targets)
+
+    summary(targets, report_output)
+
+    if failed:
+        raise DeliverError("Failed to deploy to {0} of {1} targets".format(len(failed), len(targets)))
+
+    return targets
 
 
 if __name__ == "__main__":
@@ -289,17 +1277,120 @@ if __name__ == "__main__":
                       help="Anthill Password", default=os.environ.get("ANTHILL_PASSWORD"))
     parser.add_option("-f", "--force", action="store_true", dest="force", default=False,
                       help="Force yes")
+    parser.add_option("--concurrency", type="int", dest="concurrency", default=DEFAULT_CONCURRENCY,
+                      help="Amount of bundles to check concurrently")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=DEFAULT_JOBS,
+                      help="Amount of bundles to upload in parallel")
+    parser.add_option("--hash-jobs", type="int", dest="hash_jobs", default=DEFAULT_HASH_JOBS,
+                      help="Amount of bundles to hash in parallel")
+    parser.add_option("--attach-jobs", type="int", dest="attach_jobs", default=DEFAULT_ATTACH_JOBS,
+                      help="Amount of existing bundles to attach in parallel")
+    parser.add_option("--hash-cache", type="string", dest="hash_cache", default="",
+                      help="Location of the local bundle hash cache")
+    parser.add_option("--no-hash-cache", action="store_true", dest="no_hash_cache", default=False,
+                      help="Do not use the local bundle hash cache, hash every bundle")
+    parser.add_option("--no-batch-check", action="store_false", dest="batch_check", default=True,
+                      help="Check bundles one by one, even if the server supports batch checks")
+    parser.add_option("--no-bulk-attach", action="store_false", dest="bulk_attach", default=True,
+                      help="Attach existing bundles one by one, even if the server can attach many at once")
+    parser.add_option("--clone", action="store_true", dest="clone", default=False,
+                      help="Clone the published data version and only deliver the bundles that changed")
+    parser.add_option("--plan", action="store_true", dest="plan", default=False,
+                      help="Only show what the deploy would do and how long it would take, change nothing")
+    parser.add_option("--plan-output", type="string", dest="plan_output", default="",
+                      help="Also write the plan into this JSON file")
+    parser.add_option("--max-upload", type="float", dest="max_upload", default=0,
+                      help="With --plan, fail if more than this many megabytes would be uploaded")
+    parser.add_option("--content-store", type="string", dest="content_store", default="",
+                      help="Location of the local index of deployed bundle payloads")
+    parser.add_option("--no-content-store", action="store_true", dest="no_content_store", default=False,
+                      help="Do not look for bundles with identical payloads, upload every bundle")
+    parser.add_option("--content-hash", type="choice", dest="content_hash", default=DEFAULT_CONTENT_HASH,
+                      choices=CONTENT_HASHES, help="Hash identifying bundle payloads: " + ", ".join(CONTENT_HASHES))
+    parser.add_option("--progress", type="string", dest="progress", default="bar",
+                      help="Upload progress output: bar, json:<file> or none")
+    parser.add_option("--no-service-cache", action="store_false", dest="service_cache", default=True,
+                      help="Do not use cached environment and discovery responses")
+    parser.add_option("--no-token-cache", action="store_false", dest="token_cache", default=True,
+                      help="Always authenticate, do not reuse cached access tokens")
+    parser.add_option("--compress", type="string", dest="compress", default="none",
+                      help="Compress uploads: none, gzip[:level], zstd[:level] or auto[:codec[:level]]")
+    parser.add_option("--delta", action="store_true", dest="delta", default=False,
+                      help="Upload only the changed parts of bundles, if the server supports it")
+    parser.add_option("--resume", action="store_true", dest="resume", default=False,
+                      help="Continue the data version of an interrupted deploy instead of creating a new one")
+    parser.add_option("--trace", type="string", dest="trace", default="",
+                      help="Trace requests and phases, comma separated: summary, json:<file>, otel:<file>")
+    parser.add_option("--retries", type="int", dest="retries", default=DEFAULT_ATTEMPTS,
+                      help="Amount of retries for each failed request, 0 to disable")
+    parser.add_option("-t", "--targets", type="string", dest="targets", default="",
+                      help="JSON file with a list of apps and gamespaces to deliver configs to, forces yes")
+    parser.add_option("--parallel", type="int", dest="parallel", default=DEFAULT_PARALLEL,
+                      help="With --targets, amount of targets to deliver to at once")
+    parser.add_option("--max-uploads", type="int", dest="max_uploads", default=0,
+                      help="With --targets, amount of bundles uploaded at once across all targets")
+    parser.add_option("--bandwidth", type="float", dest="bandwidth", default=0,
+                      help="Megabytes per second all uploads together may use, unlimited by default")
+    parser.add_option("--stream-bandwidth", type="float", dest="stream_bandwidth", default=0,
+                      help="Megabytes per second each upload may use, unlimited by default")
+    parser.add_option("--schedule", type="choice", dest="schedule", default=SMALLEST_FIRST, choices=POLICIES,
+                      help="How limited bandwidth is shared between uploads: " + ", ".join(POLICIES))
+    parser.add_option("--bandwidth-file", type="string", dest="bandwidth_file", default="",
+                      help="JSON file with bandwidth limits, applied again whenever it changes")
+    parser.add_option("--report-output", type="string", dest="report_output", default="",
+                      help="With --targets, also write the summary of every target into this JSON file")
 
     (options, args) = parser.parse_args()
 
     defaults = vars(parser.get_default_values())
+    target_options = ["environment_location", "application_name", "application_version", "gamespace", "config"]
 
     for k, v in vars(options).items():
+        if options.targets and k in target_options:
+            continue
         if v is None and defaults.get(k) is None:
             parser.print_help()
             exit(1)
 
     try:
+        if options.targets:
+            with open(options.targets, "r") as f:
+                targets_config = json.load(f)
+
+            deploy_many(
+                targets_config,
+                config_location=options.config,
+                username=options.anthill_username,
+                password=options.anthill_password,
+                parallel=options.parallel,
+                max_uploads=options.max_uploads or None,
+                bandwidth=options.bandwidth * 1024 * 1024 or None,
+                stream_bandwidth=options.stream_bandwidth * 1024 * 1024 or None,
+                schedule=options.schedule,
+                bandwidth_file=options.bandwidth_file,
+                report_output=options.report_output,
+                concurrency=options.concurrency,
+                jobs=options.jobs,
+                hash_jobs=options.hash_jobs,
+                attach_jobs=options.attach_jobs,
+                hash_cache=False if options.no_hash_cache else (options.hash_cache or True),
+                batch_check=options.batch_check,
+                bulk_attach=options.bulk_attach,
+                clone=options.clone,
+                content_store=False if options.no_content_store else (options.content_store or True),
+                content_hash=options.content_hash,
+                plan=options.plan,
+                plan_output=options.plan_output,
+                max_upload=options.max_upload * 1024 * 1024 if options.max_upload else None,
+                progress=options.progress,
+                service_cache=options.service_cache,
+                token_cache=options.token_cache,
+                delta=options.delta,
+                compression=options.compress,
+                retries=options.retries,
+                trace=options.trace)
+            exit(0)
+
         deploy(
             environment_location=options.environment_location,
             application_name=options.application_name,
@@ -308,7 +1399,32 @@ if __name__ == "__main__":
             config_location=options.config,
             username=options.anthill_username,
             password=options.anthill_password,
-            force=options.force)
+            force=options.force,
+            concurrency=options.concurrency,
+            jobs=options.jobs,
+            hash_jobs=options.hash_jobs,
+            attach_jobs=options.attach_jobs,
+            hash_cache=False if options.no_hash_cache else (options.hash_cache or True),
+            batch_check=options.batch_check,
+            bulk_attach=options.bulk_attach,
+            clone=options.clone,
+            content_store=False if options.no_content_store else (options.content_store or True),
+            content_hash=options.content_hash,
+            plan=options.plan,
+            plan_output=options.plan_output,
+            max_upload=options.max_upload * 1024 * 1024 if options.max_upload else None,
+            progress=options.progress,
+            service_cache=options.service_cache,
+            token_cache=options.token_cache,
+            delta=options.delta,
+            compression=options.compress,
+            retries=options.retries,
+            resume=options.resume,
+            trace=options.trace,
+            bandwidth=options.bandwidth * 1024 * 1024 or None,
+            stream_bandwidth=options.stream_bandwidth * 1024 * 1024 or None,
+            schedule=options.schedule,
+            bandwidth_file=options.bandwidth_file)
     except DeliverError as e:
         print("ERROR: " + str(e))
         exit(1)
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "hash_cache.json")
+
+
+class HashCache(object):
+    """
+    Remembers bundle hashes between deploys. An entry is only trusted while the file's
+    size, mtime and inode are exactly the same as when it was hashed; anything else
+    (or a cache written by a different format version) means the file is hashed again.
+    Entries of files that no longer exist are dropped on save. Each entry keeps the digests it was
+    hashed with, by name of the hash.
+    """
+
+    VERSION = 2
+
+    def __init__(self, location=DEFAULT_LOCATION):
+        self.location = location
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.loaded = False
+
+    @staticmethod
+    def key(path):
+        return os.path.abspath(path)
+
+    @staticmethod
+    def signature(stat):
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def load(self):
+        # deliverers sharing a cache load it once, the others wait for it; entries put meanwhile are newer
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+
+            try:
+                with open(self.location, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+
+            if not isinstance(data, dict) or data.get("version") != HashCache.VERSION:
+                return
+
+            entries = data.get("entries", {})
+            entries.update(self.entries)
+            self.entries = entries
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            entries = {
+                path: entry
+                for path, entry in self.entries.items()
+                if os.path.isfile(path)
+            }
+
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            temp_location = self.location + ".tmp"
+            with open(temp_location, "w") as f:
+                json.dump({"version": HashCache.VERSION, "entries": entries}, f)
+            os.replace(temp_location, self.location)
+
+            self.entries = entries
+            self.dirty = False
+
+    def get(self, path, stat, names=("md5",)):
+        with self.lock:
+            entry = self.entries.get(HashCache.key(path))
+
+        if entry is None or entry.get("signature") != HashCache.signature(stat):
+            return None
+
+        if not all(entry.get(name) for name in names):
+            return None
+
+        return {name: entry[name] for name in names}
+
+    def put(self, path, stat, digests):
+        signature = HashCache.signature(stat)
+
+        with self.lock:
+            entry = self.entries.get(HashCache.key(path))
+            if entry is None or entry.get("signature") != signature:
+                entry = self.entries[HashCache.key(path)] = {"signature": signature}
+
+            entry.update(digests)
+            self.dirty = True
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.dirty = True
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "deploys")
+
+
+class DeployJournal(object):
+    """
+    Records the progress of a DLC deploy: the data version created, the bundles created in it and
+    which of them were uploaded or attached. Every step is appended to a log as one JSON line, so an
+    interrupted deploy can continue the same data version instead of creating a new one, and recording
+    a step costs the same however many bundles the deploy has. The log is compacted when it is loaded.
+    A bundle only counts as done while its hash is the same as when it was finished, but the bundle
+    created for it is reused either way, so a bundle changed since is uploaded into it again.
+    """
+
+    VERSION = 2
+
+    def __init__(self, key, location=DEFAULT_LOCATION):
+        self.location = os.path.join(location, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jsonl")
+        self.data_id = None
+        self.bundles = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(environment_location, app_name, gamespace):
+        return "{0}/{1}@{2}".format(environment_location, app_name, gamespace)
+
+    def load(self):
+        try:
+            with open(self.location, "r") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line of a deploy killed while writing it
+                continue
+
+        if not records or not isinstance(records[0], dict) or records[0].get("version") != DeployJournal.VERSION:
+            return
+
+        with self.lock:
+            self.data_id = records[0].get("data_id")
+            self.bundles = {}
+
+            for record in records[1:]:
+                if isinstance(record, dict) and "name" in record:
+                    self.bundles[record.pop("name")] = record
+
+        self.save()
+
+    def save(self):
+        """
+        Writes the whole journal again, one line per bundle.
+        """
+
+        with self.lock:
+            os.makedirs(os.path.dirname(self.location), exist_ok=True)
+            temp_location = self.location + ".tmp"
+            with open(temp_location, "w") as f:
+                f.write(json.dumps({"version": DeployJournal.VERSION, "data_id": self.data_id}) + "\n")
+                for name, entry in self.bundles.items():
+                    f.write(json.dumps(dict(entry, name=name)) + "\n")
+            os.replace(temp_location, self.location)
+
+    def append(self, names):
+        with open(self.location, "a") as f:
+            f.write("".join(json.dumps(dict(self.bundles[name], name=name)) + "\n" for name in names))
+
+    def remove(self):
+        with self.lock:
+            self.data_id = None
+            self.bundles = {}
+            try:
+                os.remove(self.location)
+            except OSError:
+                pass
+
+    def start(self, data_id):
+        with self.lock:
+            self.data_id = data_id
+            self.bundles = {}
+        self.save()
+
+    def entry(self, bundle):
+        with self.lock:
+            return self.bundles.get(bundle.name)
+
+    def done(self, bundle):
+        entry = self.entry(bundle)
+        return entry is not None and entry.get("hash") == bundle.hash and entry.get("done", False)
+
+    def bundle_id(self, bundle):
+        entry = self.entry(bundle)
+        return entry.get("bundle_id") if entry is not None else None
+
+    def created(self, bundle, bundle_id):
+        with self.lock:
+            self.bundles[bundle.name] = {"hash": bundle.hash, "bundle_id": bundle_id, "done": False}
+            self.append([bundle.name])
+
+    def finished(self, *bundles):
+        with self.lock:
+            for bundle in bundles:
+                entry = self.bundles.setdefault(bundle.name, {})
+                entry["hash"] = bundle.hash
+                entry["done"] = True
+
+            self.append([bundle.name for bundle in bundles])
@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+
+from anthill_tools import tracer
+
+
+QUEUE_DEPTH = 4
+STOP = object()
+
+
+class Stage(object):
+    """
+    A pool of workers taking items from a bounded queue, so a stage that falls behind slows down the
+    stages feeding it instead of letting work pile up. With batch above 1, a worker takes up to batch
+    items at once, waiting up to linger seconds for more to arrive, and the handler gets a list of them.
+    The handler passes its results on to the next stage.
+    """
+
+    def __init__(self, name, handler, workers=1, capacity=None, batch=1, linger=0):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch = max(1, batch)
+        self.batched = self.batch > 1
+        self.linger = linger
+        self.queue = queue.Queue(maxsize=capacity or self.workers * QUEUE_DEPTH)
+        self.pipeline = None
+        self.threads = []
+        self.lock = threading.Lock()
+
+        self.items = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+        self.started = None
+        self.finished = None
+
+    def start(self, pipeline):
+        self.pipeline = pipeline
+        self.threads = [
+            threading.Thread(target=self.work, name="{0}-{1}".format(self.name, i), daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def take(self):
+        item = self.queue.get()
+        if item is STOP:
+            return [], True
+
+        items = [item]
+        deadline = time.monotonic() + self.linger
+
+        while len(items) < self.batch:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is STOP:
+                return items, True
+            items.append(item)
+
+        return items, False
+
+    def work(self):
+        with tracer().phase(self.name):
+            while True:
+                waited = time.monotonic()
+                items, stop = self.take()
+                started = time.monotonic()
+
+                if items and not self.pipeline.failed:
+                    try:
+                        self.handler(items if self.batched else items[0])
+                    except BaseException as e:
+                        self.pipeline.fail(e)
+
+                finished = time.monotonic()
+
+                with self.lock:
+                    self.waiting += started - waited
+                    if items:
+                        self.items += len(items)
+                        self.busy += finished - started
+                        self.started = started if self.started is None else min(self.started, started)
+                        self.finished = finished
+
+                if stop:
+                    return
+
+    @property
+    def time(self):
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class Pipeline(object):
+    """
+    Runs stages connected one after another. Items of the source are put into the first stage, or
+    passed to feed to pick a stage for each. Once the source is exhausted, each stage is closed after
+    the stages before it, so every item has passed through every stage it was sent to when run()
+    returns. The first error raised by a handler stops the source and makes the remaining items pass
+    through without being handled, then run() raises it.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.lock = threading.Lock()
+        self.error = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def run(self, source, feed=None):
+        feed = feed or self.stages[0].put
+
+        for stage in self.stages:
+            stage.start(self)
+
+        try:
+            for item in source:
+                if self.failed:
+                    break
+                feed(item)
+        except BaseException as e:
+            self.fail(e)
+        finally:
+            for stage in self.stages:
+                stage.close()
+
+        if self.error is not None:
+            raise self.error
+
+
+def report(stages, log=print):
+    log("Stages:")
+    log("  {0:<8} {1:>7} {2:>7} {3:>9} {4:>9} {5:>9}".format(
+        "stage", "workers", "items", "time", "busy", "waiting"))
+
+    for stage in stages:
+        log("  {0:<8} {1:>7} {2:>7} {3:>8.2f}s {4:>8.2f}s {5:>8.2f}s".format(
+            stage.name, stage.workers, stage.items, stage.time, stage.busy, stage.waiting))
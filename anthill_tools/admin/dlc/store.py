@@ -0,0 +1,225 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "content.json")
+# bundles are identified by MD5 on the server, so keying the store on it costs no extra pass over the file
+DEFAULT_CONTENT_HASH = "md5"
+DEFAULT_MAX_AGE = 90 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10000
+CONTENT_HASHES = ["md5", "blake2b", "xxh128"]
+
+
+def hasher(name):
+    if name == "md5":
+        return hashlib.md5()
+
+    if name == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+
+    if name == "xxh128":
+        if xxhash is None:
+            raise ValueError("xxh128 content hashes require xxhash: pip install xxhash")
+        return xxhash.xxh3_128()
+
+    raise ValueError("Unknown content hash: {0}".format(name))
+
+
+class ContentStore(object):
+    """
+    A local index of bundle payloads deployed before, keyed by a content hash of the payload, with the
+    MD5 the DLC service knows it by and the apps and bundle names it was deployed under. A bundle whose
+    payload is in the index can be copied on the server from any of those instead of being uploaded.
+
+    Within a run, the same file is hashed once however many bundles point at it, and the first bundle of
+    each payload is uploaded while the other bundles with that payload wait for it, then copy it.
+
+    Payloads not deployed for max_age seconds are forgotten, and only the max_entries most recently
+    deployed are kept.
+    """
+
+    VERSION = 2
+
+    def __init__(self, location=DEFAULT_LOCATION, content_hash=DEFAULT_CONTENT_HASH, max_age=DEFAULT_MAX_AGE,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        hasher(content_hash)
+
+        self.location = location
+        self.content_hash = content_hash
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.loaded = False
+
+        # path -> (signature, digests) of files hashed in this run, and events of files being hashed
+        self.files = {}
+        self.hashing = {}
+        # content key -> event of the payload being uploaded by another bundle
+        self.uploading = {}
+
+    def key(self, digests):
+        return "{0}:{1}".format(self.content_hash, digests[self.content_hash])
+
+    def load(self):
+        # deliverers sharing a store load it once, the others wait for it; entries recorded meanwhile are newer
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+
+            try:
+                with open(self.location, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+
+            if not isinstance(data, dict) or data.get("version") != ContentStore.VERSION:
+                return
+
+            entries = data.get("entries", {})
+            entries.update(self.entries)
+            self.entries = self.pruned(entries)
+
+    def pruned(self, entries):
+        if self.max_age:
+            oldest = time.time() - self.max_age
+            entries = {key: entry for key, entry in entries.items() if entry.get("deployed", 0) > oldest}
+
+        if self.max_entries and len(entries) > self.max_entries:
+            recent = sorted(entries.items(), key=lambda item: item[1].get("deployed", 0), reverse=True)
+            entries = dict(recent[:self.max_entries])
+
+        return entries
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.entries = self.pruned(self.entries)
+
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            temp_location = "{0}.{1}.tmp".format(self.location, os.getpid())
+            with open(temp_location, "w") as f:
+                json.dump({"version": ContentStore.VERSION, "entries": self.entries}, f)
+            os.replace(temp_location, self.location)
+
+            self.dirty = False
+
+    def digest(self, path, signature, compute):
+        """
+        The digests of a file, calling compute() to hash it unless it was hashed in this run already
+        with the same signature. Bundles of the same file hashed at the same time wait for one of them.
+        """
+
+        path = os.path.abspath(path)
+
+        while True:
+            with self.lock:
+                known = self.files.get(path)
+                if known is not None and known[0] == signature:
+                    return known[1]
+
+                event = self.hashing.get(path)
+                if event is None:
+                    event = self.hashing[path] = threading.Event()
+                    break
+
+            event.wait()
+
+        try:
+            digests = compute()
+            with self.lock:
+                self.files[path] = (signature, digests)
+            return digests
+        finally:
+            with self.lock:
+                self.hashing.pop(path, None)
+            event.set()
+
+    @staticmethod
+    def located(entry, location):
+        if entry is None:
+            return []
+
+        return [(app, name) for source_location, app, name in reversed(entry["bundles"])
+                if source_location == location]
+
+    def sources(self, key, location):
+        """
+        The (app, bundle name) pairs a payload was deployed under to the admin service at location,
+        most recent first.
+        """
+
+        with self.lock:
+            return ContentStore.located(self.entries.get(key), location)
+
+    def deployed(self, key, md5, size, location, app, name):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry["md5"] != md5:
+                entry = self.entries[key] = {"md5": md5, "size": size, "bundles": []}
+
+            entry["deployed"] = time.time()
+
+            source = [location, app, name]
+            if source in entry["bundles"]:
+                entry["bundles"].remove(source)
+            entry["bundles"].append(source)
+            self.dirty = True
+
+    def forget(self, key, location, app, name):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or [location, app, name] not in entry["bundles"]:
+                return
+
+            entry["bundles"].remove([location, app, name])
+            if not entry["bundles"]:
+                del self.entries[key]
+            self.dirty = True
+
+    @contextlib.contextmanager
+    def payload(self, key, location):
+        """
+        Yields the (app, bundle name) pairs the payload can be copied from, like sources(). If there are
+        none, the payload is not being uploaded by another bundle either, so this one should upload it:
+        the others wait until it leaves the block, and copy it if it was recorded with deployed().
+        """
+
+        while True:
+            with self.lock:
+                event = self.uploading.get(key)
+                if event is None:
+                    sources = ContentStore.located(self.entries.get(key), location)
+                    if not sources:
+                        event = self.uploading[key] = threading.Event()
+                    break
+
+            event.wait()
+
+        if sources:
+            yield sources
+            return
+
+        try:
+            yield sources
+        finally:
+            with self.lock:
+                self.uploading.pop(key, None)
+            event.set()
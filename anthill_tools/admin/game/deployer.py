@@ -1,11 +1,28 @@
 import os
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
 
-from anthill_tools import Environment, Login, Admin, ApplicationInfo
+from anthill_tools import Environment, Login, Admin, ApplicationInfo, ServiceError, transport
+from anthill_tools import limit_bandwidth, log_lock, retry_policy, scheduler, tracer
+from anthill_tools.trace import trace_sinks
+from anthill_tools.plan import DeployPlan, HostMeters, LinkMeter, LinkStats, write_plans
+from anthill_tools.retry import DEFAULT_ATTEMPTS
+from anthill_tools.upload import ResumableUpload, DEFAULT_CHUNK_RETRIES
+from anthill_tools.progress import progress_sink, sizeof_fmt
+from anthill_tools.compression import Compression
+from anthill_tools.shaping import POLICIES, SMALLEST_FIRST
+
+
+DEFAULT_JOBS = 2
 
 
 def log(data):
-    print(data)
+    with log_lock:
+        print(data)
 
 
 class DeliverError(Exception):
@@ -17,13 +34,22 @@ class DeliverError(Exception):
 
 
 class Deliverer(object):
-    def __init__(self, environment_location, app_info, filename, switch, username=None, password=None):
+    def __init__(self, environment_location, app_info, filename, switch, username=None, password=None,
+                 chunk_size=None, chunk_retries=DEFAULT_CHUNK_RETRIES, progress=None,
+                 service_cache=True, token_cache=True, compression=None, upload_state=None):
         self.environment_location = environment_location
         self.app_info = app_info
         self.username = username
         self.password = password
         self.filename = filename
         self.switch = switch
+        self.chunk_size = chunk_size
+        self.chunk_retries = chunk_retries
+        self.progress = progress
+        self.service_cache = service_cache
+        self.token_cache = token_cache
+        self.compression = compression
+        self.upload_state = upload_state
 
         self.bundles = []
 
@@ -44,72 +70,366 @@ class Deliverer(object):
     def init(self):
         log("Initializing...")
 
-        self.env = Environment(self.environment_location, self.app_info)
-        self.env.init()
+        with tracer().phase("init"):
+            self.env = Environment(self.environment_location, self.app_info, cache=self.service_cache)
+            self.env.init()
 
-        self.discovery = self.env.discovery
+            self.discovery = self.env.discovery
 
-        services = self.discovery.get_services([Login.ID, Admin.ID, "game"])
+            services = self.discovery.get_services([Login.ID, Admin.ID, "game"])
 
         self.login = services[Login.ID]
         self.admin = services[Admin.ID]
         self.game = services["game"]
 
+    def locations(self):
+        """
+        Locations of the environment and the services the deliverer talks to.
+        """
+
+        services = (self.discovery, self.login, self.admin, self.game)
+        return [self.environment_location] + [service.location for service in services if service is not None]
+
     def create_version(self, version_name, create_version_env):
         self.create_version_name = version_name
         self.create_version_env = create_version_env
 
-    def deliver(self):
+    def auth(self):
         log("Authenticating...")
 
         rights = ["admin", "game_deploy_admin"]
         if self.create_version_name:
             rights.append("env_admin")
 
-        self.login.auth_dev(self.username, self.password, rights, options={
-            "as": "deployer"
-        })
+        with tracer().phase("auth"):
+            self.login.auth_dev(self.username, self.password, rights, options={
+                "as": "deployer"
+            }, cache=self.token_cache)
+
+    def authenticate(self):
+        self.auth()
 
         if self.create_version_name:
             log("Creating new version {0} for dev {1}...".format(self.create_version_name, self.create_version_env))
 
             try:
-                self.admin.api_post("environment", "new_app_version", "create", {
-                    "app_id": self.app_info.app_name
-                }, {
-                    "version_name": self.create_version_name,
-                    "version_env": self.create_version_env
-                })
+                with tracer().phase("create"):
+                    self.admin.api_post("environment", "new_app_version", "create", {
+                        "app_id": self.app_info.app_name
+                    }, {
+                        "version_name": self.create_version_name,
+                        "version_env": self.create_version_env
+                    })
             except Exception as e:
                 log("Version was not created (already exist?)")
 
+    @property
+    def context(self):
+        return {
+            "game_name": self.app_info.app_name,
+            "game_version": self.app_info.app_version
+            if self.create_version_name is None else self.create_version_name
+        }
+
+    @property
+    def args(self):
+        return {
+            "switch_to_new": self.switch
+        }
+
+    @property
+    def headers(self):
+        return {
+            "X-File-Name": os.path.basename(self.filename)
+        }
+
+    def resumable(self):
+        return ResumableUpload(self.admin, "game", "deploy", self.context, self.filename, args=self.args,
+                               headers=self.headers, chunk_size=self.chunk_size, retries=self.chunk_retries,
+                               state_location=self.upload_state, progress=self.progress)
+
+    def upload(self):
         log("Deploying...")
 
-        with open(self.filename, "rb") as f:
-            self.admin.api_put("game", "deploy", {
-                "game_name": self.app_info.app_name,
-                "game_version": self.app_info.app_version
-                if self.create_version_name is None else self.create_version_name
-            }, f, args={
-                "switch_to_new": self.switch
-            }, headers={
-                "X-File-Name": os.path.basename(self.filename)
-            })
+        with tracer().phase("upload"):
+            if self.chunk_size:
+                if self.compression is not None:
+                    log("Compression is not applied to chunked uploads")
+
+                self.resumable().upload()
+            else:
+                with open(self.filename, "rb") as f:
+                    self.admin.api_put("game", "deploy", self.context, f, args=self.args, headers=self.headers,
+                                       progress=self.progress, compression=self.compression, idempotent=False)
 
         log("Deployed!")
 
+    def plan(self, target):
+        """
+        Authenticates and returns what the upload would do, without creating a version or uploading
+        anything. A chunked upload interrupted before only counts what is left of it. Upload sizes are
+        before compression.
+        """
+
+        started = time.monotonic()
+        self.auth()
+
+        size = os.path.getsize(self.filename)
+        offset = 0
+
+        if self.chunk_size and size:
+            state = self.resumable().state
+            state.load()
+            if state.offset < size:
+                offset = state.offset
+
+        plan = DeployPlan(target)
+        plan.gather_time = time.monotonic() - started
+        plan.uploads = 1
+        plan.upload_bytes = size - offset
+        plan.requests = (math.ceil((size - offset) / self.chunk_size) if self.chunk_size and size else 1) + \
+            bool(self.create_version_name)
+        plan.rounds = plan.requests
+
+        return plan
+
+    def deliver(self):
+        self.authenticate()
+        self.upload()
+
+
+class Target(object):
+    def __init__(self, environment_location, application_name, application_version, gamespace,
+                 create_version=None, create_version_env=None):
+        self.environment_location = environment_location
+        self.app_info = ApplicationInfo(application_name, application_version, gamespace)
+        self.create_version = create_version
+        self.create_version_env = create_version_env
+
+        self.deliverer = None
+        self.error = None
+        self.timings = {}
+        self.plan = None
+
+    @staticmethod
+    def parse(config):
+        try:
+            return Target(
+                config["environment"], config["name"], config["version"], config["gamespace"],
+                create_version=config.get("create_version"),
+                create_version_env=config.get("create_version_env"))
+        except KeyError as e:
+            raise DeliverError("Target has no {0} option".format(str(e)))
+
+    def __str__(self):
+        return "{0} {1}/{2}@{3}".format(
+            self.environment_location, self.app_info.app_name,
+            self.create_version or self.app_info.app_version, self.app_info.gamespace)
+
+    def locations(self):
+        return self.deliverer.locations() if self.deliverer is not None else [self.environment_location]
+
+    def run(self, phase, method, *args):
+        if self.error is not None:
+            return
+
+        started = time.monotonic()
+
+        try:
+            method(*args)
+        except (ServiceError, DeliverError, OSError, ValueError) as e:
+            self.error = "{0} failed: {1}".format(phase, str(e))
+            log("{0}: {1}".format(self, self.error))
+        finally:
+            self.timings[phase] = time.monotonic() - started
+
+    def prepare(self, filename, switch, kwargs):
+        self.deliverer = Deliverer(self.environment_location, self.app_info, filename, switch, **kwargs)
+
+        if self.create_version and self.create_version_env:
+            self.deliverer.create_version(self.create_version, self.create_version_env)
+
+    def init(self, filename, switch, kwargs):
+        self.run("init", self.prepare, filename, switch, kwargs)
+        self.run("auth", lambda: self.deliverer.authenticate())
+
+    def upload(self):
+        self.run("upload", lambda: self.deliverer.upload())
+
+    def plan_deploy(self, filename, switch, kwargs):
+        def plan():
+            self.plan = self.deliverer.plan(str(self))
+
+        self.run("init", self.prepare, filename, switch, kwargs)
+        self.run("auth", plan)
+
+
+def log_retries():
+    stats = retry_policy().stats
+    if stats.retries:
+        log("Retries: {0}".format(str(stats)))
+
+
+def summary(targets):
+    log("Deploy summary:")
+
+    for target in targets:
+        timings = ", ".join(
+            "{0} {1}".format(phase, "{0:.1f}s".format(target.timings[phase]) if phase in target.timings else "-")
+            for phase in ("init", "auth", "upload"))
+
+        log("  {0} {1}: {2}{3}".format(
+            "OK  " if target.error is None else "FAIL",
+            target,
+            timings,
+            "" if target.error is None else " ({0})".format(target.error)))
+
+    scheduler().report(log)
+    log_retries()
+
+
+def report_plans(plans, jobs, plan_output, max_upload):
+    for plan in plans:
+        plan.report(log)
+
+    total = plans[0]
+
+    if len(plans) > 1:
+        total = DeployPlan.combine("{0} targets".format(len(plans)), plans, jobs)
+        total.report(log)
+        plans = plans + [total]
+
+    if plan_output:
+        write_plans(plans, plan_output)
+
+    if max_upload is not None and total.upload_bytes > max_upload:
+        raise DeliverError("The deploy would upload {0}, more than the limit of {1}".format(
+            sizeof_fmt(total.upload_bytes), sizeof_fmt(max_upload)))
+
+    return total
+
+
+def deploy_many(targets, filename, switch, username=None, password=None, jobs=DEFAULT_JOBS,
+                retries=None, trace=None, plan=False, plan_output=None, max_upload=None, bandwidth=None,
+                stream_bandwidth=None, schedule=None, bandwidth_file=None, link_stats=None, **kwargs):
+    retry_policy().reset(retries)
+    limit_bandwidth(bandwidth, stream_bandwidth, schedule, bandwidth_file)
+
+    if isinstance(trace, str):
+        trace = trace_sinks(trace, log)
+
+    meters = HostMeters()
+    link_stats = LinkStats(link_stats)
+
+    with tracer().hooked((trace or []) + [meters]):
+        targets = deploy_targets(targets, filename, switch, username, password, jobs, plan, kwargs)
+
+    if plan:
+        for target in targets:
+            target.plan.measure(meters.meter(target.locations()), link_stats.get(target.environment_location))
+        return report_plans([target.plan for target in targets], jobs, plan_output, max_upload)
+
+    meters.store(link_stats, targets)
+
+    return targets
+
+
+def deploy_targets(targets, filename, switch, username, password, jobs, plan, kwargs):
+    if isinstance(kwargs.get("progress"), str):
+        kwargs["progress"] = progress_sink(kwargs["progress"])
+
+    if isinstance(kwargs.get("compression"), str):
+        kwargs["compression"] = Compression.parse(kwargs["compression"])
+
+    kwargs.update({
+        "username": username,
+        "password": password
+    })
+
+    targets = [
+        target if isinstance(target, Target) else Target.parse(target)
+        for target in targets
+    ]
+
+    if not targets:
+        raise DeliverError("No targets to deploy")
+
+    jobs = max(1, jobs)
+    transport().reserve(max(len(targets), jobs))
+
+    log("Initializing {0} targets...".format(len(targets)))
+
+    if plan:
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            for _ in executor.map(lambda target: target.plan_deploy(filename, switch, kwargs), targets):
+                pass
+
+        failed = [target for target in targets if target.error is not None]
+        if failed:
+            raise DeliverError("Failed to plan {0} of {1} targets".format(len(failed), len(targets)))
+
+        return targets
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        for _ in executor.map(lambda target: target.init(filename, switch, kwargs), targets):
+            pass
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for _ in executor.map(lambda target: target.upload(), targets):
+            pass
+
+    summary(targets)
+
+    failed = [target for target in targets if target.error is not None]
+    if failed:
+        raise DeliverError("Failed to deploy to {0} of {1} targets".format(len(failed), len(targets)))
+
+    return targets
+
 
 def deploy(environment_location, application_name, application_version,
            gamespace, filename, switch, username=None, password=None,
-           create_version=None, create_version_env=None):
+           create_version=None, create_version_env=None, chunk_size=None, chunk_retries=DEFAULT_CHUNK_RETRIES,
+           progress=None, service_cache=True, token_cache=True, compression=None, retries=None,
+           trace=None, plan=False, plan_output=None, max_upload=None, bandwidth=None, stream_bandwidth=None,
+           schedule=None, bandwidth_file=None, upload_state=None, link_stats=None):
+    retry_policy().reset(retries)
+    limit_bandwidth(bandwidth, stream_bandwidth, schedule, bandwidth_file)
+
     app_info = ApplicationInfo(application_name, application_version, gamespace)
 
-    d = Deliverer(environment_location, app_info, filename, switch, username=username, password=password)
+    if isinstance(progress, str):
+        progress = progress_sink(progress)
+
+    if isinstance(compression, str):
+        compression = Compression.parse(compression)
+
+    if isinstance(trace, str):
+        trace = trace_sinks(trace, log)
+
+    meter = LinkMeter()
+    link_stats = LinkStats(link_stats)
 
-    if create_version and create_version_env:
-        d.create_version(create_version, create_version_env)
+    with tracer().hooked((trace or []) + [meter]):
+        d = Deliverer(environment_location, app_info, filename, switch, username=username, password=password,
+                      chunk_size=chunk_size, chunk_retries=chunk_retries, progress=progress,
+                      service_cache=service_cache, token_cache=token_cache, compression=compression,
+                      upload_state=upload_state)
 
-    d.deliver()
+        if create_version and create_version_env:
+            d.create_version(create_version, create_version_env)
+
+        if plan:
+            result = d.plan("{0} {1}/{2}@{3}".format(
+                environment_location, application_name, create_version or application_version, gamespace))
+            result.measure(meter, link_stats.get(environment_location))
+            return report_plans([result], 1, plan_output, max_upload)
+
+        d.deliver()
+
+    link_stats.update(environment_location, meter)
+    scheduler().report(log)
+    log_retries()
 
 
 if __name__ == "__main__":
@@ -135,17 +455,82 @@ if __name__ == "__main__":
                       help="Anthill Password", default=os.environ.get("ANTHILL_PASSWORD"))
     parser.add_option("-s", "--switch", type="string", dest="switch_to_new",
                       help="Switch application to deployed version automatically", default="true")
+    parser.add_option("--chunk-size", type="int", dest="chunk_size", default=0,
+                      help="Upload the file in resumable chunks of this many megabytes")
+    parser.add_option("--chunk-retries", type="int", dest="chunk_retries", default=DEFAULT_CHUNK_RETRIES,
+                      help="Amount of retries for each failed chunk")
+    parser.add_option("--progress", type="string", dest="progress", default="bar",
+                      help="Upload progress output: bar, json:<file> or none")
+    parser.add_option("--no-service-cache", action="store_false", dest="service_cache", default=True,
+                      help="Do not use cached environment and discovery responses")
+    parser.add_option("--no-token-cache", action="store_false", dest="token_cache", default=True,
+                      help="Always authenticate, do not reuse cached access tokens")
+    parser.add_option("--compress", type="string", dest="compress", default="none",
+                      help="Compress uploads: none, gzip[:level], zstd[:level] or auto[:codec[:level]]")
+    parser.add_option("-t", "--targets", type="string", dest="targets", default="",
+                      help="JSON file with a list of targets to deploy the same file to")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=DEFAULT_JOBS,
+                      help="Amount of targets to upload to in parallel")
+    parser.add_option("--trace", type="string", dest="trace", default="",
+                      help="Trace requests and phases, comma separated: summary, json:<file>, otel:<file>")
+    parser.add_option("--retries", type="int", dest="retries", default=DEFAULT_ATTEMPTS,
+                      help="Amount of retries for each failed request, 0 to disable")
+    parser.add_option("--plan", action="store_true", dest="plan", default=False,
+                      help="Only show what the deploy would do and how long it would take, change nothing")
+    parser.add_option("--plan-output", type="string", dest="plan_output", default="",
+                      help="Also write the plan into this JSON file")
+    parser.add_option("--max-upload", type="float", dest="max_upload", default=0,
+                      help="With --plan, fail if more than this many megabytes would be uploaded")
+    parser.add_option("--bandwidth", type="float", dest="bandwidth", default=0,
+                      help="Megabytes per second all uploads together may use, unlimited by default")
+    parser.add_option("--stream-bandwidth", type="float", dest="stream_bandwidth", default=0,
+                      help="Megabytes per second each upload may use, unlimited by default")
+    parser.add_option("--schedule", type="choice", dest="schedule", default=SMALLEST_FIRST, choices=POLICIES,
+                      help="How limited bandwidth is shared between uploads: " + ", ".join(POLICIES))
+    parser.add_option("--bandwidth-file", type="string", dest="bandwidth_file", default="",
+                      help="JSON file with bandwidth limits, applied again whenever it changes")
 
     (options, args) = parser.parse_args()
 
     defaults = vars(parser.get_default_values())
+    target_options = ["environment_location", "application_name", "application_version", "gamespace"]
 
     for k, v in vars(options).items():
+        if options.targets and k in target_options:
+            continue
         if v is None and defaults.get(k) is None:
             parser.print_help()
             exit(1)
 
     try:
+        if options.targets:
+            with open(options.targets, "r") as f:
+                targets_config = json.load(f)
+
+            deploy_many(
+                targets_config,
+                filename=options.filename,
+                switch=options.switch_to_new,
+                username=options.anthill_username,
+                password=options.anthill_password,
+                jobs=options.jobs,
+                chunk_size=options.chunk_size * 1024 * 1024,
+                chunk_retries=options.chunk_retries,
+                progress=options.progress,
+                service_cache=options.service_cache,
+                token_cache=options.token_cache,
+                compression=options.compress,
+                retries=options.retries,
+                trace=options.trace,
+                plan=options.plan,
+                plan_output=options.plan_output,
+                max_upload=options.max_upload * 1024 * 1024 if options.max_upload else None,
+                bandwidth=options.bandwidth * 1024 * 1024 or None,
+                stream_bandwidth=options.stream_bandwidth * 1024 * 1024 or None,
+                schedule=options.schedule,
+                bandwidth_file=options.bandwidth_file)
+            exit(0)
+
         deploy(
             environment_location=options.environment_location,
             application_name=options.application_name,
@@ -156,7 +541,22 @@ if __name__ == "__main__":
             filename=options.filename,
             switch=options.switch_to_new,
             username=options.anthill_username,
-            password=options.anthill_password)
+            password=options.anthill_password,
+            chunk_size=options.chunk_size * 1024 * 1024,
+            chunk_retries=options.chunk_retries,
+            progress=options.progress,
+            service_cache=options.service_cache,
+            token_cache=options.token_cache,
+            compression=options.compress,
+            retries=options.retries,
+            trace=options.trace,
+            plan=options.plan,
+            plan_output=options.plan_output,
+            max_upload=options.max_upload * 1024 * 1024 if options.max_upload else None,
+            bandwidth=options.bandwidth * 1024 * 1024 or None,
+            stream_bandwidth=options.stream_bandwidth * 1024 * 1024 or None,
+            schedule=options.schedule,
+            bandwidth_file=options.bandwidth_file)
     except DeliverError as e:
         print("ERROR: " + str(e))
         exit(1)
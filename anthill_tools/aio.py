@@ -0,0 +1,653 @@
+import asyncio
+import functools
+import json
+import os
+import time
+from urllib.parse import urlencode
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from anthill_tools import ServiceError, TokenStore, IDEMPOTENT_METHODS, log
+from anthill_tools import service_cache, token_store, token_expired, replayable, retry_policy, scheduler, tracer
+from anthill_tools.progress import Transfer
+
+
+DEFAULT_READ_SIZE = 1024 * 1024
+
+
+class Response(object):
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+
+class Transport(object):
+    DEFAULT_TIMEOUT = (10, 300)
+    DEFAULT_UPLOAD_TIMEOUT = (10, None)
+
+    def __init__(self, limit=100, limit_per_host=10, timeout=DEFAULT_TIMEOUT, keep_alive=True,
+                 upload_timeout=DEFAULT_UPLOAD_TIMEOUT):
+        if aiohttp is None:
+            raise ImportError("anthill_tools.aio requires aiohttp: pip install anthill_tools[aio]")
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+        self.keep_alive = keep_alive
+        self.session = None
+
+    def new_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            force_close=not self.keep_alive)
+
+        return aiohttp.ClientSession(connector=connector, timeout=Transport.client_timeout(self.timeout))
+
+    @staticmethod
+    def client_timeout(timeout):
+        connect_timeout, read_timeout = timeout
+        return aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+    async def request(self, method, url, **kwargs):
+        if self.session is None or self.session.closed:
+            self.session = self.new_session()
+
+        if isinstance(kwargs.get("timeout"), tuple):
+            kwargs["timeout"] = Transport.client_timeout(kwargs["timeout"])
+
+        async with self.session.request(method, url, **kwargs) as response:
+            content = await response.read()
+            return Response(response.status, response.headers, content)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+__transport__ = None
+
+
+def transport():
+    global __transport__
+
+    if __transport__ is None:
+        __transport__ = Transport()
+    return __transport__
+
+
+async def configure_transport(**kwargs):
+    global __transport__
+
+    if __transport__ is not None:
+        await __transport__.close()
+    __transport__ = Transport(**kwargs)
+    return __transport__
+
+
+async def close():
+    if __transport__ is not None:
+        await __transport__.close()
+
+
+def clean(values):
+    if values is None or not isinstance(values, dict):
+        return values
+    return {key: str(value) for key, value in values.items() if value is not None}
+
+
+async def blocking(function, *args, **kwargs):
+    """
+    Calls a function doing blocking I/O, like the file backed caches shared with the synchronous
+    client, on the default executor, so it does not stall the event loop.
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+
+def body_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, dict):
+        return len(urlencode(data))
+    if isinstance(data, (str, bytes)):
+        return len(data)
+    return getattr(data, "sent_bytes", None) or 0
+
+
+async def send(method, url, **kwargs):
+    try:
+        response = await transport().request(method, url, **kwargs)
+    except aiohttp.ClientConnectorError as e:
+        error = ServiceError(599, str(e))
+        error.not_sent = True
+        raise error
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        raise ServiceError(599, str(e) or "Timeout")
+
+    if response.status_code >= 300:
+        raise ServiceError(response.status_code, response.text, response)
+
+    return response
+
+
+async def request(method, url, idempotent=None, retry=None, trace=None, **kwargs):
+    """
+    The coroutine counterpart of anthill_tools.request: the same retry policy, idempotency rules and
+    tracer hooks. File bodies are passed as FileUpload, so they can be read again for a retry.
+    """
+
+    for field in ("params", "data"):
+        if field in kwargs:
+            kwargs[field] = clean(kwargs[field])
+
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+
+    policy = retry_policy() if retry is None else retry
+    data = kwargs.get("data")
+
+    started = time.monotonic()
+    attempt = 0
+
+    while True:
+        if isinstance(data, FileUpload):
+            kwargs["data"] = data.chunks()
+
+        attempt_started = time.time()
+        attempt_clock = time.monotonic()
+
+        try:
+            response = await send(method, url, **kwargs)
+        except ServiceError as e:
+            traced(method, url, trace, data, attempt_started, attempt_clock, attempt, e.response, e)
+
+            if not policy or not replayable(data) or \
+                    not policy.should_retry(e, attempt, time.monotonic() - started, idempotent):
+                if policy and attempt:
+                    policy.stats.done(False)
+                raise
+
+            delay = policy.delay(attempt)
+            attempt += 1
+            policy.stats.retry(e.code, delay)
+
+            log("{0} {1} failed ({2}), retry {3} in {4:.1f}s...".format(
+                method, url, e.code, attempt, delay))
+
+            await asyncio.sleep(delay)
+
+            if isinstance(data, FileUpload):
+                data.rewind()
+        else:
+            traced(method, url, trace, data, attempt_started, attempt_clock, attempt, response)
+
+            if attempt:
+                policy.stats.done(True)
+            return response
+
+
+def traced(method, url, attributes, data, started, clock, attempt, response=None, error=None):
+    if not tracer().enabled:
+        return
+
+    tracer().request(
+        started, time.monotonic() - clock, method=method, url=url,
+        status=response.status_code if response is not None else getattr(error, "code", None),
+        bytes_in=len(response.content) if response is not None else 0,
+        bytes_out=body_size(data), attempt=attempt, error=str(error) if error is not None else None,
+        **(attributes or {}))
+
+
+async def get(url, params=None, **kwargs):
+    return await request("GET", url, params=params, **kwargs)
+
+
+async def post(url, data=None, **kwargs):
+    return await request("POST", url, data=data, **kwargs)
+
+
+async def put(url, data=None, **kwargs):
+    return await request("PUT", url, data=data, **kwargs)
+
+
+class FileUpload(object):
+    """
+    A file uploaded from its current position, read on the default executor. Each attempt of a request
+    reads it from that position again, reporting progress to transfer and waiting for bandwidth from
+    the scheduler stream, if any.
+    """
+
+    def __init__(self, f, size, transfer=None, stream=None, read_size=DEFAULT_READ_SIZE):
+        self.f = f
+        self.size = size
+        self.transfer = transfer
+        self.stream = stream
+        self.read_size = read_size
+        self.start = f.tell() if hasattr(f, "tell") else None
+        # bytes read by the current attempt, which is what the HTTP client sent
+        self.sent_bytes = 0
+
+    @property
+    def rewindable(self):
+        return self.start is not None and hasattr(self.f, "seek")
+
+    def rewind(self):
+        self.f.seek(self.start)
+        if self.transfer is not None:
+            self.transfer.rewind(self.transfer.initial)
+
+    async def chunks(self):
+        self.sent_bytes = 0
+
+        while True:
+            data = await blocking(self.f.read, self.read_size)
+            if not data:
+                break
+            self.sent_bytes += len(data)
+            if self.stream is not None:
+                await blocking(self.stream.consume, len(data))
+            if self.transfer is not None:
+                self.transfer.update(len(data))
+            yield data
+
+        if self.transfer is not None:
+            self.transfer.finish()
+
+
+class Service(object):
+    def __init__(self, location):
+        self.location = location
+        self.environment = None
+        self.service_cache = None
+        self.service_cache_keys = None
+        log("New service: {0} at {1}".format(self.ID, self.location))
+
+    @property
+    def token(self):
+        if self.environment is not None:
+            return self.environment.access_token
+        return None
+
+    def authorize(self, method, kwargs):
+        token = self.token
+        if method == "POST":
+            kwargs["data"]["access_token"] = token
+        else:
+            kwargs["params"]["access_token"] = token
+        return token
+
+    async def request(self, method, url, authorized=False, **kwargs):
+        kwargs.setdefault("trace", {"service": self.ID})
+        data = kwargs.get("data")
+        refreshed = False
+
+        while True:
+            token = self.authorize(method, kwargs) if authorized else None
+
+            try:
+                return await request(method, self.location + "/" + url, **kwargs)
+            except ServiceError as e:
+                if e.code == 599 and self.service_cache_keys:
+                    log("Cached location of {0} is not reachable, invalidating the cache".format(self.ID))
+                    await blocking(self.service_cache.invalidate, *self.service_cache_keys)
+                    self.service_cache_keys = None
+
+                if not authorized or refreshed or not token_expired(e) or not replayable(data):
+                    raise
+
+                login = self.environment.login_service if self.environment is not None else None
+                if login is None or not await login.reauth(token):
+                    raise
+
+                refreshed = True
+
+                if isinstance(data, FileUpload):
+                    data.rewind()
+
+    async def get(self, url, params):
+        result = await self.request("GET", url, authorized=True, params=params)
+        return result.json()
+
+    async def post(self, url, data, idempotent=False):
+        result = await self.request("POST", url, authorized=True, data=data, idempotent=idempotent)
+        return result.json()
+
+
+class Discovery(Service):
+    ID = "discovery"
+
+    def __init__(self, location):
+        super(Discovery, self).__init__(location)
+        self.cache = {}
+        self.cache_key = None
+        self.environment_keys = None
+
+    def new_service(self, service_id, location, args):
+        _args, _kwargs = args.get(service_id, ([], {}))
+        service = Services.new_service(service_id, location, *_args, **_kwargs)
+        service.environment = self.environment
+        service.service_cache = self.service_cache
+        service.service_cache_keys = self.environment_keys
+        self.cache[service_id] = service
+        return service
+
+    async def get_service(self, service_id, *args, **kwargs):
+        services = await self.get_services([service_id], {service_id: (args, kwargs)})
+        return services[service_id]
+
+    async def get_services(self, services, args=None):
+
+        if args is None:
+            args = {}
+
+        if not isinstance(services, list):
+            raise ServiceError(400, "Service should be a list")
+
+        result = {}
+        to_request = []
+
+        for service_id in services:
+            cached = self.cache.get(service_id, None)
+            if cached:
+                result[service_id] = cached
+            else:
+                to_request.append(service_id)
+
+        if to_request and self.service_cache is not None:
+            locations = await blocking(self.service_cache.get, self.cache_key) or {}
+
+            for service_id in list(to_request):
+                location = locations.get(service_id)
+                if location:
+                    result[service_id] = self.new_service(service_id, location, args)
+                    to_request.remove(service_id)
+
+        if not to_request:
+            return result
+
+        log("Looking for services: " + ",".join(to_request))
+
+        response = await self.request("GET", "services/" + ",".join(to_request))
+        response_json = response.json()
+
+        for service_id, location in response_json.items():
+            result[service_id] = self.new_service(service_id, location, args)
+
+        if self.service_cache is not None:
+            await blocking(self.service_cache.update, self.cache_key, response_json)
+
+        return result
+
+
+class Environment(Service):
+    ID = "environment"
+
+    def __init__(self, location, app_info, cache=True):
+        super(Environment, self).__init__(location)
+
+        self.app_info = app_info
+        self.env = {}
+        self.discovery = None
+        self.environment = self
+        self.access_token = None
+        self.login_service = None
+
+        if cache is True:
+            self.service_cache = service_cache()
+        elif cache:
+            self.service_cache = cache
+
+    async def init(self):
+        path = self.app_info.app_name + "/" + self.app_info.app_version
+        environment_key = "environment:" + self.location + "/" + path
+        discovery_key = "discovery:" + self.location + "/" + path
+
+        env = None
+
+        if self.service_cache is not None:
+            env = await blocking(self.service_cache.get, environment_key)
+
+        if env is None:
+            response = await self.request("GET", path)
+            env = response.json()
+
+            if self.service_cache is not None:
+                await blocking(self.service_cache.put, environment_key, env)
+        else:
+            log("Using cached environment response")
+
+        self.env = env
+
+        try:
+            self.discovery = Discovery(self.env["discovery"])
+        except KeyError:
+            raise ServiceError(500, "No discovery in environment info!")
+
+        self.discovery.environment = self
+        self.discovery.cache_key = discovery_key
+        self.discovery.environment_keys = (environment_key, discovery_key)
+
+        if self.service_cache is not None:
+            self.discovery.service_cache = self.service_cache
+            self.discovery.service_cache_keys = self.discovery.environment_keys
+
+        log("Got environment response!")
+        log("Discovery: " + self.discovery.location)
+
+
+class Login(Service):
+    ID = "login"
+
+    def __init__(self, location):
+        super(Login, self).__init__(location)
+        self.lock = asyncio.Lock()
+        self.auth_data = None
+        self.store = None
+        self.store_key = None
+
+    def set_token(self, token):
+        self.environment.access_token = token
+        self.environment.login_service = self
+
+    async def auth(self, credential, scopes, options, cache=True):
+        if not isinstance(scopes, list):
+            raise ServiceError(400, "Scopes should be a list")
+
+        app_info = self.environment.app_info
+
+        data = {
+            "credential": credential,
+            "scopes": ",".join(scopes),
+            "gamespace": app_info.gamespace,
+            "full": "true"
+        }
+
+        data.update(options)
+
+        self.auth_data = data
+
+        if cache is True:
+            self.store = token_store()
+        else:
+            self.store = cache or None
+
+        if self.store is not None:
+            self.store_key = TokenStore.key(
+                self.environment.location, app_info.gamespace, credential, options.get("username"), scopes, options)
+
+            token = await blocking(self.store.get, self.store_key)
+
+            if token is not None:
+                self.set_token(token)
+                log("Authenticated with a cached token!")
+                return token
+
+        return await self.authenticate()
+
+    async def authenticate(self):
+        response = await self.request("POST", "auth", data=dict(self.auth_data))
+        response_json = response.json()
+
+        token = response_json["token"]
+        self.set_token(token)
+
+        if self.store is not None:
+            await blocking(self.store.put, self.store_key, token, response_json.get("expires_in"))
+
+        log("Authenticated!")
+
+        return token
+
+    async def reauth(self, expired_token):
+        async with self.lock:
+            if self.auth_data is None:
+                return False
+
+            if self.token != expired_token:
+                return True
+
+            if self.store is not None:
+                await blocking(self.store.invalidate, self.store_key)
+
+            log("Access token has expired, authenticating again...")
+
+            try:
+                await self.authenticate()
+            except ServiceError:
+                return False
+
+            return True
+
+    async def auth_dev(self, username, password, scopes, options=None, cache=True):
+
+        if options is None:
+            options = {}
+
+        options.update({
+            "username": username,
+            "key": password
+        })
+
+        return await self.auth("dev", scopes, options, cache=cache)
+
+
+class Admin(Service):
+    ID = "admin"
+
+    def __init__(self, location):
+        super(Admin, self).__init__(location)
+
+    @staticmethod
+    def find_entry(response, entry_id):
+        for entry in response:
+            if entry.get("id") == entry_id:
+                return entry
+        return None
+
+    async def api_get(self, service, action, context):
+        return await self.request("GET", "api", authorized=True, params={
+            "service": service,
+            "context": json.dumps(context),
+            "action": action
+        }, trace={"service": service, "action": action})
+
+    async def api_post(self, service, action, method, context, data, idempotent=False):
+
+        args = {
+            "service": service,
+            "method": method,
+            "context": json.dumps(context),
+            "action": action
+        }
+
+        args.update(data)
+
+        return await self.request("POST", "api", authorized=True, data=args, idempotent=idempotent,
+                                  trace={"service": service, "action": "{0}:{1}".format(action, method)})
+
+    async def api_put(self, service, action, context, data, args=None, progress=None, weight=1, idempotent=False,
+                      **kwargs):
+
+        stream = None
+
+        if hasattr(data, "read"):
+            name = os.path.basename(getattr(data, "name", "") or action)
+            total = os.fstat(data.fileno()).st_size - data.tell() if hasattr(data, "fileno") else 0
+
+            if scheduler().shaping:
+                stream = scheduler().stream(name, total, weight)
+
+            data = FileUpload(data, total, Transfer(name, total, progress) if progress is not None else None, stream)
+
+            if total:
+                kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"Content-Length": str(total)})
+
+        kwargs.setdefault("timeout", transport().upload_timeout)
+
+        request_args = {
+            "service": service,
+            "context": json.dumps(context),
+            "action": action,
+            "args": json.dumps(args) if args else "{}"
+        }
+
+        try:
+            result = await self.request("PUT", "service/upload", authorized=True, params=request_args,
+                                        data=data, idempotent=idempotent,
+                                        trace={"service": service, "action": action}, **kwargs)
+        except ServiceError as e:
+            if e.code == 444:
+                return e.response
+
+            if e.code == 244:
+                return e.response
+
+            raise e
+        finally:
+            if stream is not None:
+                stream.close()
+        return result
+
+
+class GenericService(Service):
+    def __init__(self, service_id, location):
+        self.ID = service_id
+        super(GenericService, self).__init__(location)
+        log("No service {0} registered, used GenericService".format(service_id))
+
+
+class Services:
+    SERVICES = [
+        Environment,
+        Discovery,
+        Login,
+        Admin
+    ]
+
+    __wrappers__ = {
+        service.ID: service
+        for service in SERVICES
+    }
+
+    @staticmethod
+    def new_service(service_id, location, *args, **kwargs):
+        try:
+            return Services.__wrappers__[service_id](location, *args, **kwargs)
+        except KeyError:
+            return GenericService(service_id, location)
+
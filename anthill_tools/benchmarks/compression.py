@@ -0,0 +1,100 @@
+import os
+import time
+from optparse import OptionParser
+
+from anthill_tools.compression import CompressedReader, CODECS, zstandard
+from anthill_tools.progress import sizeof_fmt
+
+
+BENCHMARK_LEVELS = {
+    "gzip": [1, 3, 6, 9],
+    "zstd": [1, 3, 6, 12, 19]
+}
+
+DEFAULT_SIZE = 64
+
+
+def run(f, codec, level):
+    reader = CompressedReader(f, codec, level)
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    for _ in reader:
+        pass
+
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    return reader.raw_bytes, reader.compressed_bytes, elapsed, cpu
+
+
+def benchmark(filename, codecs, levels=None, size=DEFAULT_SIZE * 1024 * 1024):
+    results = []
+
+    print("{0:<6} {1:>5} {2:>10} {3:>10} {4:>7} {5:>12} {6:>10}".format(
+        "codec", "level", "raw", "compressed", "ratio", "throughput", "cpu/GB"))
+
+    for codec in codecs:
+        for level in (levels or BENCHMARK_LEVELS[codec]):
+            with open(filename, "rb") as f:
+                raw, compressed, elapsed, cpu = run(LimitedReader(f, size), codec, level)
+
+            if not raw:
+                continue
+
+            result = {
+                "codec": codec,
+                "level": level,
+                "raw": raw,
+                "compressed": compressed,
+                "ratio": float(compressed) / raw,
+                "throughput": raw / elapsed if elapsed else 0,
+                "cpu_per_gb": cpu * (1024 ** 3) / raw
+            }
+            results.append(result)
+
+            print("{0:<6} {1:>5} {2:>10} {3:>10} {4:>7.3f} {5:>10}/s {6:>9.1f}s".format(
+                codec, level, sizeof_fmt(raw), sizeof_fmt(compressed), result["ratio"],
+                sizeof_fmt(result["throughput"]), result["cpu_per_gb"]))
+
+    return results
+
+
+class LimitedReader(object):
+    def __init__(self, f, limit):
+        self.f = f
+        self.remaining = limit
+
+    def read(self, size):
+        data = self.f.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(usage="%prog [options] <file>")
+    parser.add_option("-c", "--codecs", type="string", dest="codecs", default=",".join(CODECS),
+                      help="Codecs to benchmark, comma separated")
+    parser.add_option("-l", "--levels", type="string", dest="levels", default="",
+                      help="Compression levels to benchmark, comma separated")
+    parser.add_option("-s", "--size", type="int", dest="size", default=DEFAULT_SIZE,
+                      help="Amount of megabytes of the file to compress")
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1 or not os.path.isfile(args[0]):
+        parser.print_help()
+        exit(1)
+
+    codecs = [codec for codec in options.codecs.split(",") if codec]
+
+    if "zstd" in codecs and zstandard is None:
+        print("zstandard is not installed, skipping zstd")
+        codecs.remove("zstd")
+
+    benchmark(
+        args[0], codecs,
+        levels=[int(level) for level in options.levels.split(",") if level] or None,
+        size=options.size * 1024 * 1024)
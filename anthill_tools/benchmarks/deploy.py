@@ -0,0 +1,250 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+import anthill_tools
+from anthill_tools import Environment, ApplicationInfo, Login, Admin, ServiceError
+from anthill_tools.cache import ServiceCache
+from anthill_tools.mock import MockAnthill
+from anthill_tools.progress import sizeof_fmt
+from anthill_tools.admin.dlc import deployer as dlc_deployer
+from anthill_tools.admin.game import deployer as game_deployer
+
+
+SCENARIOS = ["small-bundles", "huge-bundles", "game-server", "discovery-cold", "discovery-cached"]
+
+DEFAULT_BUNDLES = 200
+DEFAULT_BUNDLE_SIZE = 64
+DEFAULT_HUGE_BUNDLES = 3
+DEFAULT_HUGE_SIZE = 64
+DEFAULT_GAME_SIZE = 128
+
+WRITE_SIZE = 1024 * 1024
+
+
+def serve(queue, options):
+    mock = MockAnthill(**options)
+    queue.put(mock.location)
+    mock.server.serve_forever()
+
+
+class MockProcess(object):
+    """
+    Runs MockAnthill in a separate process, so the CPU time of this process is the CPU time
+    of the tools alone.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.process = None
+        self.location = None
+
+    @property
+    def environment_location(self):
+        return self.location + "/environment"
+
+    def stats(self):
+        return anthill_tools.get(self.location + "/mock/stats", retry=False).json()
+
+    def __enter__(self):
+        queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=serve, args=(queue, self.options), daemon=True)
+        self.process.start()
+        self.location = queue.get(timeout=30)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.join()
+
+
+def write_file(path, size):
+    with open(path, "wb") as f:
+        while size > 0:
+            block = os.urandom(min(WRITE_SIZE, size))
+            f.write(block)
+            size -= len(block)
+    return path
+
+
+def write_config(directory, name, count, size):
+    bundles = {}
+
+    for i in range(count):
+        bundle_name = "{0}-{1}.zip".format(name, i)
+        bundles[bundle_name] = {
+            "path": write_file(os.path.join(directory, bundle_name), size),
+            "filters": {}
+        }
+
+    config = os.path.join(directory, name + ".json")
+    with open(config, "w") as f:
+        json.dump({"bundles": bundles}, f)
+
+    return config
+
+
+class Benchmark(object):
+    def __init__(self, directory, bundles=DEFAULT_BUNDLES, bundle_size=DEFAULT_BUNDLE_SIZE * 1024,
+                 huge_bundles=DEFAULT_HUGE_BUNDLES, huge_size=DEFAULT_HUGE_SIZE * 1024 * 1024,
+                 game_size=DEFAULT_GAME_SIZE * 1024 * 1024, jobs=1, mock_options=None):
+        self.directory = directory
+        self.bundles = bundles
+        self.bundle_size = bundle_size
+        self.huge_bundles = huge_bundles
+        self.huge_size = huge_size
+        self.game_size = game_size
+        self.jobs = jobs
+        self.mock_options = mock_options or {}
+
+    def deploy_dlc(self, mock, config):
+        dlc_deployer.deploy(
+            mock.environment_location, "test", "1.0", "root", config, username="test", password="test",
+            force=True, jobs=self.jobs, hash_cache=False, progress="none", service_cache=False,
+            token_cache=False, journal=False, content_store=False)
+
+    def scenario_small_bundles(self, mock):
+        config = write_config(self.directory, "small", self.bundles, self.bundle_size)
+        return lambda: self.deploy_dlc(mock, config)
+
+    def scenario_huge_bundles(self, mock):
+        config = write_config(self.directory, "huge", self.huge_bundles, self.huge_size)
+        return lambda: self.deploy_dlc(mock, config)
+
+    def scenario_game_server(self, mock):
+        filename = write_file(os.path.join(self.directory, "game_server.zip"), self.game_size)
+        return lambda: game_deployer.deploy(
+            mock.environment_location, "test", "1.0", "root", filename, "true",
+            username="test", password="test", progress="none", service_cache=False, token_cache=False)
+
+    def discover(self, mock, cache):
+        env = Environment(mock.environment_location, ApplicationInfo("test", "1.0", "root"), cache=cache)
+        env.init()
+        env.discovery.get_services([Login.ID, Admin.ID, "dlc"])
+
+    def scenario_discovery_cold(self, mock):
+        return lambda: self.discover(mock, False)
+
+    def scenario_discovery_cached(self, mock):
+        cache = ServiceCache(location=os.path.join(self.directory, "services.json"))
+        self.discover(mock, cache)
+        return lambda: self.discover(mock, cache)
+
+    def run(self, scenario):
+        with MockProcess(**self.mock_options) as mock:
+            prepare = getattr(self, "scenario_" + scenario.replace("-", "_"))
+
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                method = prepare(mock)
+                before = mock.stats()
+
+                started = time.perf_counter()
+                cpu_started = time.process_time()
+                error = None
+
+                try:
+                    method()
+                except (ServiceError, dlc_deployer.DeliverError, game_deployer.DeliverError, OSError) as e:
+                    error = str(e)
+
+                elapsed = time.perf_counter() - started
+                cpu = time.process_time() - cpu_started
+
+            after = mock.stats()
+
+        return {
+            "scenario": scenario,
+            "wall": elapsed,
+            "cpu": cpu,
+            "requests": after["requests"] - before["requests"],
+            "received_bytes": after["received_bytes"] - before["received_bytes"],
+            "sent_bytes": after["sent_bytes"] - before["sent_bytes"],
+            "errors": after["errors"] - before["errors"],
+            "error": error
+        }
+
+
+def benchmark(scenarios, **kwargs):
+    directory = tempfile.mkdtemp(prefix="anthill-benchmark-")
+    results = []
+
+    print("{0:<17} {1:>8} {2:>8} {3:>9} {4:>10} {5:>10} {6:>7}".format(
+        "scenario", "wall", "cpu", "requests", "uploaded", "received", "errors"))
+
+    try:
+        bench = Benchmark(directory, **kwargs)
+
+        for scenario in scenarios:
+            result = bench.run(scenario)
+            results.append(result)
+
+            print("{0:<17} {1:>7.2f}s {2:>7.2f}s {3:>9} {4:>10} {5:>10} {6:>7}{7}".format(
+                scenario, result["wall"], result["cpu"], result["requests"],
+                sizeof_fmt(result["received_bytes"]), sizeof_fmt(result["sent_bytes"]), result["errors"],
+                "" if result["error"] is None else "  FAILED: " + result["error"]))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser()
+    parser.add_option("-s", "--scenarios", type="string", dest="scenarios", default=",".join(SCENARIOS),
+                      help="Scenarios to run, comma separated: " + ", ".join(SCENARIOS))
+    parser.add_option("--bundles", type="int", dest="bundles", default=DEFAULT_BUNDLES,
+                      help="Amount of bundles of the small-bundles scenario")
+    parser.add_option("--bundle-size", type="int", dest="bundle_size", default=DEFAULT_BUNDLE_SIZE,
+                      help="Size of each small bundle, in kilobytes")
+    parser.add_option("--huge-bundles", type="int", dest="huge_bundles", default=DEFAULT_HUGE_BUNDLES,
+                      help="Amount of bundles of the huge-bundles scenario")
+    parser.add_option("--huge-size", type="int", dest="huge_size", default=DEFAULT_HUGE_SIZE,
+                      help="Size of each huge bundle, in megabytes")
+    parser.add_option("--game-size", type="int", dest="game_size", default=DEFAULT_GAME_SIZE,
+                      help="Size of the game server zip, in megabytes")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="Amount of bundles to upload in parallel")
+    parser.add_option("--latency", type="float", dest="latency", default=0,
+                      help="Milliseconds added to every request by the mock services")
+    parser.add_option("--bandwidth", type="float", dest="bandwidth", default=0,
+                      help="Megabytes per second of every upload, unlimited by default")
+    parser.add_option("--error-rate", type="float", dest="error_rate", default=0,
+                      help="Share of GET and PUT requests failing with 503, from 0 to 1")
+    parser.add_option("--seed", type="int", dest="seed", default=0,
+                      help="Seed of the injected errors")
+    parser.add_option("-o", "--output", type="string", dest="output", default="",
+                      help="Write the results into this JSON file")
+
+    (options, args) = parser.parse_args()
+
+    scenarios = [scenario for scenario in options.scenarios.split(",") if scenario]
+
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            print("Unknown scenario: " + scenario)
+            exit(1)
+
+    results = benchmark(
+        scenarios,
+        bundles=options.bundles,
+        bundle_size=options.bundle_size * 1024,
+        huge_bundles=options.huge_bundles,
+        huge_size=options.huge_size * 1024 * 1024,
+        game_size=options.game_size * 1024 * 1024,
+        jobs=options.jobs,
+        mock_options={
+            "latency": options.latency / 1000.0,
+            "bandwidth": options.bandwidth * 1024 * 1024 or None,
+            "error_rate": options.error_rate,
+            "seed": options.seed
+        })
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=4)
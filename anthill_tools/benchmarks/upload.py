@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from optparse import OptionParser
+
+from anthill_tools import put
+from anthill_tools.body import FileBody, DEFAULT_BLOCK_SIZE
+from anthill_tools.progress import sizeof_fmt
+
+
+MODES = ["file", "blocks", "mmap"]
+READ_SIZE = 1024 * 1024
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_PUT(self):
+        buffer = bytearray(READ_SIZE)
+        view = memoryview(buffer)
+        remaining = int(self.headers.get("Content-Length", 0))
+
+        while remaining > 0:
+            read = self.rfile.readinto(view[:min(READ_SIZE, remaining)])
+            if not read:
+                break
+            remaining -= read
+
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def body(f, mode, block_size):
+    if mode == "file":
+        return f
+    return FileBody(f, block_size=block_size, memory_map=mode == "mmap")
+
+
+def run(url, filename, mode, block_size):
+    with open(filename, "rb") as f:
+        data = body(f, mode, block_size)
+
+        started = time.perf_counter()
+        # the sink runs in another thread, so only the CPU time spent sending is measured
+        cpu_started = time.thread_time()
+
+        put(url, data=data, retry=False)
+
+        elapsed = time.perf_counter() - started
+        cpu = time.thread_time() - cpu_started
+
+    return elapsed, cpu
+
+
+def benchmark(filename, modes, block_size=DEFAULT_BLOCK_SIZE, repeat=3):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = "http://127.0.0.1:{0}/upload".format(server.server_address[1])
+    size = os.path.getsize(filename)
+    results = []
+
+    print("{0:<7} {1:>10} {2:>12} {3:>10}".format("mode", "size", "throughput", "cpu/GB"))
+
+    try:
+        for mode in modes:
+            runs = [run(url, filename, mode, block_size) for _ in range(repeat)]
+            elapsed, cpu = min(runs, key=lambda r: r[1])
+
+            result = {
+                "mode": mode,
+                "size": size,
+                "throughput": size / elapsed if elapsed else 0,
+                "cpu_per_gb": cpu * (1024 ** 3) / size if size else 0
+            }
+            results.append(result)
+
+            print("{0:<7} {1:>10} {2:>10}/s {3:>9.2f}s".format(
+                mode, sizeof_fmt(size), sizeof_fmt(result["throughput"]), result["cpu_per_gb"]))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(usage="%prog [options] <file>")
+    parser.add_option("-m", "--modes", type="string", dest="modes", default=",".join(MODES),
+                      help="Upload bodies to benchmark, comma separated: file (plain file object), "
+                           "blocks (large readinto blocks) or mmap (memory-mapped views)")
+    parser.add_option("-b", "--block-size", type="int", dest="block_size", default=DEFAULT_BLOCK_SIZE // 1024,
+                      help="Block size of blocks and mmap bodies, in kilobytes")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                      help="Amount of uploads per mode, the best one is reported")
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1 or not os.path.isfile(args[0]):
+        parser.print_help()
+        exit(1)
+
+    benchmark(
+        args[0], [mode for mode in options.modes.split(",") if mode],
+        block_size=options.block_size * 1024,
+        repeat=max(1, options.repeat))
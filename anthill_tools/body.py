@@ -0,0 +1,104 @@
+import mmap
+import os
+
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def streamable(data):
+    if not hasattr(data, "fileno") or not hasattr(data, "read") or "b" not in getattr(data, "mode", "b"):
+        return False
+
+    try:
+        os.fstat(data.fileno())
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+class FileBody(object):
+    """
+    Streams a part of a file as an upload body with as little copying as possible. The body is an
+    iterable of large blocks rather than a file object, so the HTTP client hands each block straight
+    to socket.sendall() instead of reading the file in its own small blocks. Blocks are views into a
+    memory-mapped file where possible, or views of one reused buffer filled with readinto() otherwise.
+    """
+
+    rewindable = True
+
+    def __init__(self, f, offset=None, length=None, block_size=DEFAULT_BLOCK_SIZE, memory_map=True,
+                 transfer=None):
+        self.f = f
+        self.offset = f.tell() if offset is None else offset
+        self.length = max(os.fstat(f.fileno()).st_size - self.offset, 0) if length is None else length
+        self.block_size = block_size
+        self.memory_map = memory_map
+        self.transfer = transfer
+        self.start_sent = transfer.sent if transfer is not None else 0
+        # bytes yielded by the current iteration, which is what the HTTP client sent
+        self.sent_bytes = 0
+
+    @property
+    def name(self):
+        return getattr(self.f, "name", None)
+
+    def __len__(self):
+        return self.length
+
+    def rewind(self):
+        if self.transfer is not None:
+            self.transfer.rewind(self.start_sent)
+
+    def map(self):
+        if not self.memory_map or not self.length:
+            return None
+
+        try:
+            mapped = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+        return mapped
+
+    def blocks(self):
+        mapped = self.map()
+
+        # the mapping is not closed explicitly: the last block may still be referenced by the HTTP
+        # client, and the mapping is released with the last view into it
+        if mapped is not None:
+            view = memoryview(mapped)
+            end = min(self.offset + self.length, len(mapped))
+
+            for position in range(self.offset, end, self.block_size):
+                yield view[position:min(position + self.block_size, end)]
+            return
+
+        buffer = bytearray(min(self.block_size, self.length))
+        view = memoryview(buffer)
+        remaining = self.length
+
+        self.f.seek(self.offset)
+
+        while remaining > 0:
+            read = self.f.readinto(view[:min(len(buffer), remaining)])
+            if not read:
+                break
+            remaining -= read
+            yield view[:read]
+
+    def __iter__(self):
+        self.sent_bytes = 0
+
+        for block in self.blocks():
+            self.sent_bytes += len(block)
+            yield block
+
+            if self.transfer is not None:
+                self.transfer.update(len(block))
+
+        if self.transfer is not None and self.transfer.sent >= self.transfer.total:
+            self.transfer.finish()
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "services.json")
+DEFAULT_TTL = 3600
+
+
+class ServiceCache(object):
+    def __init__(self, location=DEFAULT_LOCATION, ttl=DEFAULT_TTL):
+        self.location = location
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # entries of a cache without a location, kept in memory only
+        self.entries = {}
+
+    def read(self):
+        if self.location is None:
+            return dict(self.entries)
+
+        try:
+            with open(self.location, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def write(self, entries):
+        now = time.time()
+        entries = {
+            key: entry
+            for key, entry in entries.items()
+            if entry.get("expires", 0) > now
+        }
+
+        if self.location is None:
+            self.entries = entries
+            return
+
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_location = "{0}.{1}.tmp".format(self.location, os.getpid())
+        with open(temp_location, "w") as f:
+            json.dump(entries, f)
+        os.replace(temp_location, self.location)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.read().get(key)
+
+        if entry is None or entry.get("expires", 0) <= time.time():
+            return None
+
+        return entry.get("value")
+
+    def put(self, key, value):
+        with self.lock:
+            entries = self.read()
+            entries[key] = {
+                "value": value,
+                "expires": time.time() + self.ttl
+            }
+            self.write(entries)
+
+    def update(self, key, value):
+        with self.lock:
+            entries = self.read()
+            entry = entries.get(key)
+
+            if entry is None or entry.get("expires", 0) <= time.time():
+                entry = {"value": {}, "expires": time.time() + self.ttl}
+
+            entry["value"].update(value)
+            entries[key] = entry
+            self.write(entries)
+
+    def invalidate(self, *keys):
+        with self.lock:
+            entries = self.read()
+            if not any(key in entries for key in keys):
+                return
+            for key in keys:
+                entries.pop(key, None)
+            self.write(entries)
+
+    def clear(self):
+        with self.lock:
+            self.write({})
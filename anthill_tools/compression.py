@@ -0,0 +1,158 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+READ_SIZE = 1024 * 1024
+SAMPLE_SIZE = 4 * 1024 * 1024
+DEFAULT_MIN_RATIO = 0.9
+
+CODECS = ["gzip", "zstd"]
+DEFAULT_LEVELS = {
+    "gzip": 6,
+    "zstd": 3
+}
+
+
+def compressor(codec, level):
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires zstandard: pip install zstandard")
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    raise ValueError("Unknown compression codec: {0}".format(codec))
+
+
+def compress(codec, level, data):
+    c = compressor(codec, level)
+    return c.compress(data) + c.flush()
+
+
+class CompressedReader(object):
+    def __init__(self, f, codec, level, read_size=READ_SIZE):
+        self.f = f
+        self.codec = codec
+        self.level = level
+        self.read_size = read_size
+        self.start = None if hasattr(f, "rewind") or not hasattr(f, "tell") else f.tell()
+        self.reset()
+
+    def reset(self):
+        self.compressor = compressor(self.codec, self.level)
+        self.buffer = b""
+        self.eof = False
+
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    @property
+    def sent_bytes(self):
+        return self.compressed_bytes
+
+    @property
+    def rewindable(self):
+        if hasattr(self.f, "rewind"):
+            return self.f.rewindable
+        return self.start is not None and hasattr(self.f, "seek")
+
+    def rewind(self):
+        if hasattr(self.f, "rewind"):
+            self.f.rewind()
+        else:
+            self.f.seek(self.start)
+
+        self.reset()
+
+    def fill(self, size):
+        while not self.eof and len(self.buffer) < size:
+            data = self.f.read(self.read_size)
+
+            if data:
+                self.raw_bytes += len(data)
+                self.buffer += self.compressor.compress(data)
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self.fill(float("inf"))
+            size = len(self.buffer)
+        else:
+            self.fill(size)
+
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.compressed_bytes += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.read_size)
+            if not data:
+                return
+            yield data
+
+
+class Compression(object):
+    """
+    Streams upload bodies through a compressor and sets the matching Content-Encoding.
+    In auto mode the first few megabytes of every file are compressed as a sample first,
+    and files that do not shrink below min_ratio of their size are sent as is.
+    """
+
+    def __init__(self, codec="gzip", level=None, auto=False, min_ratio=DEFAULT_MIN_RATIO,
+                 sample_size=SAMPLE_SIZE):
+        if codec not in CODECS:
+            raise ValueError("Unknown compression codec: {0}".format(codec))
+
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        self.auto = auto
+        self.min_ratio = min_ratio
+        self.sample_size = sample_size
+
+        # make sure the codec is actually available before any upload starts
+        compressor(self.codec, self.level)
+
+    @staticmethod
+    def parse(spec):
+        if not spec or spec == "none":
+            return None
+
+        auto = False
+        if spec == "auto" or spec.startswith("auto:"):
+            auto = True
+            spec = spec[5:] or "gzip"
+
+        codec, _, level = spec.partition(":")
+        return Compression(codec, int(level) if level else None, auto=auto)
+
+    def worth_it(self, f):
+        position = f.tell()
+        sample = f.read(self.sample_size)
+        f.seek(position)
+
+        if not sample:
+            return False
+
+        return len(compress(self.codec, self.level, sample)) < len(sample) * self.min_ratio
+
+    def applies(self, data):
+        if not hasattr(data, "read"):
+            return False
+
+        if not self.auto:
+            return True
+
+        return hasattr(data, "seek") and hasattr(data, "tell") and self.worth_it(data)
+
+    def wrap(self, data, headers):
+        headers = dict(headers or {})
+        headers["Content-Encoding"] = self.codec
+        return CompressedReader(data, self.codec, self.level), headers
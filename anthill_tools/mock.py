@@ -0,0 +1,574 @@
+import hashlib
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from optparse import OptionParser
+from urllib.parse import urlparse, parse_qs
+
+
+READ_SIZE = 1024 * 1024
+
+
+class MockState(object):
+    def __init__(self, batch_check=True, delta=True, bulk_attach=True, clone=True, copy=True, ranges=True,
+                 latency=0, bandwidth=None, error_rate=0, error_methods=("GET", "PUT"), seed=None):
+        self.batch_check = batch_check
+        self.delta = delta
+        self.bulk_attach = bulk_attach
+        self.clone = clone
+        self.copy = copy
+        self.ranges = ranges
+        # seconds added to every request, bytes per second of every request body, and the share of
+        # requests failing with 503 before they are handled
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_methods = error_methods
+        self.random = random.Random(seed)
+
+        # handlers may reply while holding it, and replies count the bytes sent under it too
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.requests = []
+        self.tokens = set()
+
+        # (bundle_name, bundle_hash) -> bundle size
+        self.bundles = {}
+        # bundle_id -> {"name", "data_id", "hash", "size"}
+        self.new_bundles = {}
+        # data_id -> {"bundles": {bundle_name: bundle_hash}, "published": bool}
+        self.data_versions = {}
+        # (game_name, game_version) -> [{"name", "hash", "size"}]
+        self.game_builds = {}
+        # (game_name, game_version, file_name) -> received bytes
+        self.partial_uploads = {}
+        # chunk_hash -> chunk contents
+        self.chunks = {}
+
+        self.received_bytes = 0
+        self.sent_bytes = 0
+        self.errors = 0
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def record(self, method, path, args):
+        with self.lock:
+            self.requests.append((method, path, args))
+
+    def transferred(self, received=0, sent=0):
+        with self.lock:
+            self.received_bytes += received
+            self.sent_bytes += sent
+
+    def inject_error(self, method):
+        if not self.error_rate or method not in self.error_methods:
+            return False
+
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return False
+            self.errors += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": len([request for request in self.requests if not request[1].startswith("/mock")]),
+                "received_bytes": self.received_bytes,
+                "sent_bytes": self.sent_bytes,
+                "errors": self.errors
+            }
+
+    def expire_tokens(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def count(self, method=None, path=None):
+        with self.lock:
+            return len([
+                request for request in self.requests
+                if (method is None or request[0] == method) and (path is None or request[1] == path)
+            ])
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # requests to /mock itself are left out of the transfer stats
+    counted = True
+
+    def setup(self):
+        super(MockHandler, self).setup()
+        # replies are written as headers and body separately, avoid waiting for delayed ACKs between them
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def base(self):
+        return "http://{0}:{1}".format(*self.server.server_address[:2])
+
+    def reply(self, code, body=b"", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        if self.counted:
+            self.state.transferred(sent=len(body))
+
+    def throttle(self, size):
+        self.state.transferred(received=size)
+
+        if self.state.bandwidth:
+            time.sleep(float(size) / self.state.bandwidth)
+
+    def read_body(self):
+        encoding = self.headers.get("Content-Encoding")
+
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(31)
+        elif encoding == "zstd":
+            import zstandard
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            decompressor = None
+
+        for chunk in self.read_raw_body():
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            if chunk:
+                yield chunk
+
+    def read_raw_body(self):
+        length = self.headers.get("Content-Length")
+
+        if length is not None:
+            remaining = int(length)
+            while remaining > 0:
+                chunk = self.rfile.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self.throttle(len(chunk))
+                yield chunk
+            return
+
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                self.throttle(len(chunk))
+                yield chunk
+
+    def handle_method(self, method):
+        parsed = urlparse(self.path)
+        args = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+        if method == "PUT":
+            body = self.read_body()
+        else:
+            data = b"".join(self.read_body())
+            if data:
+                args.update({key: values[0] for key, values in parse_qs(data.decode("utf-8")).items()})
+            body = None
+
+        self.state.record(method, parsed.path, args)
+
+        path = parsed.path.strip("/").split("/")
+        handler = getattr(self, "handle_" + path[0], None)
+
+        if handler is None:
+            return self.reply(404, "Not found")
+
+        self.counted = path[0] != "mock"
+
+        if self.counted:
+            if self.state.latency:
+                time.sleep(self.state.latency)
+
+            if self.state.inject_error(method):
+                self.drain(body)
+                return self.reply(503, "Injected error")
+
+        if path[0] in ("admin", "dlc") and args.get("access_token") not in self.state.tokens:
+            self.drain(body)
+            return self.reply(401, "Token expired")
+
+        try:
+            return handler(method, path[1:], args, body)
+        except (KeyError, ValueError) as e:
+            return self.reply(400, "Bad request: " + str(e))
+
+    @staticmethod
+    def drain(body):
+        if body is not None:
+            for _ in body:
+                pass
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_PUT(self):
+        self.handle_method("PUT")
+
+    def handle_mock(self, method, path, args, body):
+        if path == ["stats"]:
+            return self.reply(200, self.state.stats())
+        return self.reply(404, "Not found")
+
+    def handle_environment(self, method, path, args, body):
+        return self.reply(200, {"discovery": self.base + "/discovery"})
+
+    def handle_discovery(self, method, path, args, body):
+        if path[0] == "service":
+            return self.reply(200, self.base + "/" + path[1])
+        if path[0] == "services":
+            return self.reply(200, {
+                service_id: self.base + "/" + service_id
+                for service_id in path[1].split(",")
+            })
+        return self.reply(404, "Not found")
+
+    def handle_login(self, method, path, args, body):
+        token = "token-{0}".format(self.state.next_id())
+        with self.state.lock:
+            self.state.tokens.add(token)
+        return self.reply(200, {
+            "token": token,
+            "scopes": args.get("scopes", "").split(","),
+            "expires_in": 86400
+        })
+
+    def handle_dlc(self, method, path, args, body):
+        if path == ["bundle"]:
+            if (args["bundle_name"], args["bundle_hash"]) in self.state.bundles:
+                return self.reply(200, {})
+            return self.reply(404, "No such bundle")
+
+        if path == ["bundles", "check"] and self.state.batch_check and method == "POST":
+            manifest = json.loads(args["bundles"])
+            return self.reply(200, {
+                "existing": [
+                    entry for entry in manifest
+                    if (entry["bundle_name"], entry["bundle_hash"]) in self.state.bundles
+                ]
+            })
+
+        return self.reply(404, "Not found")
+
+    def handle_admin(self, method, path, args, body):
+        context = json.loads(args.get("context", "{}"))
+        action = args.get("action")
+
+        if path == ["api"]:
+            return self.admin_api(args.get("service"), action, args.get("method"), context, args)
+
+        if path == ["service", "upload"] and method == "PUT":
+            return self.admin_upload(args.get("service"), action, context, json.loads(args.get("args", "{}")), body)
+
+        return self.reply(404, "Not found")
+
+    def admin_api(self, service, action, method, context, args):
+        state = self.state
+
+        if service == "dlc" and action == "app" and method == "new_data_version":
+            data_id = state.next_id()
+            with state.lock:
+                state.data_versions[data_id] = {"bundles": {}, "published": False}
+            return self.reply(200, {}, {"X-Api-Context": json.dumps({"data_id": data_id})})
+
+        if service == "dlc" and action == "published_data_version" and state.clone:
+            with state.lock:
+                published = [data_id for data_id, data in state.data_versions.items() if data["published"]]
+                bundles = state.data_versions[max(published)]["bundles"].items() if published else []
+                response = {
+                    "data_id": max(published) if published else None,
+                    "bundles": [{"bundle_name": name, "bundle_hash": hash_} for name, hash_ in bundles]
+                }
+            if not published:
+                return self.reply(404, "No published data versions")
+            return self.reply(200, response)
+
+        if service == "dlc" and action == "data_version" and method == "clone" and state.clone:
+            data_id = state.next_id()
+            with state.lock:
+                source = state.data_versions.get(int(context["data_id"]))
+                if source is not None:
+                    state.data_versions[data_id] = {"bundles": dict(source["bundles"]), "published": False}
+            if source is None:
+                return self.reply(404, "No such data version")
+            return self.reply(200, {}, {"X-Api-Context": json.dumps({"data_id": data_id})})
+
+        if service == "dlc" and action == "data_version" and method == "detach" and state.clone:
+            with state.lock:
+                bundles = state.data_versions[int(context["data_id"])]["bundles"]
+                for name in json.loads(args["bundles"]):
+                    bundles.pop(name, None)
+            return self.reply(200, {})
+
+        if service == "dlc" and action == "new_bundle" and method == "create":
+            bundle_id = state.next_id()
+            with state.lock:
+                state.new_bundles[bundle_id] = {
+                    "name": args["bundle_name"],
+                    "data_id": int(context["data_id"]),
+                    "hash": None,
+                    "size": 0
+                }
+            return self.reply(200, {}, {"X-Api-Context": json.dumps({"bundle_id": bundle_id})})
+
+        if service == "dlc" and action == "attach_bundle" and method == "attach":
+            key = (args["bundle_name"], args["bundle_hash"])
+            with state.lock:
+                exists = key in state.bundles
+                if exists:
+                    state.data_versions[int(context["data_id"])]["bundles"][key[0]] = key[1]
+            if not exists:
+                return self.reply(404, "No such bundle")
+            return self.reply(200, {})
+
+        if service == "dlc" and action == "attach_bundles" and method == "attach" and state.bulk_attach:
+            keys = [(entry["bundle_name"], entry["bundle_hash"]) for entry in json.loads(args["bundles"])]
+            with state.lock:
+                missing = [name for name, hash_ in keys if (name, hash_) not in state.bundles]
+                if not missing:
+                    state.data_versions[int(context["data_id"])]["bundles"].update(keys)
+            if missing:
+                return self.reply(409, {"missing": missing})
+            return self.reply(200, {})
+
+        if service == "dlc" and action == "bundle" and method == "copy" and state.copy:
+            key = (args["bundle_name"], args["bundle_hash"])
+            with state.lock:
+                size = state.bundles.get(key)
+                if size is not None:
+                    bundle = state.new_bundles[int(context["bundle_id"])]
+                    bundle["hash"] = key[1]
+                    bundle["size"] = size
+                    state.bundles[(bundle["name"], bundle["hash"])] = size
+                    state.data_versions[bundle["data_id"]]["bundles"][bundle["name"]] = bundle["hash"]
+            if size is None:
+                return self.reply(409, "No such bundle to copy")
+            return self.reply(200, {})
+
+        if service == "dlc" and action == "data_version" and method == "publish":
+            with state.lock:
+                state.data_versions[int(context["data_id"])]["published"] = True
+            return self.reply(200, {})
+
+        if service == "dlc" and action == "bundle" and method == "assemble" and state.delta:
+            return self.assemble_bundle(context, args)
+
+        if service == "environment" and action == "new_app_version":
+            return self.reply(200, {})
+
+        return self.reply(404, "No such action")
+
+    def assemble_bundle(self, context, args):
+        state = self.state
+        manifest = json.loads(args["manifest"])
+
+        with state.lock:
+            missing = [chunk_hash for chunk_hash, size in manifest if chunk_hash not in state.chunks]
+            if missing:
+                return self.reply(409, {"missing": missing})
+
+            hash_ = hashlib.md5()
+            size = 0
+            for chunk_hash, chunk_size in manifest:
+                hash_.update(state.chunks[chunk_hash])
+                size += chunk_size
+
+            if hash_.hexdigest() != args["bundle_hash"]:
+                return self.reply(400, "Assembled bundle hash mismatch")
+
+            bundle = state.new_bundles[int(context["bundle_id"])]
+            bundle["hash"] = hash_.hexdigest()
+            bundle["size"] = size
+            state.bundles[(bundle["name"], bundle["hash"])] = size
+            state.data_versions[bundle["data_id"]]["bundles"][bundle["name"]] = bundle["hash"]
+
+        return self.reply(200, {})
+
+    def admin_upload(self, service, action, context, upload_args, body):
+        state = self.state
+
+        if service == "dlc" and action == "bundle_chunk" and state.delta:
+            chunk = b"".join(body)
+            if hashlib.sha256(chunk).hexdigest() != context["chunk_hash"]:
+                return self.reply(400, "Chunk hash mismatch")
+            with state.lock:
+                state.chunks[context["chunk_hash"]] = chunk
+            return self.reply(200, {})
+
+        hash_ = hashlib.md5()
+        size = 0
+        for chunk in body:
+            hash_.update(chunk)
+            size += len(chunk)
+
+        if service == "dlc" and action == "bundle":
+            with state.lock:
+                bundle = state.new_bundles[int(context["bundle_id"])]
+                bundle["hash"] = hash_.hexdigest()
+                bundle["size"] = size
+                state.bundles[(bundle["name"], bundle["hash"])] = size
+                state.data_versions[bundle["data_id"]]["bundles"][bundle["name"]] = bundle["hash"]
+            return self.reply(200, {})
+
+        if service == "game" and action == "deploy":
+            return self.game_upload(context, hash_, size)
+
+        return self.reply(404, "No such action")
+
+    def game_upload(self, context, hash_, size):
+        state = self.state
+
+        build_key = (context["game_name"], context["game_version"])
+        file_name = self.headers.get("X-File-Name")
+        content_range = self.headers.get("Content-Range")
+
+        # a server without ranged uploads takes every chunk for a whole build
+        if content_range is None or not state.ranges:
+            with state.lock:
+                state.game_builds.setdefault(build_key, []).append({
+                    "name": file_name,
+                    "hash": hash_.hexdigest(),
+                    "size": size
+                })
+            return self.reply(200, {})
+
+        # chunks are not hashed together here, the mock only tracks how much was received
+        start, end, total = parse_content_range(content_range)
+        upload_key = build_key + (file_name,)
+
+        with state.lock:
+            received = state.partial_uploads.get(upload_key, 0) if start else 0
+            if start != received or end - start + 1 != size:
+                return self.reply(416, "Expected offset {0}".format(received))
+
+            received = end + 1
+            if received < total:
+                state.partial_uploads[upload_key] = received
+                return self.reply(200, {"received": received})
+
+            state.partial_uploads.pop(upload_key, None)
+            state.game_builds.setdefault(build_key, []).append({
+                "name": file_name,
+                "hash": None,
+                "size": total
+            })
+
+        return self.reply(200, {"received": received})
+
+
+def parse_content_range(value):
+    unit, _, spec = value.partition(" ")
+    if unit != "bytes":
+        raise ValueError("Unsupported range unit")
+    span, _, total = spec.partition("/")
+    start, _, end = span.partition("-")
+    return int(start), int(end), int(total)
+
+
+class MockAnthill(object):
+    """
+    A local stand-in for the environment, discovery, login, admin, dlc and game
+    services, good enough to run both deployers against it offline.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, handler=MockHandler, **kwargs):
+        self.state = MockState(**kwargs)
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.state = self.state
+        self.thread = None
+
+    @property
+    def location(self):
+        return "http://{0}:{1}".format(*self.server.server_address[:2])
+
+    @property
+    def environment_location(self):
+        return self.location + "/environment"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser()
+    parser.add_option("--host", type="string", dest="host", default="127.0.0.1",
+                      help="Host to listen on")
+    parser.add_option("--port", type="int", dest="port", default=9500,
+                      help="Port to listen on")
+    parser.add_option("--no-batch-check", action="store_false", dest="batch_check", default=True,
+                      help="Do not support batch bundle checks")
+    parser.add_option("--no-delta", action="store_false", dest="delta", default=True,
+                      help="Do not support delta bundle uploads")
+    parser.add_option("--no-bulk-attach", action="store_false", dest="bulk_attach", default=True,
+                      help="Do not support attaching many bundles at once")
+    parser.add_option("--no-clone", action="store_false", dest="clone", default=True,
+                      help="Do not support cloning data versions")
+    parser.add_option("--no-copy", action="store_false", dest="copy", default=True,
+                      help="Do not support copying bundles with the same payload")
+    parser.add_option("--no-ranges", action="store_false", dest="ranges", default=True,
+                      help="Ignore Content-Range of game build uploads")
+    parser.add_option("--latency", type="float", dest="latency", default=0,
+                      help="Milliseconds added to every request")
+    parser.add_option("--bandwidth", type="float", dest="bandwidth", default=0,
+                      help="Megabytes per second of every upload, unlimited by default")
+    parser.add_option("--error-rate", type="float", dest="error_rate", default=0,
+                      help="Share of GET and PUT requests failing with 503, from 0 to 1")
+
+    (options, args) = parser.parse_args()
+
+    mock = MockAnthill(options.host, options.port, batch_check=options.batch_check, delta=options.delta,
+                       bulk_attach=options.bulk_attach, clone=options.clone, copy=options.copy,
+                       ranges=options.ranges, latency=options.latency / 1000.0,
+                       bandwidth=options.bandwidth * 1024 * 1024 or None, error_rate=options.error_rate)
+    print("Environment: " + mock.environment_location)
+
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,279 @@
+import json
+import math
+import os
+import statistics
+import threading
+import time
+from urllib.parse import urlparse
+
+from anthill_tools.trace import busy_time
+from anthill_tools.progress import sizeof_fmt
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "link.json")
+# requests sending or receiving less than this are round trips, bigger uploads measure throughput
+SMALL_REQUEST = 64 * 1024
+MIN_MEASURED_BYTES = 1024 * 1024
+
+
+class LinkMeter(object):
+    """
+    A tracer hook measuring the link to the services: the median latency of small requests, and
+    the upload throughput of requests sending bodies, over the time any of them was in flight.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.uploads = []
+        self.uploaded = 0
+
+    def __call__(self, event):
+        if event.kind != "request" or event.error is not None:
+            return
+
+        with self.lock:
+            if (event.bytes_out or 0) >= SMALL_REQUEST:
+                self.uploads.append((event.started, event.started + event.latency))
+                self.uploaded += event.bytes_out
+            elif (event.bytes_in or 0) < SMALL_REQUEST:
+                self.latencies.append(event.latency)
+
+    def add(self, meter):
+        with meter.lock:
+            latencies, uploads, uploaded = list(meter.latencies), list(meter.uploads), meter.uploaded
+
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.uploads.extend(uploads)
+            self.uploaded += uploaded
+
+    def latency(self):
+        with self.lock:
+            return statistics.median(self.latencies) if self.latencies else None
+
+    def throughput(self):
+        with self.lock:
+            if self.uploaded < MIN_MEASURED_BYTES:
+                return None
+            elapsed = busy_time(self.uploads)
+            return self.uploaded / elapsed if elapsed else None
+
+
+class HostMeters(object):
+    """
+    A tracer hook measuring the link to each host apart, so a deploy to several environments at once
+    can tell what each of them measured rather than the rate of all of them together.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meters = {}
+
+    def __call__(self, event):
+        if event.kind != "request" or not event.url:
+            return
+
+        host = urlparse(event.url).netloc
+
+        with self.lock:
+            meter = self.meters.get(host)
+            if meter is None:
+                meter = self.meters[host] = LinkMeter()
+
+        meter(event)
+
+    def meter(self, locations):
+        """
+        A LinkMeter of the requests sent to the hosts of locations.
+        """
+
+        combined = LinkMeter()
+
+        with self.lock:
+            meters = [self.meters[host] for host in set(urlparse(location).netloc for location in locations)
+                      if host in self.meters]
+
+        for meter in meters:
+            combined.add(meter)
+
+        return combined
+
+    def store(self, link_stats, targets):
+        """
+        Updates the link stats of the environment of each target, with what was measured for the
+        locations of the targets of that environment only.
+        """
+
+        for environment_location in set(target.environment_location for target in targets):
+            link_stats.update(environment_location, self.meter(
+                location for target in targets if target.environment_location == environment_location
+                for location in target.locations()))
+
+
+class LinkStats(object):
+    """
+    Latency and upload throughput measured by the last deploys to each environment, so a plan
+    can estimate uploads without uploading anything.
+    """
+
+    def __init__(self, location=None):
+        self.location = location or DEFAULT_LOCATION
+        self.lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.location, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.read().get(key)
+        return entry if isinstance(entry, dict) else {}
+
+    def update(self, key, meter):
+        latency, throughput = meter.latency(), meter.throughput()
+        if latency is None and throughput is None:
+            return
+
+        with self.lock:
+            entries = self.read()
+            entry = entries.setdefault(key, {})
+
+            if latency is not None:
+                entry["latency"] = latency
+            if throughput is not None:
+                entry["throughput"] = throughput
+            entry["updated"] = time.time()
+
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            temp_location = "{0}.{1}.tmp".format(self.location, os.getpid())
+            with open(temp_location, "w") as f:
+                json.dump(entries, f)
+            os.replace(temp_location, self.location)
+
+
+class DeployPlan(object):
+    """
+    What a deploy would do and an estimate of how long it would take: the time spent gathering
+    (measured while planning), one latency per round of requests that can't run at the same time,
+    and the bytes to upload at the throughput of the previous deploys.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.copies = 0
+        self.attaches = 0
+        self.detaches = 0
+        self.unchanged = 0
+        self.requests = 0
+        self.rounds = 0
+        self.gather_time = 0.0
+        self.latency = None
+        self.throughput = None
+
+    @staticmethod
+    def combine(target, plans, parallel=1):
+        """
+        The plan of running plans up to parallel at a time, all of them uploading over the same link.
+        """
+
+        combined = DeployPlan(target)
+
+        for plan in plans:
+            combined.uploads += plan.uploads
+            combined.upload_bytes += plan.upload_bytes
+            combined.copies += plan.copies
+            combined.attaches += plan.attaches
+            combined.detaches += plan.detaches
+            combined.unchanged += plan.unchanged
+            combined.requests += plan.requests
+
+        if plans:
+            combined.rounds = max(plan.rounds for plan in plans) * math.ceil(len(plans) / max(1, parallel))
+            combined.gather_time = max(plan.gather_time for plan in plans)
+
+        latencies = [plan.latency for plan in plans if plan.latency is not None]
+        throughputs = [plan.throughput for plan in plans if plan.throughput]
+        combined.latency = max(latencies) if latencies else None
+        combined.throughput = min(throughputs) if throughputs else None
+
+        return combined
+
+    def measure(self, meter, stats):
+        self.latency = meter.latency()
+        if self.latency is None:
+            self.latency = stats.get("latency")
+        self.throughput = stats.get("throughput")
+
+    @property
+    def transfer_time(self):
+        if not self.upload_bytes:
+            return 0.0
+        if not self.throughput:
+            return None
+        return self.upload_bytes / self.throughput
+
+    @property
+    def time(self):
+        transfer_time = self.transfer_time
+        if transfer_time is None or (self.rounds and self.latency is None):
+            return None
+        return self.gather_time + self.rounds * (self.latency or 0) + transfer_time
+
+    def dump(self):
+        return {
+            "target": self.target,
+            "uploads": self.uploads,
+            "upload_bytes": self.upload_bytes,
+            "copies": self.copies,
+            "attaches": self.attaches,
+            "detaches": self.detaches,
+            "unchanged": self.unchanged,
+            "requests": self.requests,
+            "gather_time": self.gather_time,
+            "latency": self.latency,
+            "throughput": self.throughput,
+            "transfer_time": self.transfer_time,
+            "time": self.time
+        }
+
+    def report(self, log=print):
+        def seconds(value):
+            return "unknown" if value is None else "{0:.1f}s".format(value)
+
+        log("Plan for {0}:".format(self.target))
+        log("  {0:<14} {1} ({2})".format("uploads", self.uploads, sizeof_fmt(self.upload_bytes)))
+
+        if self.copies:
+            log("  {0:<14} {1}".format("copies", self.copies))
+        if self.attaches:
+            log("  {0:<14} {1}".format("attaches", self.attaches))
+        if self.detaches:
+            log("  {0:<14} {1}".format("detaches", self.detaches))
+        if self.unchanged:
+            log("  {0:<14} {1}".format("unchanged", self.unchanged))
+
+        log("  {0:<14} {1}".format("requests", self.requests))
+        log("  {0:<14} {1}".format(
+            "latency", "unknown" if self.latency is None else "{0:.0f}ms".format(self.latency * 1000)))
+        log("  {0:<14} {1}".format(
+            "throughput", "unknown, no uploads measured yet" if self.throughput is None
+            else sizeof_fmt(self.throughput) + "/s"))
+        log("  {0:<14} {1}".format("gathering", seconds(self.gather_time)))
+        log("  {0:<14} {1}".format("transfer", seconds(self.transfer_time)))
+        log("  {0:<14} {1}".format("estimated", seconds(self.time)))
+
+
+def write_plans(plans, location):
+    with open(location, "w") as f:
+        json.dump([plan.dump() for plan in plans], f, indent=4)
@@ -0,0 +1,203 @@
+import json
+import sys
+import threading
+import time
+
+
+DEFAULT_INTERVAL = 0.5
+
+
+def sizeof_fmt(num, suffix='B'):
+    for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
+        if abs(num) < 1024.0:
+            return "%3.1f%s%s" % (num, unit, suffix)
+        num /= 1024.0
+    return "%.1f%s%s" % (num, 'Yi', suffix)
+
+
+def time_fmt(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+    return "%02d:%02d" % (seconds // 60, seconds % 60)
+
+
+class Progress(object):
+    def __init__(self, name, sent, total, rate, average, elapsed, done):
+        self.name = name
+        self.sent = sent
+        self.total = total
+        self.rate = rate
+        self.average = average
+        self.elapsed = elapsed
+        self.done = done
+
+    @property
+    def eta(self):
+        if not self.total or not self.average:
+            return None
+        return max(self.total - self.sent, 0) / self.average
+
+    def dump(self):
+        return {
+            "name": self.name,
+            "sent": self.sent,
+            "total": self.total,
+            "rate": self.rate,
+            "average": self.average,
+            "elapsed": self.elapsed,
+            "eta": self.eta,
+            "done": self.done
+        }
+
+
+class Transfer(object):
+    def __init__(self, name, total, callback, sent=0, interval=DEFAULT_INTERVAL):
+        self.name = name
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+
+        self.initial = sent
+        self.sent = sent
+        self.started = time.monotonic()
+        self.last_time = self.started
+        self.last_sent = sent
+        self.done = False
+
+    def report(self, now, done=False):
+        elapsed = now - self.started
+        delta = now - self.last_time
+
+        rate = (self.sent - self.last_sent) / delta if delta > 0 else 0.0
+        average = (self.sent - self.initial) / elapsed if elapsed > 0 else 0.0
+
+        self.last_time = now
+        self.last_sent = self.sent
+
+        if self.callback is not None:
+            self.callback(Progress(self.name, self.sent, self.total, rate, average, elapsed, done))
+
+    def update(self, amount):
+        self.sent += amount
+        now = time.monotonic()
+
+        if now - self.last_time >= self.interval:
+            self.report(now)
+
+    def rewind(self, sent):
+        self.sent = sent
+        self.last_sent = min(self.last_sent, sent)
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.report(time.monotonic(), done=True)
+
+
+class ProgressReader(object):
+    def __init__(self, f, transfer):
+        self.f = f
+        self.transfer = transfer
+        self.start = None if hasattr(f, "rewind") or not hasattr(f, "tell") else f.tell()
+        self.start_sent = transfer.sent
+        self.sent_bytes = 0
+
+    @property
+    def rewindable(self):
+        if hasattr(self.f, "rewind"):
+            return self.f.rewindable
+        return self.start is not None and hasattr(self.f, "seek")
+
+    def rewind(self):
+        if hasattr(self.f, "rewind"):
+            self.f.rewind()
+        else:
+            self.f.seek(self.start)
+
+        self.transfer.rewind(self.start_sent)
+        self.sent_bytes = 0
+
+    def __len__(self):
+        return len(self.f) if hasattr(self.f, "__len__") else max(self.transfer.total - self.transfer.sent, 0)
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+
+        if data:
+            self.sent_bytes += len(data)
+            self.transfer.update(len(data))
+        elif self.transfer.sent >= self.transfer.total:
+            self.transfer.finish()
+
+        return data
+
+
+class TerminalProgress(object):
+    WIDTH = 30
+    LOG_INTERVAL = 10
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self.interactive = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.lock = threading.Lock()
+        self.last_line = 0
+
+    def line(self, progress):
+        if progress.total:
+            ratio = min(float(progress.sent) / progress.total, 1.0)
+        else:
+            ratio = 1.0 if progress.done else 0.0
+
+        filled = int(ratio * TerminalProgress.WIDTH)
+
+        return "{0} [{1}{2}] {3:5.1f}% {4}/{5} {6}/s (avg {7}/s) ETA {8}".format(
+            progress.name,
+            "#" * filled,
+            "." * (TerminalProgress.WIDTH - filled),
+            ratio * 100,
+            sizeof_fmt(progress.sent),
+            sizeof_fmt(progress.total),
+            sizeof_fmt(progress.rate),
+            sizeof_fmt(progress.average),
+            time_fmt(0 if progress.done else progress.eta))
+
+    def __call__(self, progress):
+        with self.lock:
+            if self.interactive:
+                self.stream.write("\r\033[K" + self.line(progress) + ("\n" if progress.done else ""))
+            else:
+                now = time.monotonic()
+                if not progress.done and now - self.last_line < TerminalProgress.LOG_INTERVAL:
+                    return
+                self.last_line = now
+                self.stream.write(self.line(progress) + "\n")
+
+            self.stream.flush()
+
+
+class JsonLinesProgress(object):
+    def __init__(self, location):
+        self.location = location
+        self.lock = threading.Lock()
+
+    def __call__(self, progress):
+        record = progress.dump()
+        record["time"] = time.time()
+
+        with self.lock:
+            with open(self.location, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def progress_sink(spec):
+    if not spec or spec == "none":
+        return None
+    if spec == "bar":
+        return TerminalProgress()
+    if spec.startswith("json:"):
+        return JsonLinesProgress(spec[5:])
+    raise ValueError("Unknown progress sink: {0}".format(spec))
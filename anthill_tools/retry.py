@@ -0,0 +1,92 @@
+import random
+import threading
+
+
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+DEFAULT_BUDGET = 300
+
+RETRY_CODES = (408, 429, 500, 502, 503, 504, 599)
+
+
+class RetryStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.recovered = 0
+        self.failed = 0
+        self.delay = 0.0
+        self.codes = {}
+
+    def retry(self, code, delay):
+        with self.lock:
+            self.retries += 1
+            self.delay += delay
+            self.codes[code] = self.codes.get(code, 0) + 1
+
+    def done(self, success):
+        with self.lock:
+            if success:
+                self.recovered += 1
+            else:
+                self.failed += 1
+
+    def dump(self):
+        with self.lock:
+            return {
+                "retries": self.retries,
+                "recovered": self.recovered,
+                "failed": self.failed,
+                "delay": self.delay,
+                "codes": dict(self.codes)
+            }
+
+    def __str__(self):
+        with self.lock:
+            return "{0} retries ({1}), {2} requests recovered, {3} gave up, {4:.1f}s spent waiting".format(
+                self.retries,
+                ", ".join("{0}: {1}".format(code, count) for code, count in sorted(self.codes.items())),
+                self.recovered, self.failed, self.delay)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed request should be sent again. Requests that are not idempotent
+    are only retried when the connection could not be established at all, so the server never
+    saw them; everything else is retried on the RETRY_CODES, with exponential backoff and full
+    jitter, until either the attempts or the time budget of that call are spent.
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 budget=DEFAULT_BUDGET, codes=RETRY_CODES):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.codes = codes
+        self.stats = RetryStats()
+
+    def reset(self, attempts=None):
+        """
+        Starts counting retries anew, and changes the amount of attempts if given.
+        """
+
+        if attempts is not None:
+            self.attempts = attempts
+        self.stats = RetryStats()
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def should_retry(self, error, attempt, elapsed, idempotent):
+        if attempt >= self.attempts:
+            return False
+
+        if self.budget is not None and elapsed >= self.budget:
+            return False
+
+        if error.code not in self.codes:
+            return False
+
+        return idempotent or getattr(error, "not_sent", False)
@@ -0,0 +1,425 @@
+import json
+import os
+import threading
+import time
+
+import requests
+
+from anthill_tools.progress import sizeof_fmt
+
+
+SLICE_SIZE = 256 * 1024
+# how often streams waiting for bandwidth look again, in case a wake up was missed
+MAX_WAIT = 0.1
+# a transfer waiting this long for its next slice goes first, so the server doesn't drop it as stalled
+MAX_STARVATION = 5.0
+CONTROL_INTERVAL = 1.0
+REPORT_SIZE = 20
+
+SMALLEST_FIRST = "smallest"
+WEIGHTED = "weighted"
+FIFO = "fifo"
+POLICIES = [SMALLEST_FIRST, WEIGHTED, FIFO]
+
+
+class Bucket(object):
+    """
+    A token bucket allowing rate bytes per second, and up to a second worth of bytes at once after being
+    idle. Bytes are taken even if there are not enough tokens, the debt is paid off by waiting.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate or None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        self.rate = rate or None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        if self.rate is None:
+            return 0.0
+
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def take(self, amount):
+        if self.rate is not None:
+            self.tokens -= amount
+
+
+class Stream(object):
+    """
+    One transfer sent through a Scheduler: the bytes it may still send are granted slice by slice, under
+    its own rate limit (or the scheduler's limit per stream) and the scheduler's global one.
+    """
+
+    def __init__(self, scheduler, name, size, weight=1, rate=None):
+        self.scheduler = scheduler
+        self.name = name
+        self.size = size
+        self.weight = max(weight or 1, 0.001)
+        self.rate = rate
+        self.bucket = Bucket(rate or scheduler.stream_rate)
+
+        self.sent = 0
+        self.waited = 0.0
+        self.started = time.monotonic()
+        self.finished = None
+        self.order = None
+        self.asked = None
+
+    @property
+    def remaining(self):
+        return max(self.size - self.sent, 0) if self.size else float("inf")
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def average(self):
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def set_rate(self, rate):
+        self.scheduler.set_stream_rate(rate, self)
+
+    def consume(self, amount):
+        self.scheduler.acquire(self, amount)
+
+    def close(self):
+        self.scheduler.close(self)
+
+    def dump(self):
+        return {
+            "name": self.name,
+            "size": self.size,
+            "sent": self.sent,
+            "waited": self.waited,
+            "elapsed": self.elapsed,
+            "rate": self.average
+        }
+
+
+class Scheduler(object):
+    """
+    Shares the upload bandwidth of the process between the transfers running at once. Every slice of a
+    transfer waits for its own stream limit and for the global limit; when several transfers wait for
+    the global limit, the policy picks the next one: the transfer with the fewest bytes left (smallest,
+    the default, so small bundles are not stuck behind a huge one), the one that sent the least for its
+    weight (weighted), or the one that asked first (fifo). Limits can be changed at any time, waiting
+    transfers follow at once. Without limits, nothing waits.
+
+    Finished transfers are kept with the time they spent waiting and the rate they achieved.
+    """
+
+    def __init__(self, rate=None, stream_rate=None, policy=SMALLEST_FIRST):
+        if policy not in POLICIES:
+            raise ValueError("Unknown scheduling policy: {0}".format(policy))
+
+        self.condition = threading.Condition()
+        self.bucket = Bucket(rate)
+        self.stream_rate = stream_rate or None
+        self.policy = policy
+        self.waiting = []
+        self.requests = 0
+        self.transfers = []
+        self.control = None
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @property
+    def shaping(self):
+        return self.bucket.rate is not None or self.stream_rate is not None
+
+    def configure(self, rate=None, stream_rate=None, policy=None):
+        with self.condition:
+            if policy is not None:
+                if policy not in POLICIES:
+                    raise ValueError("Unknown scheduling policy: {0}".format(policy))
+                self.policy = policy
+
+            self.bucket.set_rate(rate)
+            self.set_stream_rate(stream_rate)
+            self.condition.notify_all()
+
+    def set_rate(self, rate):
+        with self.condition:
+            self.bucket.set_rate(rate)
+            self.condition.notify_all()
+
+    def set_stream_rate(self, rate, stream=None):
+        """
+        Changes the limit of one stream, or the default limit of all streams without a limit of their own.
+        """
+
+        with self.condition:
+            if stream is not None:
+                stream.rate = rate
+                stream.bucket.set_rate(rate or self.stream_rate)
+            else:
+                self.stream_rate = rate or None
+                for waiting in self.waiting:
+                    if not waiting.rate:
+                        waiting.bucket.set_rate(self.stream_rate)
+            self.condition.notify_all()
+
+    def stream(self, name, size, weight=1, rate=None):
+        return Stream(self, name, size, weight, rate)
+
+    def next(self, now):
+        ready = [stream for stream in self.waiting if stream.bucket.delay(now) <= 0]
+        if not ready:
+            return None
+
+        starving = [stream for stream in ready if now - stream.asked > MAX_STARVATION]
+        if starving:
+            return min(starving, key=lambda stream: stream.order)
+
+        if self.policy == SMALLEST_FIRST:
+            return min(ready, key=lambda stream: (stream.remaining, stream.order))
+        if self.policy == WEIGHTED:
+            return min(ready, key=lambda stream: (stream.sent / stream.weight, stream.order))
+        return min(ready, key=lambda stream: stream.order)
+
+    def acquire(self, stream, amount):
+        if not self.shaping:
+            stream.sent += amount
+            return
+
+        started = time.monotonic()
+
+        with self.condition:
+            self.requests += 1
+            stream.order = self.requests
+            stream.asked = started
+            self.waiting.append(stream)
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = stream.bucket.delay(now)
+
+                    if wait <= 0:
+                        wait = self.bucket.delay(now)
+                        if wait <= 0:
+                            if self.next(now) is stream:
+                                break
+                            # another stream goes first, it wakes the others up once it took its bytes
+                            wait = MAX_WAIT
+
+                    self.condition.wait(min(wait, MAX_WAIT))
+
+                self.bucket.take(amount)
+                stream.bucket.take(amount)
+                stream.sent += amount
+            finally:
+                self.waiting.remove(stream)
+                self.condition.notify_all()
+
+        stream.waited += time.monotonic() - started
+
+    def close(self, stream):
+        if stream.finished is not None:
+            return
+
+        stream.finished = time.monotonic()
+
+        with self.condition:
+            self.transfers.append(stream)
+
+    def reset(self):
+        with self.condition:
+            self.transfers = []
+
+    def report(self, log=print, size=REPORT_SIZE):
+        """
+        Logs the transfers that waited the longest for bandwidth, with the rate each of them achieved.
+        """
+
+        with self.condition:
+            transfers = sorted(self.transfers, key=lambda stream: stream.waited, reverse=True)
+
+        if not transfers:
+            return
+
+        log("Transfers:")
+        log("  {0:<32} {1:>10} {2:>9} {3:>9} {4:>12}".format("name", "size", "waited", "time", "rate"))
+
+        for stream in transfers[:size]:
+            log("  {0:<32} {1:>10} {2:>9} {3:>9} {4:>12}".format(
+                stream.name[-32:], sizeof_fmt(stream.sent), "{0:.2f}s".format(stream.waited),
+                "{0:.2f}s".format(stream.elapsed), sizeof_fmt(stream.average) + "/s"))
+
+        if len(transfers) > size:
+            log("  ... and {0} more".format(len(transfers) - size))
+
+        waited = sum(stream.waited for stream in transfers)
+        log("  {0} transfer(s), {1} sent, {2:.2f}s waited in total".format(
+            len(transfers), sizeof_fmt(sum(stream.sent for stream in transfers)), waited))
+
+    def follow(self, location, interval=CONTROL_INTERVAL):
+        """
+        Applies the limits in a JSON file whenever it changes, so they can be adjusted while uploading:
+        {"bandwidth": <MB/s>, "stream_bandwidth": <MB/s>, "schedule": "smallest|weighted|fifo"}.
+        Missing or zero limits mean no limit.
+        """
+
+        if self.control is not None:
+            self.control.stop()
+
+        self.control = LimitsFile(self, location, interval)
+        self.control.start()
+        return self.control
+
+    def unfollow(self):
+        if self.control is not None:
+            self.control.stop()
+            self.control = None
+
+
+class LimitsFile(object):
+    def __init__(self, scheduler, location, interval=CONTROL_INTERVAL):
+        self.scheduler = scheduler
+        self.location = location
+        self.interval = interval
+        self.modified = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.check()
+        self.thread = threading.Thread(target=self.run, name="limits", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        try:
+            modified = os.stat(self.location).st_mtime_ns
+        except OSError:
+            return
+
+        if modified == self.modified:
+            return
+
+        self.modified = modified
+
+        try:
+            with open(self.location, "r") as f:
+                limits = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if not isinstance(limits, dict):
+            return
+
+        megabyte = 1024 * 1024
+
+        try:
+            self.scheduler.configure(
+                rate=(limits.get("bandwidth") or 0) * megabyte,
+                stream_rate=(limits.get("stream_bandwidth") or 0) * megabyte,
+                policy=limits.get("schedule"))
+        except (TypeError, ValueError):
+            return
+
+
+class LimitedBody(object):
+    def __init__(self, data, stream, slice_size=SLICE_SIZE):
+        self.data = data
+        self.stream = stream
+        self.slice_size = slice_size
+        self.whole = isinstance(data, (bytes, bytearray, memoryview))
+        self.start = None if hasattr(data, "rewind") or not hasattr(data, "tell") else data.tell()
+        # bytes passed on since the last rewind, which is what the HTTP client sent
+        self.sent_bytes = 0
+
+    @property
+    def name(self):
+        return getattr(self.data, "name", None)
+
+    @property
+    def rewindable(self):
+        if self.whole:
+            return True
+        if hasattr(self.data, "rewind"):
+            return self.data.rewindable
+        return self.start is not None and hasattr(self.data, "seek")
+
+    def rewind(self):
+        self.sent_bytes = 0
+
+        if self.whole:
+            return
+        if hasattr(self.data, "rewind"):
+            self.data.rewind()
+        else:
+            self.data.seek(self.start)
+
+
+class LimitedBlocks(LimitedBody):
+    def __iter__(self):
+        self.sent_bytes = 0
+
+        for block in [self.data] if self.whole else self.data:
+            for position in range(0, len(block), self.slice_size):
+                piece = block[position:position + self.slice_size]
+                self.stream.consume(len(piece))
+                self.sent_bytes += len(piece)
+                yield piece
+
+    def __len__(self):
+        return requests.utils.super_len(self.data)
+
+
+class LimitedStream(LimitedBody):
+    # bodies of unknown length (like compressed ones) are sent chunked, so this one has no length either
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.slice_size:
+            size = self.slice_size
+
+        data = self.data.read(size)
+        if data:
+            self.stream.consume(len(data))
+            self.sent_bytes += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.slice_size)
+            if not data:
+                return
+            yield data
+
+
+class LimitedReader(LimitedStream):
+    def __len__(self):
+        return requests.utils.super_len(self.data)
+
+
+def scheduled(data, stream):
+    """
+    Wraps an upload body so it is sent at the pace the scheduler of stream allows: bytes and iterables of
+    blocks (like FileBody) are passed on in slices, file-like bodies are read in slices. The wrapper has
+    a length only if the body has one, so the HTTP client sends it the same way.
+    """
+
+    if not hasattr(data, "read"):
+        return LimitedBlocks(data, stream)
+
+    if hasattr(data, "__len__") or hasattr(data, "tell"):
+        return LimitedReader(data, stream)
+
+    return LimitedStream(data, stream)
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+
+DEFAULT_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "tokens.json")
+DEFAULT_TTL = 3600
+EXPIRY_MARGIN = 60
+
+
+class TokenStore(object):
+    def __init__(self, location=DEFAULT_LOCATION):
+        self.location = location
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(environment, gamespace, credential, username, scopes, options=None):
+        options = {
+            option: value
+            for option, value in (options or {}).items()
+            if option not in ("username", "key", "password")
+        }
+
+        return json.dumps([
+            environment, gamespace, credential, username, sorted(scopes), options
+        ], sort_keys=True)
+
+    def read(self):
+        if self.location is None:
+            return {}
+
+        try:
+            with open(self.location, "r") as f:
+                tokens = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return tokens if isinstance(tokens, dict) else {}
+
+    def write(self, tokens):
+        if self.location is None:
+            return
+
+        now = time.time()
+
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        temp_location = "{0}.{1}.tmp".format(self.location, os.getpid())
+        fd = os.open(temp_location, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                key: entry
+                for key, entry in tokens.items()
+                if entry.get("expires", 0) > now
+            }, f)
+        os.replace(temp_location, self.location)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.tokens.get(key)
+
+            if entry is None:
+                entry = self.read().get(key)
+
+        if entry is None or entry.get("expires", 0) - EXPIRY_MARGIN <= time.time():
+            return None
+
+        return entry.get("token")
+
+    def put(self, key, token, expires_in=None):
+        entry = {
+            "token": token,
+            "expires": time.time() + (expires_in or DEFAULT_TTL)
+        }
+
+        with self.lock:
+            self.tokens[key] = entry
+
+            tokens = self.read()
+            tokens[key] = entry
+            self.write(tokens)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.tokens.pop(key, None)
+
+            tokens = self.read()
+            if tokens.pop(key, None) is not None:
+                self.write(tokens)
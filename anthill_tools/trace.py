@@ -0,0 +1,346 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from anthill_tools.progress import sizeof_fmt
+
+
+class Event(object):
+    """
+    A finished span of work: either a "phase" of a deployer, or a single "request" attempt with
+    its service, action, URL (without the query, so access tokens stay out of traces), status,
+    latency and the amount of bytes sent and received.
+    """
+
+    def __init__(self, kind, name, started, latency, trace_id, span_id, parent_id=None, phase=None,
+                 service=None, action=None, method=None, url=None, status=None, bytes_in=0, bytes_out=0,
+                 attempt=0, error=None):
+        self.kind = kind
+        self.name = name
+        self.started = started
+        self.latency = latency
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.phase = phase
+        self.service = service
+        self.action = action
+        self.method = method
+        self.url = url
+        self.status = status
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.attempt = attempt
+        self.error = error
+
+    def dump(self):
+        return dict(self.__dict__)
+
+
+def busy_time(spans):
+    """
+    Total time covered by (started, finished) spans, counting overlapping spans once.
+    """
+
+    total = 0.0
+    end = None
+
+    for started, finished in sorted(spans):
+        if end is not None and started < end:
+            started = end
+        if finished > started:
+            total += finished - started
+            end = finished
+
+    return total
+
+
+class Phase(object):
+    def __init__(self, name, span_id, parent_id):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.started = time.time()
+        self.clock = time.monotonic()
+
+
+class Tracer(object):
+    """
+    Passes events to the hooks added. Phases nest per thread; a request is attributed to the innermost
+    phase of its own thread or, on threads without phases (like upload workers), to the phase started
+    last, so it still counts towards the phase that started the work.
+    """
+
+    def __init__(self):
+        self.hooks = []
+        self.phases = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.trace_id = os.urandom(16).hex()
+
+    @property
+    def enabled(self):
+        return bool(self.hooks)
+
+    @staticmethod
+    def new_span_id():
+        return os.urandom(8).hex()
+
+    def add_hook(self, hook):
+        with self.lock:
+            self.hooks = self.hooks + [hook]
+
+    def remove_hook(self, hook):
+        with self.lock:
+            self.hooks = [h for h in self.hooks if h is not hook]
+
+    @contextlib.contextmanager
+    def hooked(self, hooks):
+        for hook in hooks:
+            self.add_hook(hook)
+
+        try:
+            yield self
+        finally:
+            for hook in hooks:
+                self.remove_hook(hook)
+                if hasattr(hook, "close"):
+                    hook.close()
+
+    def stack(self):
+        if not hasattr(self.local, "phases"):
+            self.local.phases = []
+        return self.local.phases
+
+    def current(self):
+        stack = self.stack()
+        if stack:
+            return stack[-1]
+
+        with self.lock:
+            return self.phases[-1] if self.phases else None
+
+    def emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def request(self, started, latency, **kwargs):
+        phase = self.current()
+        kwargs.setdefault("name", "{0} {1}".format(kwargs.get("method"), kwargs.get("action") or kwargs.get("url")))
+
+        self.emit(Event(
+            "request", started=started, latency=latency, trace_id=self.trace_id, span_id=Tracer.new_span_id(),
+            parent_id=phase.span_id if phase is not None else None,
+            phase=phase.name if phase is not None else None, **kwargs))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        stack = self.stack()
+        parent = self.current()
+        phase = Phase(name, Tracer.new_span_id(), parent.span_id if parent is not None else None)
+
+        stack.append(phase)
+
+        with self.lock:
+            self.phases.append(phase)
+
+        error = None
+
+        try:
+            yield
+        except BaseException as e:
+            error = str(e)
+            raise
+        finally:
+            stack.remove(phase)
+
+            with self.lock:
+                self.phases.remove(phase)
+
+            self.emit(Event(
+                "phase", name, phase.started, time.monotonic() - phase.clock, self.trace_id, phase.span_id,
+                parent_id=phase.parent_id, phase=name, error=error))
+
+
+class PhaseSummary(object):
+    """
+    Sums up time, requests and bytes per phase and logs a table of them once closed. The time of a phase
+    is the time any thread spent in it, so phases running on several threads at once are not counted
+    more than once.
+    """
+
+    def __init__(self, log=print):
+        self.log = log
+        self.lock = threading.Lock()
+        self.order = []
+        self.phases = {}
+
+    def entry(self, name):
+        entry = self.phases.get(name)
+        if entry is None:
+            entry = self.phases[name] = {"spans": [], "requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+            self.order.append(name)
+        return entry
+
+    def __call__(self, event):
+        with self.lock:
+            entry = self.entry(event.phase or "-")
+
+            if event.kind == "phase":
+                entry["spans"].append((event.started, event.started + event.latency))
+                return
+
+            entry["requests"] += 1
+            entry["bytes_in"] += event.bytes_in or 0
+            entry["bytes_out"] += event.bytes_out or 0
+
+            if event.error is not None:
+                entry["errors"] += 1
+
+    def close(self):
+        with self.lock:
+            if not self.order:
+                return
+
+            self.log("Timings:")
+            self.log("  {0:<10} {1:>8} {2:>9} {3:>7} {4:>10} {5:>10}".format(
+                "phase", "time", "requests", "errors", "sent", "received"))
+
+            for name in self.order:
+                entry = self.phases[name]
+                self.log("  {0:<10} {1:>7.2f}s {2:>9} {3:>7} {4:>10} {5:>10}".format(
+                    name, busy_time(entry["spans"]), entry["requests"], entry["errors"],
+                    sizeof_fmt(entry["bytes_out"]), sizeof_fmt(entry["bytes_in"])))
+
+
+class JsonLinesTrace(object):
+    def __init__(self, location):
+        self.location = location
+        self.lock = threading.Lock()
+        self.f = None
+
+    def __call__(self, event):
+        with self.lock:
+            if self.f is None:
+                self.f = open(self.location, "a")
+            self.f.write(json.dumps(event.dump()) + "\n")
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+
+class SpanExporter(object):
+    """
+    Writes events as OpenTelemetry spans in the OTLP/JSON file format, one export request per line,
+    so they can be loaded into any OpenTelemetry collector or viewer later.
+    """
+
+    SPAN_KIND_INTERNAL = 1
+    SPAN_KIND_CLIENT = 3
+    STATUS_ERROR = 2
+
+    def __init__(self, location, service_name="anthill_tools"):
+        self.location = location
+        self.service_name = service_name
+        self.lock = threading.Lock()
+        self.spans = []
+
+    @staticmethod
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def span(self, event):
+        start = int(event.started * 1e9)
+
+        if event.kind == "request":
+            attributes = [
+                ("http.request.method", event.method),
+                ("url.full", event.url),
+                ("http.response.status_code", event.status),
+                ("http.request.body.size", event.bytes_out),
+                ("http.response.body.size", event.bytes_in),
+                ("http.request.resend_count", event.attempt),
+                ("anthill.service", event.service),
+                ("anthill.action", event.action)
+            ]
+        else:
+            attributes = [("anthill.phase", event.name)]
+
+        span = {
+            "traceId": event.trace_id,
+            "spanId": event.span_id,
+            "name": event.name,
+            "kind": SpanExporter.SPAN_KIND_CLIENT if event.kind == "request" else SpanExporter.SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int(event.latency * 1e9)),
+            "attributes": [
+                SpanExporter.attribute(key, value)
+                for key, value in attributes
+                if value is not None
+            ]
+        }
+
+        if event.parent_id is not None:
+            span["parentSpanId"] = event.parent_id
+
+        if event.error is not None:
+            span["status"] = {"code": SpanExporter.STATUS_ERROR, "message": event.error}
+
+        return span
+
+    def __call__(self, event):
+        with self.lock:
+            self.spans.append(self.span(event))
+
+    def close(self):
+        with self.lock:
+            if not self.spans:
+                return
+
+            request = {
+                "resourceSpans": [{
+                    "resource": {
+                        "attributes": [SpanExporter.attribute("service.name", self.service_name)]
+                    },
+                    "scopeSpans": [{
+                        "scope": {"name": "anthill_tools"},
+                        "spans": self.spans
+                    }]
+                }]
+            }
+
+            with open(self.location, "a") as f:
+                f.write(json.dumps(request) + "\n")
+
+            self.spans = []
+
+
+def trace_sinks(spec, log=print):
+    sinks = []
+
+    for item in (spec or "").split(","):
+        if not item or item == "none":
+            continue
+        if item == "summary":
+            sinks.append(PhaseSummary(log))
+        elif item.startswith("json:"):
+            sinks.append(JsonLinesTrace(item[5:]))
+        elif item.startswith("otel:"):
+            sinks.append(SpanExporter(item[5:]))
+        else:
+            raise ValueError("Unknown trace sink: {0}".format(item))
+
+    return sinks
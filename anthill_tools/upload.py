@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+
+from anthill_tools import log, scheduler, transport
+from anthill_tools.progress import Transfer
+from anthill_tools.retry import RetryPolicy
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_CHUNK_RETRIES = 5
+DEFAULT_STATE_LOCATION = os.path.join(os.path.expanduser("~"), ".anthill", "uploads")
+
+
+class UploadState(object):
+    def __init__(self, location, key):
+        self.location = os.path.join(location, key + ".json")
+        self.offset = 0
+
+    def load(self):
+        try:
+            with open(self.location, "r") as f:
+                self.offset = json.load(f).get("offset", 0)
+        except (OSError, ValueError):
+            self.offset = 0
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.location), exist_ok=True)
+        temp_location = self.location + ".tmp"
+        with open(temp_location, "w") as f:
+            json.dump({"offset": self.offset}, f)
+        os.replace(temp_location, self.location)
+
+    def remove(self):
+        try:
+            os.remove(self.location)
+        except OSError:
+            pass
+
+
+class ResumableUpload(object):
+    """
+    Uploads a file with Admin.api_put in Content-Range chunks, retrying each chunk on its own.
+    The server acknowledges every chunk with the amount of bytes it has received so far. That
+    offset is stored locally, so a new upload of the same file to the same target continues where
+    the previous one stopped. A server that does not acknowledge a chunk does not support ranged
+    uploads and would keep that chunk as the whole file, so the file is uploaded in one request then.
+    """
+
+    def __init__(self, admin, service, action, context, filename, args=None, headers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, retries=DEFAULT_CHUNK_RETRIES,
+                 state_location=None, progress=None):
+        self.admin = admin
+        self.service = service
+        self.action = action
+        self.context = context
+        self.filename = filename
+        self.args = args
+        self.headers = dict(headers or {})
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry = RetryPolicy(attempts=retries)
+        self.progress = progress
+        self.state = UploadState(state_location or DEFAULT_STATE_LOCATION, self.key())
+
+    def key(self):
+        stat = os.stat(self.filename)
+        identity = json.dumps([
+            self.admin.location, self.service, self.action, self.context,
+            os.path.abspath(self.filename), stat.st_size, stat.st_mtime_ns
+        ], sort_keys=True)
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def upload_chunk(self, f, offset, length, total, transfer, stream=None):
+        headers = dict(self.headers)
+        headers["Content-Range"] = "bytes {0}-{1}/{2}".format(offset, offset + length - 1, total)
+
+        transfer.rewind(offset)
+        data = transport().body(f, offset, length, transfer=transfer)
+
+        return self.admin.api_put(self.service, self.action, self.context, data, args=self.args,
+                                  headers=headers, retry=self.retry, stream=stream, idempotent=True)
+
+    @staticmethod
+    def acknowledged(response, offset, total):
+        """
+        The offset the server has received the file up to, if it acknowledged more than offset.
+        """
+
+        try:
+            received = response.json().get("received")
+        except (ValueError, AttributeError):
+            return None
+
+        if not isinstance(received, int) or not offset < received <= total:
+            return None
+
+        return received
+
+    def upload_whole(self, stream=None):
+        with open(self.filename, "rb") as f:
+            return self.admin.api_put(self.service, self.action, self.context, f, args=self.args,
+                                      headers=self.headers, progress=self.progress, stream=stream,
+                                      idempotent=False)
+
+    def upload(self):
+        total = os.path.getsize(self.filename)
+
+        if not total:
+            return self.upload_whole()
+
+        self.state.load()
+        if self.state.offset >= total:
+            self.state.offset = 0
+
+        if self.state.offset:
+            log("Resuming upload from {0} of {1} bytes".format(self.state.offset, total))
+
+        result = None
+        transfer = Transfer(os.path.basename(self.filename), total, self.progress, sent=self.state.offset)
+
+        # the chunks share one stream, so the scheduler sees the whole file as one transfer
+        stream = None
+        if scheduler().shaping:
+            stream = scheduler().stream(os.path.basename(self.filename), total - self.state.offset)
+
+        try:
+            with open(self.filename, "rb") as f:
+                while True:
+                    length = min(self.chunk_size, total - self.state.offset)
+                    result = self.upload_chunk(f, self.state.offset, length, total, transfer, stream)
+                    received = self.acknowledged(result, self.state.offset, total)
+
+                    if received is None:
+                        log("Chunks of {0} were not acknowledged, uploading it in one request".format(
+                            os.path.basename(self.filename)))
+                        self.state.remove()
+                        return self.upload_whole(stream)
+
+                    self.state.offset = received
+
+                    if self.state.offset >= total:
+                        break
+
+                    self.state.save()
+        finally:
+            if stream is not None:
+                stream.close()
+
+        self.state.remove()
+        return result
@@ -14,6 +14,12 @@ setup(name='anthill_tools',
       author='desertkun',
       author_email='desertkun@gmail.com',
       license='MIT',
-      packages=['anthill_tools', 'anthill_tools.admin', 'anthill_tools.admin.dlc', 'anthill_tools.admin.game'],
+      packages=['anthill_tools', 'anthill_tools.admin', 'anthill_tools.admin.dlc', 'anthill_tools.admin.game',
+                'anthill_tools.benchmarks'],
       zip_safe=False,
-      install_requires=['requests'])
+      install_requires=['requests'],
+      extras_require={
+          'aio': ['aiohttp'],
+          'zstd': ['zstandard'],
+          'xxhash': ['xxhash']
+      })
@@ -0,0 +1,86 @@
+import atexit
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# default locations are resolved when anthill_tools is imported, keep them out of the real home
+HOME = tempfile.mkdtemp(prefix="anthill-tools-tests-")
+os.environ["HOME"] = HOME
+atexit.register(shutil.rmtree, HOME, True)
+
+from anthill_tools import configure_bandwidth, configure_retry
+from anthill_tools.mock import MockAnthill
+from anthill_tools.retry import RetryPolicy
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # retries are what is tested, not how long they wait
+    monkeypatch.setattr(RetryPolicy, "delay", lambda self, attempt: 0.0)
+    yield
+    configure_bandwidth()
+    configure_retry()
+
+
+@pytest.fixture
+def mock(request):
+    marker = request.node.get_closest_marker("mock")
+    with MockAnthill(**(marker.kwargs if marker else {})) as server:
+        yield server
+
+
+class Bundles(object):
+    def __init__(self, location):
+        self.location = location
+
+    def file(self, name, data=None, size=64 * 1024):
+        path = os.path.join(self.location, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size) if data is None else data)
+        return path
+
+    def config(self, name, bundles):
+        path = os.path.join(self.location, name)
+        with open(path, "w") as f:
+            json.dump({"bundles": {bundle: {"path": file_path} for bundle, file_path in bundles.items()}}, f)
+        return path
+
+
+@pytest.fixture
+def bundles(tmp_path):
+    return Bundles(str(tmp_path))
+
+
+@pytest.fixture
+def options(tmp_path):
+    """
+    Deploy options keeping every local cache of a test in its own directory.
+    """
+
+    return dict(
+        username="test", password="test", force=True, service_cache=False, token_cache=False,
+        hash_cache=False, journal=str(tmp_path / "deploys"), content_store=str(tmp_path / "content.json"),
+        link_stats=str(tmp_path / "link.json"))
+
+
+@pytest.fixture
+def game_options(tmp_path):
+    """
+    Game deploy options keeping every local state of a test in its own directory.
+    """
+
+    return dict(
+        username="test", password="test", service_cache=False, token_cache=False,
+        upload_state=str(tmp_path / "uploads"), link_stats=str(tmp_path / "link.json"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "mock(**kwargs): options of the MockAnthill of the test")
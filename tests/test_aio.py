@@ -0,0 +1,112 @@
+import asyncio
+import sys
+import threading
+import time
+
+import pytest
+
+from anthill_tools import ApplicationInfo, ServiceError, aio, log
+from anthill_tools.cache import ServiceCache
+from anthill_tools.tokens import TokenStore
+
+
+def admin(mock, tmp_path):
+    async def connect():
+        environment = aio.Environment(mock.environment_location, ApplicationInfo("test", "1.0", "root"),
+                                      cache=ServiceCache(str(tmp_path / "services.json")))
+        await environment.init()
+        services = await environment.discovery.get_services(["login", "admin"])
+        await services["login"].auth_dev("test", "test", ["admin"], cache=TokenStore(str(tmp_path / "tokens.json")))
+        return services["admin"]
+
+    return connect()
+
+
+def new_bundle(mock):
+    mock.state.new_bundles[1] = {"name": "a", "data_id": 1, "hash": None, "size": 0}
+    mock.state.data_versions[1] = {"bundles": {}, "published": False}
+
+
+def run(coroutine):
+    async def closing():
+        try:
+            return await coroutine
+        finally:
+            await aio.close()
+
+    return asyncio.run(closing())
+
+
+@pytest.mark.mock(error_rate=0.5, error_methods=("PUT",), seed=1)
+def test_file_upload_is_retried(mock, bundles, tmp_path):
+    path = bundles.file("a.bin", size=1024 * 1024)
+    new_bundle(mock)
+
+    async def upload():
+        service = await admin(mock, tmp_path)
+        with open(path, "rb") as f:
+            await service.api_put("dlc", "bundle", {"app_id": "test", "data_id": 1, "bundle_id": 1}, f,
+                                  idempotent=True)
+
+    run(upload())
+
+    assert mock.state.errors
+    assert mock.state.count("PUT") == mock.state.errors + 1
+    assert mock.state.new_bundles[1]["size"] == 1024 * 1024
+
+
+@pytest.mark.mock(error_rate=1.0, error_methods=("PUT",))
+def test_non_idempotent_upload_is_not_retried(mock, bundles, tmp_path):
+    path = bundles.file("a.bin")
+    new_bundle(mock)
+
+    async def upload():
+        service = await admin(mock, tmp_path)
+        with open(path, "rb") as f:
+            await service.api_put("dlc", "bundle", {"app_id": "test", "data_id": 1, "bundle_id": 1}, f,
+                                  idempotent=False)
+
+    with pytest.raises(ServiceError):
+        run(upload())
+
+    assert mock.state.count("PUT") == 1
+
+
+def test_cached_services_and_token_are_reused(mock, tmp_path):
+    run(admin(mock, tmp_path))
+    requests = len(mock.state.requests)
+
+    run(admin(mock, tmp_path))
+
+    assert len(mock.state.requests) == requests
+
+
+class SlowOutput(object):
+    # gives other threads a chance to write between the parts of a printed line
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        time.sleep(0.0001)
+        self.parts.append(data)
+
+    def flush(self):
+        pass
+
+
+def test_log_lines_stay_whole(monkeypatch):
+    output = SlowOutput()
+    monkeypatch.setattr(sys, "stdout", output)
+
+    def logging(line):
+        for _ in range(50):
+            log(line)
+
+    threads = [threading.Thread(target=logging, args=(str(index),)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    lines = "".join(output.parts).splitlines()
+    assert sorted(lines) == sorted(str(index) for index in range(8) for _ in range(50))
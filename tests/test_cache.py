@@ -0,0 +1,59 @@
+import time
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.cache import ServiceCache
+
+
+def lookups(mock):
+    return [request for request in mock.state.requests if request[1].split("/")[1] in ("environment", "discovery")]
+
+
+def test_second_deploy_skips_environment_and_discovery(mock, bundles, options, tmp_path):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin")})
+    options = dict(options, service_cache=ServiceCache(str(tmp_path / "services.json")))
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    first = len(lookups(mock))
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+
+    assert first
+    assert len(lookups(mock)) == first
+
+
+def test_entries_expire(tmp_path):
+    cache = ServiceCache(str(tmp_path / "services.json"), ttl=60)
+    cache.put("fresh", {"a": 1})
+    cache.put("stale", {"a": 1})
+
+    entries = cache.read()
+    entries["stale"]["expires"] = time.time() - 1
+    cache.write(entries)
+
+    assert cache.get("fresh") == {"a": 1}
+    assert cache.get("stale") is None
+    assert "stale" not in cache.read()
+
+
+def test_update_merges_values(tmp_path):
+    cache = ServiceCache(str(tmp_path / "services.json"))
+    cache.put("discovery", {"login": "http://login"})
+    cache.update("discovery", {"admin": "http://admin"})
+
+    assert cache.get("discovery") == {"login": "http://login", "admin": "http://admin"}
+
+
+def test_invalidate(tmp_path):
+    cache = ServiceCache(str(tmp_path / "services.json"))
+    cache.put("environment", {"discovery": "http://discovery"})
+    cache.put("discovery", {"login": "http://login"})
+    cache.invalidate("environment", "discovery")
+
+    assert cache.get("environment") is None
+    assert cache.get("discovery") is None
+
+
+def test_cache_without_location_stays_in_memory(tmp_path):
+    cache = ServiceCache(None)
+    cache.put("discovery", {"login": "http://login"})
+
+    assert cache.get("discovery") == {"login": "http://login"}
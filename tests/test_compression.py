@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import io
+
+import pytest
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.compression import Compression, CompressedReader
+
+
+TEXT = b"compressible " * 100000
+
+
+def test_reader_round_trip():
+    reader = CompressedReader(io.BytesIO(TEXT), "gzip", 6, read_size=4096)
+    compressed = b"".join(reader)
+
+    assert gzip.decompress(compressed) == TEXT
+    assert reader.raw_bytes == len(TEXT)
+    assert reader.sent_bytes == len(compressed)
+
+
+def test_reader_rewinds_to_where_it_started():
+    f = io.BytesIO(b"header" + TEXT)
+    f.seek(6)
+    reader = CompressedReader(f, "gzip", 6)
+    first = reader.read()
+
+    assert reader.rewindable
+    reader.rewind()
+
+    assert reader.read() == first
+    assert gzip.decompress(first) == TEXT
+
+
+@pytest.mark.parametrize("spec, codec, level, auto", [
+    ("gzip", "gzip", 6, False), ("gzip:9", "gzip", 9, False), ("auto", "gzip", 6, True),
+    ("auto:gzip:1", "gzip", 1, True)])
+def test_parse(spec, codec, level, auto):
+    compression = Compression.parse(spec)
+
+    assert (compression.codec, compression.level, compression.auto) == (codec, level, auto)
+
+
+@pytest.mark.parametrize("spec", [None, "", "none"])
+def test_parse_none(spec):
+    assert Compression.parse(spec) is None
+
+
+def test_parse_unknown_codec():
+    with pytest.raises(ValueError):
+        Compression.parse("brotli")
+
+
+def test_auto_skips_incompressible_files(bundles):
+    compression = Compression.parse("auto")
+
+    with open(bundles.file("random.bin"), "rb") as random, open(bundles.file("text.bin", TEXT), "rb") as text:
+        assert not compression.applies(random)
+        assert compression.applies(text)
+        assert random.tell() == 0 and text.tell() == 0
+
+
+@pytest.mark.parametrize("compression", ["gzip", "auto"])
+def test_deploy_sends_less_with_the_same_hash(mock, bundles, options, compression):
+    config = bundles.config("config.json", {
+        "text": bundles.file("text.bin", TEXT),
+        "random": bundles.file("random.bin")
+    })
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, compression=compression, **options)
+
+    assert ("text", hashlib.md5(TEXT).hexdigest()) in mock.state.bundles
+    assert mock.state.received_bytes < len(TEXT)
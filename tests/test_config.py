@@ -0,0 +1,65 @@
+import io
+import json
+
+import pytest
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.admin.dlc.config import read_config, read_json
+
+
+class Trickle(io.StringIO):
+    # returns a few characters per read, so values are split across reads
+    def read(self, size=-1):
+        return super(Trickle, self).read(3)
+
+
+BUNDLES = {
+    "a": {"path": "a.bin", "filters": {"platform": "ios"}, "properties": {"weight": 1.5e3, "tags": ["x", "y"]}},
+    "b \"quoted\"": {"path": "dir\\b.bin", "properties": {"count": 1234567890, "enabled": True, "none": None}},
+    "c": {"path": "c.bin", "properties": {"negative": -0.25}}
+}
+
+
+def test_bundles_match_the_whole_document():
+    document = json.dumps({"version": [1, {"nested": "}"}], "bundles": BUNDLES, "after": "ignored"}, indent=2)
+
+    assert dict(read_json(Trickle(document))) == BUNDLES
+
+
+def test_bundles_are_yielded_while_reading():
+    reader = read_json(Trickle('{"bundles": {"a": {"path": "a.bin"}, "b": '))
+
+    assert next(reader) == ("a", {"path": "a.bin"})
+    with pytest.raises(ValueError):
+        next(reader)
+
+
+@pytest.mark.parametrize("document", ['{"bundles": []}', '{"bundles": {"a" {}}}', '[]', '{"bundles": {1: {}}}'])
+def test_malformed_documents(document):
+    with pytest.raises(ValueError):
+        list(read_json(Trickle(document)))
+
+
+def test_json_lines(tmp_path):
+    location = tmp_path / "config.jsonl"
+    location.write_text("\n".join(json.dumps(dict(config, name=name)) for name, config in BUNDLES.items()) + "\n\n")
+
+    assert [name for name, config in read_config(str(location))] == list(BUNDLES)
+
+
+def test_json_lines_without_name(tmp_path):
+    location = tmp_path / "config.jsonl"
+    location.write_text('{"name": "a", "path": "a.bin"}\n{"path": "b.bin"}\n')
+
+    with pytest.raises(ValueError, match="Line 2"):
+        list(read_config(str(location)))
+
+
+def test_deploy_from_json_lines(mock, bundles, options, tmp_path):
+    location = tmp_path / "config.jsonl"
+    location.write_text("\n".join(json.dumps({"name": name, "path": bundles.file(name + ".bin")}) for name in "abc"))
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", str(location), **options)
+
+    published = [data for data in mock.state.data_versions.values() if data["published"]]
+    assert sorted(published[0]["bundles"]) == ["a", "b", "c"]
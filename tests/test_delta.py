@@ -0,0 +1,82 @@
+import io
+import os
+import random
+
+from anthill_tools.admin.dlc import delta, deployer
+
+
+def chunk_sizes(data, **kwargs):
+    return [len(chunk) for offset, chunk in delta.chunks(io.BytesIO(data), **kwargs)]
+
+
+def text(lines):
+    generator = random.Random(1)
+    return b"".join(b'{"id": %d, "name": "item%d", "value": %f}\n' % (i, i * 7, generator.random())
+                    for i in range(lines))
+
+
+def test_chunks_cover_the_file_within_bounds():
+    data = os.urandom(24 * 1024 * 1024)
+    offset = 0
+
+    for chunk_offset, chunk in delta.chunks(io.BytesIO(data)):
+        assert chunk_offset == offset
+        assert chunk == data[offset:offset + len(chunk)]
+        offset += len(chunk)
+
+    sizes = chunk_sizes(data)
+    assert offset == len(data)
+    assert all(delta.CHUNK_MIN_SIZE < size <= delta.CHUNK_MAX_SIZE for size in sizes[:-1])
+    assert 8 <= len(sizes) <= 40
+
+
+def test_chunks_do_not_depend_on_reads(monkeypatch):
+    class Reader(io.BytesIO):
+        def read(self, size=-1):
+            return super(Reader, self).read(min(size, 1000003))
+
+    data = os.urandom(12 * 1024 * 1024)
+    expected = chunk_sizes(data)
+
+    monkeypatch.setattr(delta, "READ_SIZE", 1000003)
+    assert [len(chunk) for offset, chunk in delta.chunks(Reader(data))] == expected
+
+
+def test_insertion_only_changes_the_chunk_around_it():
+    for data in (os.urandom(16 * 1024 * 1024), text(300000)):
+        changed = data[:5000000] + b"inserted" + data[5000000:]
+        before = set(chunk for offset, chunk in delta.chunks(io.BytesIO(data)))
+        after = [chunk for offset, chunk in delta.chunks(io.BytesIO(changed))]
+
+        assert len(after) > 4
+        assert sum(chunk not in before for chunk in after) <= 2
+
+
+def test_constant_data_is_cut_at_max_size():
+    assert chunk_sizes(bytes(20 * 1024 * 1024)) == [delta.CHUNK_MAX_SIZE, delta.CHUNK_MAX_SIZE, 4 * 1024 * 1024]
+
+
+def test_bundles_are_chunked_once_uploaded_before(mock, bundles, options):
+    data = os.urandom(6 * 1024 * 1024)
+    path = bundles.file("a.bin", data)
+    config = bundles.config("config.json", {"a": path})
+
+    def deploy():
+        deployer.deploy(mock.environment_location, "test", "1.0", "root", config, delta=True,
+                        **dict(options, content_store=False))
+        bundle_hash = [data_version for data_version in mock.state.data_versions.values()
+                       if data_version["published"]][-1]["bundles"]["a"]
+        assert mock.state.bundles[("a", bundle_hash)] == os.path.getsize(path)
+
+    # nothing to share chunks with yet
+    deploy()
+    assert not mock.state.chunks
+
+    bundles.file("a.bin", data + b"appended")
+    deploy()
+    chunks = len(mock.state.chunks)
+    assert chunks > 2
+
+    bundles.file("a.bin", data[:3000000] + b"inserted" + data[3000000:] + b"appended")
+    deploy()
+    assert len(mock.state.chunks) - chunks <= 2
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from anthill_tools.admin.dlc import deployer
+
+
+def target(mock, name, gamespace="root", **options):
+    return dict({"environment": mock.environment_location, "name": name, "version": "1.0",
+                 "gamespace": gamespace}, **options)
+
+
+def many_options(options):
+    return {option: options[option] for option in ("username", "password", "hash_cache", "content_store",
+                                                   "journal", "link_stats")}
+
+
+def test_targets_share_caches_and_payloads(mock, bundles, options, tmp_path):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin"), "b": bundles.file("b.bin")})
+    report = str(tmp_path / "report.json")
+
+    deployer.deploy_many([target(mock, "one"), target(mock, "two"), target(mock, "one", "other")], config,
+                         service_cache=False, token_cache=False, report_output=report, **many_options(options))
+
+    # one authentication per gamespace, one environment lookup per app, each payload uploaded once
+    assert mock.state.count("POST", "/login/auth") == 2
+    assert len([request for request in mock.state.requests if request[1].startswith("/environment")]) == 2
+    assert mock.state.count("PUT", "/admin/service/upload") == 2
+
+    with open(report) as f:
+        entries = json.load(f)
+
+    assert [entry["ok"] for entry in entries] == [True] * 3
+    assert sum(entry["uploaded"] for entry in entries) == 2
+
+
+def test_failed_target_does_not_stop_the_others(mock, bundles, options, tmp_path):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin")})
+    targets = [deployer.Target.parse(target(mock, "one"), config),
+               deployer.Target.parse(target(mock, "two", config=str(tmp_path / "missing.json")))]
+
+    with pytest.raises(deployer.DeliverError, match="1 of 2"):
+        deployer.deploy_many(targets, service_cache=False, token_cache=False, **many_options(options))
+
+    assert targets[0].error is None
+    # the config is read while delivering
+    assert targets[1].error.startswith("deliver failed") and "missing.json" in targets[1].error
+    assert len([data for data in mock.state.data_versions.values() if data["published"]]) == 1
+
+
+def test_target_options():
+    parsed = deployer.Target.parse({"environment": "http://env", "name": "one", "version": "1.0",
+                                    "gamespace": "root", "config": "one.json", "delta": True, "force": False})
+
+    assert parsed.config_location == "one.json"
+    assert parsed.options == {"delta": True}
+
+
+def test_target_without_config():
+    with pytest.raises(deployer.DeliverError, match="config"):
+        deployer.Target.parse({"environment": "http://env", "name": "one", "version": "1.0", "gamespace": "root"})
@@ -0,0 +1,120 @@
+import hashlib
+import os
+
+import pytest
+
+from anthill_tools import Admin, ServiceError
+from anthill_tools.admin.dlc import deployer
+
+
+def published(mock):
+    data_versions = mock.state.data_versions
+    return [data for data in data_versions.values() if data["published"]]
+
+
+def test_deploy_uploads_and_publishes(mock, bundles, options):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin"), "b": bundles.file("b.bin")})
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+
+    assert mock.state.count("PUT", "/admin/service/upload") == 2
+    assert sorted(published(mock)[0]["bundles"]) == ["a", "b"]
+
+
+@pytest.mark.parametrize("batch_check", [True, False])
+def test_batch_check_falls_back_to_single_checks(mock, bundles, options, batch_check):
+    mock.state.batch_check = batch_check
+    config = bundles.config("config.json", {name: bundles.file(name + ".bin") for name in "abc"})
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **dict(options, content_store=False))
+
+    # the second deploy finds every bundle on the server and attaches it
+    assert mock.state.count("PUT", "/admin/service/upload") == 3
+    assert len(published(mock)) == 2
+    assert mock.state.count("POST", "/dlc/bundles/check") > 0
+    assert mock.state.count("GET", "/dlc/bundle") == (0 if batch_check else 6)
+
+
+def test_resume_continues_the_interrupted_data_version(mock, bundles, options, monkeypatch):
+    config = bundles.config("config.json", {name: bundles.file(name + ".bin") for name in "abc"})
+    api_put = Admin.api_put
+    calls = []
+
+    def failing(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise ServiceError(500, "Interrupted")
+        return api_put(self, *args, **kwargs)
+
+    monkeypatch.setattr(Admin, "api_put", failing)
+
+    with pytest.raises(deployer.DeliverError):
+        deployer.deploy(mock.environment_location, "test", "1.0", "root", config, jobs=1, retries=0, **options)
+
+    assert not published(mock)
+    assert os.listdir(options["journal"])
+
+    monkeypatch.setattr(Admin, "api_put", api_put)
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, resume=True, **options)
+
+    # one data version, published with every bundle, and only the unfinished bundles uploaded again
+    assert len(mock.state.data_versions) == 1
+    assert sorted(published(mock)[0]["bundles"]) == ["a", "b", "c"]
+    assert mock.state.count("PUT", "/admin/service/upload") == 3
+    assert not os.listdir(options["journal"])
+
+
+def test_resume_uploads_bundles_changed_since(mock, bundles, options, monkeypatch):
+    path = bundles.file("a.bin")
+    config = bundles.config("config.json", {"a": path, "b": bundles.file("b.bin")})
+
+    api_post = Admin.api_post
+
+    def no_publish(self, service, action, method, *args, **kwargs):
+        if method == "publish":
+            raise ServiceError(500, "Interrupted")
+        return api_post(self, service, action, method, *args, **kwargs)
+
+    monkeypatch.setattr(Admin, "api_post", no_publish)
+
+    with pytest.raises(ServiceError):
+        deployer.deploy(mock.environment_location, "test", "1.0", "root", config, retries=0, **options)
+
+    monkeypatch.setattr(Admin, "api_post", api_post)
+    bundles.file("a.bin")
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, resume=True, **options)
+
+    with open(path, "rb") as f:
+        assert published(mock)[0]["bundles"]["a"] == hashlib.md5(f.read()).hexdigest()
+
+    # the changed bundle is uploaded into the bundle created for it before, no other record is left behind
+    assert sorted(bundle["name"] for bundle in mock.state.new_bundles.values()) == ["a", "b"]
+    assert mock.state.count("PUT", "/admin/service/upload") == 3
+
+
+def test_identical_payloads_are_copied_instead_of_uploaded(mock, bundles, options):
+    payload = os.urandom(256 * 1024)
+    first = bundles.config("first.json", {"x": bundles.file("x.bin", payload), "y": bundles.file("y.bin", payload)})
+    second = bundles.config("second.json", {"q": bundles.file("q.bin", payload)})
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", first, **options)
+    deployer.deploy(mock.environment_location, "other", "1.0", "root", second, **options)
+
+    # the payload is uploaded once, every other bundle with it is copied on the server
+    assert mock.state.count("PUT", "/admin/service/upload") == 1
+    assert [args["method"] for method, path, args in mock.state.requests
+            if path == "/admin/api" and args.get("method") == "copy"] == ["copy", "copy"]
+    assert sorted(bundle["name"] for bundle in mock.state.new_bundles.values() if bundle["hash"]) == ["q", "x", "y"]
+
+
+@pytest.mark.mock(copy=False)
+def test_identical_payloads_are_uploaded_without_server_copies(mock, bundles, options):
+    payload = os.urandom(256 * 1024)
+    first = bundles.config("first.json", {"x": bundles.file("x.bin", payload)})
+    second = bundles.config("second.json", {"q": bundles.file("q.bin", payload)})
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", first, **options)
+    deployer.deploy(mock.environment_location, "other", "1.0", "root", second, **options)
+
+    assert mock.state.count("PUT", "/admin/service/upload") == 2
@@ -0,0 +1,48 @@
+import hashlib
+
+import pytest
+
+from anthill_tools.admin.game import deployer
+from anthill_tools.mock import MockAnthill
+
+
+def target(location, version="1.0"):
+    return {"environment": location, "name": "test", "version": version, "gamespace": "root"}
+
+
+def test_build_reaches_every_target(mock, bundles, game_options):
+    data = bundles.file("build.zip", size=256 * 1024)
+
+    with MockAnthill() as other:
+        targets = deployer.deploy_many([
+            target(mock.environment_location), target(mock.environment_location, "2.0"),
+            target(other.environment_location)
+        ], data, "true", jobs=2, **game_options)
+
+        other_builds = other.state.game_builds[("test", "1.0")]
+
+    with open(data, "rb") as f:
+        md5 = hashlib.md5(f.read()).hexdigest()
+
+    assert all(target.error is None for target in targets)
+    assert [build["hash"] for build in mock.state.game_builds[("test", "1.0")]] == [md5]
+    assert [build["hash"] for build in mock.state.game_builds[("test", "2.0")]] == [md5]
+    assert [build["hash"] for build in other_builds] == [md5]
+
+
+def test_failed_target_does_not_stop_the_others(mock, bundles, game_options):
+    data = bundles.file("build.zip")
+    targets = [deployer.Target.parse(target(location)) for location in (mock.environment_location,
+                                                                        "http://127.0.0.1:1/environment")]
+
+    with pytest.raises(deployer.DeliverError, match="1 of 2"):
+        deployer.deploy_many(targets, data, "true", retries=0, **game_options)
+
+    assert targets[0].error is None
+    assert targets[1].error.startswith("init failed")
+    assert len(mock.state.game_builds[("test", "1.0")]) == 1
+
+
+def test_target_without_environment():
+    with pytest.raises(deployer.DeliverError, match="environment"):
+        deployer.Target.parse({"name": "test", "version": "1.0", "gamespace": "root"})
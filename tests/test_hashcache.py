@@ -0,0 +1,73 @@
+import os
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.admin.dlc.hashcache import HashCache
+
+
+def cached(path, location):
+    cache = HashCache(location)
+    cache.load()
+    return cache.get(path, os.stat(path))
+
+
+def test_hashes_are_reused_between_deploys(mock, bundles, options, tmp_path, monkeypatch):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin"), "b": bundles.file("b.bin")})
+    options = dict(options, hash_cache=str(tmp_path / "hash_cache.json"), content_store=False)
+    digest = deployer.digest
+    hashed = []
+
+    def recording(file_name, names=("md5",)):
+        hashed.append(os.path.basename(file_name))
+        return digest(file_name, names)
+
+    monkeypatch.setattr(deployer, "digest", recording)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+
+    assert sorted(hashed) == ["a.bin", "b.bin"]
+
+
+def test_metadata_changes_keep_the_hash(bundles, tmp_path):
+    path = bundles.file("a.bin")
+    location = str(tmp_path / "hash_cache.json")
+    cache = HashCache(location)
+    cache.put(path, os.stat(path), {"md5": "hash"})
+    cache.save()
+
+    # changes only the ctime
+    os.chmod(path, 0o600)
+
+    assert cached(path, location) == {"md5": "hash"}
+
+
+def test_changed_file_is_hashed_again(bundles, tmp_path):
+    path = bundles.file("a.bin")
+    location = str(tmp_path / "hash_cache.json")
+    cache = HashCache(location)
+    cache.put(path, os.stat(path), {"md5": "hash"})
+    cache.save()
+
+    with open(path, "ab") as f:
+        f.write(b"more")
+
+    assert cached(path, location) is None
+
+
+def test_missing_digests_are_not_cached(bundles, tmp_path):
+    path = bundles.file("a.bin")
+    cache = HashCache(str(tmp_path / "hash_cache.json"))
+    cache.put(path, os.stat(path), {"md5": "hash"})
+
+    assert cache.get(path, os.stat(path), ("md5", "blake2b")) is None
+
+
+def test_entries_of_removed_files_are_dropped(bundles, tmp_path):
+    path = bundles.file("a.bin")
+    location = str(tmp_path / "hash_cache.json")
+    cache = HashCache(location)
+    cache.put(path, os.stat(path), {"md5": "hash"})
+    os.remove(path)
+    cache.save()
+
+    assert cache.entries == {}
@@ -0,0 +1,65 @@
+from anthill_tools.admin.dlc.journal import DeployJournal
+
+
+class Bundle(object):
+    def __init__(self, name, hash_):
+        self.name = name
+        self.hash = hash_
+
+
+def test_steps_are_replayed_after_a_restart(tmp_path):
+    journal = DeployJournal("key", str(tmp_path))
+    journal.start(7)
+    journal.created(Bundle("a", "1"), 100)
+    journal.created(Bundle("b", "2"), 101)
+    journal.finished(Bundle("a", "1"), Bundle("c", "3"))
+
+    loaded = DeployJournal("key", str(tmp_path))
+    loaded.load()
+
+    assert loaded.data_id == 7
+    assert loaded.done(Bundle("a", "1")) and loaded.done(Bundle("c", "3"))
+    assert not loaded.done(Bundle("b", "2"))
+    assert loaded.bundle_id(Bundle("b", "2")) == 101
+
+    # compacted to one line per bundle
+    with open(loaded.location) as f:
+        assert len(f.readlines()) == 4
+
+
+def test_torn_lines_are_skipped(tmp_path):
+    journal = DeployJournal("key", str(tmp_path))
+    journal.start(7)
+    journal.created(Bundle("a", "1"), 100)
+
+    with open(journal.location, "a") as f:
+        f.write('{"name": "b", "ha')
+
+    loaded = DeployJournal("key", str(tmp_path))
+    loaded.load()
+    assert loaded.bundle_id(Bundle("a", "1")) == 100
+    assert loaded.entry(Bundle("b", "2")) is None
+
+
+def test_changed_bundles_keep_their_bundle_id(tmp_path):
+    journal = DeployJournal("key", str(tmp_path))
+    journal.start(7)
+    journal.created(Bundle("a", "1"), 100)
+    journal.finished(Bundle("a", "1"))
+
+    changed = Bundle("a", "2")
+    assert not journal.done(changed)
+    assert journal.bundle_id(changed) == 100
+
+    journal.finished(changed)
+    assert journal.done(changed) and not journal.done(Bundle("a", "1"))
+    assert journal.bundle_id(changed) == 100
+
+
+def test_other_versions_are_ignored(tmp_path):
+    journal = DeployJournal("key", str(tmp_path))
+    with open(journal.location, "w") as f:
+        f.write('{"version": 1, "data_id": 7}\n')
+
+    journal.load()
+    assert journal.data_id is None
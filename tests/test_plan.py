@@ -0,0 +1,54 @@
+import json
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.mock import MockAnthill
+from anthill_tools.plan import HostMeters, LinkStats
+from anthill_tools.trace import Event
+
+
+def upload(url, started, latency, size):
+    return Event("request", "PUT", started, latency, "trace", "span", method="PUT", url=url, bytes_out=size)
+
+
+def test_host_meters_keep_hosts_apart():
+    meters = HostMeters()
+    meters(upload("http://a:1/admin/service/upload", 0.0, 1.0, 4 * 1024 * 1024))
+    meters(upload("http://b:2/admin/service/upload", 0.0, 4.0, 4 * 1024 * 1024))
+    meters(Event("phase", "init", 0.0, 1.0, "trace", "span"))
+
+    assert meters.meter(["http://a:1/environment"]).throughput() == 4 * 1024 * 1024
+    assert meters.meter(["http://b:2/admin"]).throughput() == 1024 * 1024
+    assert meters.meter(["http://a:1/login", "http://b:2/admin"]).throughput() == 8 * 1024 * 1024 / 4
+    assert meters.meter(["http://c:3/admin"]).throughput() is None
+
+
+def test_plan_uploads_nothing(mock, bundles, options):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin"), "b": bundles.file("b.bin")})
+
+    plan = deployer.deploy(mock.environment_location, "test", "1.0", "root", config, plan=True, **options)
+
+    assert (plan.uploads, plan.upload_bytes) == (2, 2 * 64 * 1024)
+    assert not mock.state.count("PUT")
+    assert not mock.state.data_versions
+
+
+def test_deploy_many_stores_the_link_of_each_environment(bundles, tmp_path):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin", size=2 * 1024 * 1024)})
+    link_stats = str(tmp_path / "link.json")
+
+    with MockAnthill() as fast, MockAnthill(bandwidth=2 * 1024 * 1024) as slow:
+        deployer.deploy_many([
+            {"environment": server.environment_location, "name": "test", "version": "1.0", "gamespace": "root",
+             "config": config} for server in (fast, slow)
+        ], username="test", password="test", service_cache=False, token_cache=False, hash_cache=False,
+            content_store=False, journal=str(tmp_path / "deploys"), link_stats=link_stats)
+
+        stats = LinkStats(link_stats)
+        fast_throughput = stats.get(fast.environment_location)["throughput"]
+        slow_throughput = stats.get(slow.environment_location)["throughput"]
+
+    assert slow_throughput < 3 * 1024 * 1024
+    assert fast_throughput > 2 * slow_throughput
+
+    with open(link_stats) as f:
+        assert len(json.load(f)) == 2
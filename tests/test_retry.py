@@ -0,0 +1,66 @@
+import pytest
+
+from anthill_tools import ServiceError, configure_retry, retry_policy
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.admin.game import deployer as game_deployer
+
+
+UPLOAD = "/admin/service/upload"
+
+
+@pytest.mark.mock(error_rate=0.4, error_methods=("PUT",), seed=1)
+def test_bundle_uploads_are_retried(mock, bundles, options):
+    config = bundles.config("config.json", {name: bundles.file(name + ".bin") for name in "abcdef"})
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, retries=10, **options)
+
+    assert mock.state.errors
+    assert mock.state.count("PUT", UPLOAD) == 6 + mock.state.errors
+
+
+@pytest.mark.mock(error_rate=1.0, error_methods=("PUT",))
+def test_game_builds_are_not_uploaded_twice(mock, bundles, game_options):
+    build = bundles.file("build.zip")
+
+    with pytest.raises(ServiceError) as error:
+        game_deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", retries=5,
+                             **game_options)
+
+    # the server may have stored the build before the error, so it is not sent again
+    assert error.value.code == 503
+    assert mock.state.count("PUT", UPLOAD) == 1
+
+
+@pytest.mark.mock(error_rate=1.0, error_methods=("POST",))
+def test_authentication_is_not_repeated_once_sent(mock, bundles, game_options):
+    build = bundles.file("build.zip")
+
+    with pytest.raises(ServiceError):
+        game_deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", retries=5,
+                             **game_options)
+
+    assert mock.state.count("POST", "/login/auth") == 1
+
+
+@pytest.mark.mock(error_rate=0.5, error_methods=("PUT",), seed=2)
+def test_game_build_chunks_are_retried(mock, bundles, game_options):
+    build = bundles.file("build.zip", size=4 * 1024 * 1024)
+
+    game_deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true",
+                         chunk_size=1024 * 1024, chunk_retries=10, **game_options)
+
+    assert mock.state.errors
+    assert mock.state.count("PUT", UPLOAD) == 4 + mock.state.errors
+
+
+def test_deploys_keep_the_configured_policy(mock, bundles, options):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin")})
+    configure_retry(attempts=8, backoff=1, max_backoff=60, budget=600)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    policy = retry_policy()
+    assert (policy.attempts, policy.backoff, policy.max_backoff, policy.budget) == (8, 1, 60, 600)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, retries=2, **options)
+    assert retry_policy() is policy
+    assert (policy.attempts, policy.backoff, policy.max_backoff, policy.budget) == (2, 1, 60, 600)
@@ -0,0 +1,115 @@
+import io
+import json
+import time
+
+from anthill_tools import configure_bandwidth, scheduler
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.shaping import FIFO, LimitsFile, MAX_STARVATION, SMALLEST_FIRST, WEIGHTED, Scheduler, scheduled
+
+
+def waiting(shaper, *streams):
+    now = time.monotonic()
+    for order, stream in enumerate(streams):
+        stream.order = order
+        stream.asked = now
+    shaper.waiting = list(streams)
+    return now
+
+
+def test_unlimited_streams_do_not_wait():
+    shaper = Scheduler()
+    stream = shaper.stream("a", 10 * 1024 * 1024)
+
+    started = time.monotonic()
+    for _ in range(40):
+        stream.consume(256 * 1024)
+
+    assert time.monotonic() - started < 0.5
+    assert stream.sent == 10 * 1024 * 1024
+    assert not shaper.shaping
+
+
+def test_global_rate_is_kept():
+    shaper = Scheduler(rate=2 * 1024 * 1024)
+    stream = shaper.stream("a", 1024 * 1024)
+
+    started = time.monotonic()
+    for _ in range(4):
+        stream.consume(256 * 1024)
+    stream.close()
+
+    assert time.monotonic() - started >= 0.35
+    assert shaper.transfers == [stream]
+    assert stream.waited > 0
+
+
+def test_policies_pick_the_next_stream():
+    shaper = Scheduler(rate=1024, policy=SMALLEST_FIRST)
+    big, small = shaper.stream("big", 1000), shaper.stream("small", 10)
+    heavy = shaper.stream("heavy", 1000, weight=10)
+    big.sent, heavy.sent = 100, 100
+    now = waiting(shaper, big, small, heavy)
+
+    assert shaper.next(now) is small
+
+    shaper.configure(1024, policy=WEIGHTED)
+    assert shaper.next(now) is small
+    small.sent = 50
+    assert shaper.next(now) is heavy
+
+    shaper.configure(1024, policy=FIFO)
+    assert shaper.next(now) is big
+
+
+def test_starving_streams_go_first():
+    shaper = Scheduler(rate=1024)
+    big, small = shaper.stream("big", 1000), shaper.stream("small", 10)
+    now = waiting(shaper, big, small)
+    big.asked = now - MAX_STARVATION - 1
+
+    assert shaper.next(now) is big
+
+
+def test_limits_file(tmp_path):
+    shaper = Scheduler()
+    location = tmp_path / "limits.json"
+    limits = LimitsFile(shaper, str(location))
+
+    location.write_text(json.dumps({"bandwidth": 2, "stream_bandwidth": 1, "schedule": "fifo"}))
+    limits.check()
+    assert (shaper.rate, shaper.stream_rate, shaper.policy) == (2 * 1024 * 1024, 1024 * 1024, FIFO)
+
+    location.write_text("not json")
+    limits.modified = None
+    limits.check()
+    assert shaper.rate == 2 * 1024 * 1024
+
+
+def test_scheduled_bodies_count_what_they_pass_on():
+    stream = Scheduler().stream("a", 1000)
+
+    blocks = scheduled(b"x" * 1000, stream)
+    assert [len(piece) for piece in blocks] == [1000]
+    assert blocks.sent_bytes == 1000 and len(blocks) == 1000
+
+    reader = scheduled(io.BytesIO(b"x" * 1000), stream)
+    assert len(reader) == 1000
+    assert reader.read(600) and reader.read() and not reader.read()
+    assert reader.sent_bytes == 1000
+
+    reader.rewind()
+    assert reader.sent_bytes == 0 and reader.read() == b"x" * 1000
+
+
+def test_deploys_keep_the_limits_of_the_process(mock, bundles, options):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin")})
+    configure_bandwidth(rate=1 << 30, policy=WEIGHTED)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    assert (scheduler().rate, scheduler().policy) == (1 << 30, WEIGHTED)
+    assert len(scheduler().transfers) == 1
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, bandwidth=1 << 29,
+                    **dict(options, content_store=False))
+    assert scheduler().rate == 1 << 29
+    assert not scheduler().transfers
@@ -0,0 +1,60 @@
+import json
+import time
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.admin.dlc.store import ContentStore
+
+
+def test_default_key_needs_no_extra_hash(mock, bundles, options, monkeypatch):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin"), "b": bundles.file("b.bin")})
+    digest = deployer.digest
+    hashed = []
+
+    def recording(file_name, names=("md5",)):
+        hashed.append(tuple(names))
+        return digest(file_name, names)
+
+    monkeypatch.setattr(deployer, "digest", recording)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+
+    assert hashed == [("md5",), ("md5",)]
+
+
+def test_known_payload_is_copied(mock, bundles, options):
+    path = bundles.file("a.bin")
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", bundles.config("first.json", {"a": path}),
+                    **options)
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", bundles.config("second.json", {"c": path}),
+                    **options)
+
+    assert mock.state.count("PUT", "/admin/service/upload") == 1
+    published = [data for data in mock.state.data_versions.values() if data["published"]]
+    assert list(published[-1]["bundles"]) == ["c"]
+
+
+def test_old_payloads_are_pruned(tmp_path):
+    location = str(tmp_path / "content.json")
+    store = ContentStore(location, max_age=60)
+    store.deployed("md5:old", "old", 1, "http://a", "test", "old")
+    store.deployed("md5:new", "new", 1, "http://a", "test", "new")
+    store.entries["md5:old"]["deployed"] = time.time() - 120
+    store.save()
+
+    with open(location) as f:
+        assert list(json.load(f)["entries"]) == ["md5:new"]
+
+
+def test_only_recent_payloads_are_kept(tmp_path):
+    location = str(tmp_path / "content.json")
+    store = ContentStore(location, max_entries=2)
+    for index in range(4):
+        store.deployed("md5:{0}".format(index), str(index), 1, "http://a", "test", str(index))
+        store.entries["md5:{0}".format(index)]["deployed"] = 1000 + index
+    store.max_age = None
+    store.save()
+
+    loaded = ContentStore(location, max_age=None)
+    loaded.load()
+    assert sorted(loaded.entries) == ["md5:2", "md5:3"]
@@ -0,0 +1,56 @@
+import os
+import stat
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.tokens import TokenStore
+
+
+def authentications(mock):
+    return mock.state.count("POST", "/login/auth")
+
+
+def test_token_is_reused_between_deploys(mock, bundles, options, tmp_path):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin")})
+    options = dict(options, token_cache=TokenStore(str(tmp_path / "tokens.json")))
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+
+    assert authentications(mock) == 1
+
+
+def test_expired_token_is_replaced(mock, bundles, options, tmp_path):
+    config = bundles.config("config.json", {"a": bundles.file("a.bin")})
+    store = TokenStore(str(tmp_path / "tokens.json"))
+    options = dict(options, token_cache=store)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+    mock.state.expire_tokens()
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, **options)
+
+    assert authentications(mock) == 2
+    assert [entry["token"] for entry in store.read().values()] == [next(iter(mock.state.tokens))]
+
+
+def test_key_ignores_secrets():
+    first = TokenStore.key("http://env", "root", "dev", "test", ["admin"], {"username": "test", "key": "one"})
+    second = TokenStore.key("http://env", "root", "dev", "test", ["admin"], {"username": "test", "key": "two"})
+
+    assert first == second
+    assert "one" not in first
+
+
+def test_tokens_close_to_expiry_are_not_used(tmp_path):
+    store = TokenStore(str(tmp_path / "tokens.json"))
+    store.put("soon", "token", expires_in=30)
+    store.put("later", "token", expires_in=3600)
+
+    assert store.get("soon") is None
+    assert TokenStore(store.location).get("later") == "token"
+
+
+def test_store_is_private(tmp_path):
+    store = TokenStore(str(tmp_path / "tokens" / "tokens.json"))
+    store.put("key", "token")
+
+    assert stat.S_IMODE(os.stat(store.location).st_mode) == 0o600
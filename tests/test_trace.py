@@ -0,0 +1,35 @@
+import pytest
+
+from anthill_tools.admin.dlc import deployer
+from anthill_tools.admin.game import deployer as game_deployer
+
+
+@pytest.mark.parametrize("compression, bandwidth", [
+    (None, None), ("gzip", None), (None, 1 << 30), ("gzip", 1 << 30)])
+def test_traced_bytes_match_the_bytes_received(mock, bundles, options, compression, bandwidth):
+    config = bundles.config("config.json", {
+        "text": bundles.file("text.bin", b"compressible " * 100000),
+        "random": bundles.file("random.bin")
+    })
+    events = []
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", config, compression=compression,
+                    bandwidth=bandwidth, trace=[events.append], **options)
+
+    requests = [event for event in events if event.kind == "request"]
+    uploads = [event for event in requests if event.method == "PUT"]
+
+    assert len(uploads) == 2
+    assert all(event.bytes_out for event in uploads)
+    assert sum(event.bytes_out for event in requests) == mock.state.received_bytes
+
+
+def test_traced_bytes_of_chunked_uploads(mock, bundles, game_options):
+    build = bundles.file("build.zip", size=3 * 1024 * 1024 + 5)
+    events = []
+
+    game_deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", chunk_size=1024 * 1024,
+                         bandwidth=1 << 30, trace=[events.append], **game_options)
+
+    uploads = [event for event in events if event.kind == "request" and event.method == "PUT"]
+    assert [event.bytes_out for event in uploads] == [1024 * 1024] * 3 + [5]
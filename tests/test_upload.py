@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+import pytest
+
+from anthill_tools import Admin, ServiceError
+from anthill_tools.admin.game import deployer
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def leftover(location):
+    return os.listdir(location) if os.path.isdir(location) else []
+
+
+def builds(mock):
+    return mock.state.game_builds[("test", "1.0")]
+
+
+def test_chunked_upload(mock, bundles, game_options):
+    build = bundles.file("build.zip", size=3 * CHUNK_SIZE + 10)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", chunk_size=CHUNK_SIZE,
+                    **game_options)
+
+    assert mock.state.count("PUT") == 4
+    assert [entry["size"] for entry in builds(mock)] == [3 * CHUNK_SIZE + 10]
+    assert not leftover(game_options["upload_state"])
+
+
+def test_interrupted_upload_resumes(mock, bundles, game_options, monkeypatch):
+    build = bundles.file("build.zip", size=4 * CHUNK_SIZE)
+    api_put = Admin.api_put
+    calls = []
+
+    def failing(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise ServiceError(400, "Interrupted")
+        return api_put(self, *args, **kwargs)
+
+    monkeypatch.setattr(Admin, "api_put", failing)
+
+    with pytest.raises(ServiceError):
+        deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", chunk_size=CHUNK_SIZE,
+                        **game_options)
+
+    monkeypatch.setattr(Admin, "api_put", api_put)
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", chunk_size=CHUNK_SIZE,
+                    **game_options)
+
+    # two chunks before the failure, the other two after it
+    assert mock.state.count("PUT") == 4
+    assert [entry["size"] for entry in builds(mock)] == [4 * CHUNK_SIZE]
+
+
+@pytest.mark.mock(ranges=False)
+def test_server_without_ranges_gets_the_whole_file(mock, bundles, game_options):
+    data = os.urandom(3 * CHUNK_SIZE)
+    build = bundles.file("build.zip", data)
+
+    deployer.deploy(mock.environment_location, "test", "1.0", "root", build, "true", chunk_size=CHUNK_SIZE,
+                    **game_options)
+
+    # the first chunk was taken for the whole build, so it was replaced by the whole file right away
+    assert mock.state.count("PUT") == 2
+    assert builds(mock)[-1] == {"name": "build.zip", "hash": hashlib.md5(data).hexdigest(), "size": len(data)}
+    assert not leftover(game_options["upload_state"])